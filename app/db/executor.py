@@ -0,0 +1,28 @@
+"""
+Bounded worker threads for blocking work called from async handlers
+The synchronous SQLAlchemy Session (and boto3) block the calling thread, so async code hands that
+work to this pool instead of running it on the event loop. The pool is sized to the engine's
+connection pool (5 + 10 overflow by default) so waiting requests queue here rather than on connections
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+BLOCKING_THREADS = int(os.getenv("BLOCKING_THREADS", "15"))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run func(*args, **kwargs) on the bounded pool and await its result
+    A Session passed in must not be used concurrently; awaiting each call keeps use sequential
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
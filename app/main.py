@@ -1,5 +1,6 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -51,6 +52,9 @@ from app.routes import recommendations
 # Test routes
 from app.routes import test_email
 
+# Background order email sender
+from app.services.order_email_outbox import start_outbox_worker, stop_outbox_worker
+
 # Optional routers from integration branch (guarded so app won’t break if missing)
 try:
     from app.routes import admin_stock
@@ -68,7 +72,13 @@ except Exception as e:  # pragma: no cover
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("greencart")
 
-app = FastAPI(title="Green Cart API", version="1.2.2")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_outbox_worker()
+    yield
+    await stop_outbox_worker()
+
+app = FastAPI(title="Green Cart API", version="1.2.2", lifespan=lifespan)
 
 # Health check
 @app.get("/health")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, ForeignKey, Boolean, Text, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, ForeignKey, Boolean, Text, Enum, LargeBinary
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.database import Base
@@ -141,4 +141,39 @@ class ForecastingModelConfig(Base):
     is_active = Column(Boolean, default=True)
     
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class UserForecastState(Base):
+    """Online per-user forecast state, updated in O(1) on every order placed or cancelled"""
+    __tablename__ = "user_forecast_state"
+
+    user_id = Column(String(36), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    rated_order_count = Column(Integer, nullable=False, default=0)
+
+    # Time-decayed sums of order sustainability scores (0-100), expressed at reference_at
+    reference_at = Column(DateTime)
+    fast_weight = Column(Float, nullable=False, default=0.0)  # 30-day decay
+    fast_score_sum = Column(Float, nullable=False, default=0.0)
+    fast_score_sq_sum = Column(Float, nullable=False, default=0.0)
+    slow_weight = Column(Float, nullable=False, default=0.0)  # 90-day decay
+    slow_score_sum = Column(Float, nullable=False, default=0.0)
+    slow_score_sq_sum = Column(Float, nullable=False, default=0.0)
+
+    # Time-decayed sums of days between consecutive orders (90-day decay)
+    interval_weight = Column(Float, nullable=False, default=0.0)
+    interval_sum = Column(Float, nullable=False, default=0.0)
+    interval_sq_sum = Column(Float, nullable=False, default=0.0)
+    last_order_at = Column(DateTime)
+
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class CarbonScoreDistribution(Base):
+    """Periodically rebuilt distribution of per-user sustainability scores for cohort comparisons"""
+    __tablename__ = "carbon_score_distributions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_count = Column(Integer, nullable=False)
+    mean_score = Column(Float)
+    sorted_scores = Column(LargeBinary, nullable=False)  # Ascending little-endian float32 array, one score per user
+    built_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, func
+from sqlalchemy import Column, String, Integer, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from app.db.database import Base
 
@@ -8,5 +8,12 @@ class Cart(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String(36), nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # active (the user's current cart), ordered (checked out) or abandoned
+    status = Column(String(16), nullable=False, default="active", server_default="active")
 
     items = relationship("CartItem", back_populates="cart", cascade="all, delete")
+
+    __table_args__ = (
+        # At most one active cart per user, so the current cart is found without looking at orders
+        Index("ux_carts_user_active", "user_id", unique=True, postgresql_where=status == "active"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.db.database import Base
 
@@ -11,3 +11,8 @@ class CartItem(Base):
     quantity = Column(Integer, nullable=False)
 
     cart = relationship("Cart", back_populates="items")
+
+    __table_args__ = (
+        # One line per product per cart; the conflict target for adding to the cart
+        Index("ux_cart_items_cart_product", "cart_id", "product_id", unique=True),
+    )
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class OrderEmailOutbox(Base):
+    """Order email waiting to be sent, written in the same transaction as the order it describes"""
+    __tablename__ = "order_email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(32), nullable=False, default="order_confirmation")
+    status = Column(String(16), nullable=False, default="pending")  # pending, sent or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, server_default=func.now())
+    last_error = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_order_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, Numeric, ForeignKey, Index
+from app.db.database import Base
+
+class OrderLine(Base):
+    """Product, quantity and unit price as they were when the order was placed"""
+    __tablename__ = "order_lines"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(Integer, nullable=False)
+    retailer_id = Column(Integer)  # Copy of products.retailer_id for per-retailer revenue
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Numeric(10, 2), nullable=False)
+
+    __table_args__ = (
+        Index("ix_order_lines_order_id", "order_id"),
+        Index("ix_order_lines_product_id", "product_id"),
+        Index("ix_order_lines_retailer_id", "retailer_id"),
+    )
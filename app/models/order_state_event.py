@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class OrderStateEvent(Base):
+    """One order state transition, written in the transaction that made it"""
+    __tablename__ = "order_state_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(String(36), nullable=False)
+    from_state = Column(String(32), nullable=False)
+    to_state = Column(String(32), nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_order_state_events_order_created", "order_id", "created_at"),
+    )
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, Numeric, Float, Boolean, ForeignKey, DateTime, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class OrderSustainabilitySummary(Base):
+    """Per-order rollup of value, item count and average sustainability, written when the order is placed"""
+    __tablename__ = "order_sustainability_summary"
+
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(String(36), nullable=False)
+    order_created_at = Column(DateTime, nullable=False)  # Copy of orders.created_at for per-user range scans
+    cancelled = Column(Boolean, nullable=False, default=False)
+
+    order_value = Column(Numeric(12, 2), nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+    avg_sustainability = Column(Float)  # Average rating value across the order's products, NULL when unrated
+
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_order_sustainability_summary_user_created", "user_id", "order_created_at"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum
+from sqlalchemy import Column, Integer, String, Numeric, ForeignKey, DateTime, Enum
 from sqlalchemy.sql import func
 from app.db.database import Base
 from sqlalchemy.orm import relationship
@@ -11,5 +11,6 @@ class Order(Base):
     cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False)
     state = Column(Enum("Preparing Order", "Ready for Delivery", "In Transit", "Delivered", "Cancelled", name="order_state"), nullable=False)
     created_at = Column(DateTime, server_default=func.now())
+    total_amount = Column(Numeric(12, 2))  # Sum of the order's lines at purchase prices
 
     user = relationship("User", back_populates="orders")
\ No newline at end of file
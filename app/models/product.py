@@ -12,6 +12,8 @@ class Product(Base):
     price = Column(Numeric(10, 2))
     in_stock = Column(Boolean)
     quantity = Column(Integer)
+    # Units held by carts (sum of stock_holds.quantity); available = quantity - reserved_quantity
+    reserved_quantity = Column(Integer, nullable=False, default=0, server_default="0")
     brand = Column(Text)
     category_id = Column(Integer, ForeignKey("categories.id"))
     retailer_id = Column(Integer, ForeignKey("retailer_information.id"))
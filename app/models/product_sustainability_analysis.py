@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class ProductSustainabilityAnalysis(Base):
+    """Pre-generated Q2 sustainability analysis per product, valid while content_hash matches"""
+    __tablename__ = "product_sustainability_analyses"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = Column(String(64), nullable=False)  # Hash of the product fields used in the prompt
+    analysis = Column(Text, nullable=False)
+    model_used = Column(String(64))
+    generated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, Float, DateTime, JSON
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class StockDriftRun(Base):
+    """One full stock reconciliation: how many products had in_stock out of step with quantity, and which"""
+    __tablename__ = "stock_drift_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_at = Column(DateTime, server_default=func.now(), nullable=False, index=True)
+    drifted_count = Column(Integer, nullable=False, default=0)
+    marked_in_stock = Column(Integer, nullable=False, default=0)
+    marked_out_of_stock = Column(Integer, nullable=False, default=0)
+    product_ids = Column(JSON)  # Drifted product ids, capped at STOCK_DRIFT_MAX_RECORDED_IDS
+    chunks = Column(Integer, nullable=False, default=0)
+    elapsed_seconds = Column(Float)
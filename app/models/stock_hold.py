@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class StockHold(Base):
+    """Stock set aside for a cart line until it expires, is released or is converted at checkout"""
+    __tablename__ = "stock_holds"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ux_stock_holds_cart_product", "cart_id", "product_id", unique=True),
+        Index("ix_stock_holds_product_expires", "product_id", "expires_at"),
+        Index("ix_stock_holds_expires", "expires_at"),
+    )
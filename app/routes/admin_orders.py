@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from app.db.session import get_db 
-from app.schemas.admin import AdminOrderOverviewRequest, AdminOrderOverviewResponse, AdminOrderListResponse, AdminMonthlyOrdersResponse, AdminRevenueOverviewResponse, AdminTotalRevenueResponse, SetOrderStateResponse, SetOrderStateRequest
-from app.services.admin_overview_services import get_orders_overview, get_orders_list, get_monthly_orders, get_revenue_overview, get_total_revenue, change_order_state
+from app.schemas.admin import AdminOrderOverviewRequest, AdminOrderOverviewResponse, AdminOrderListResponse, AdminMonthlyOrdersResponse, AdminRevenueOverviewResponse, AdminTotalRevenueResponse, SetOrderStateResponse, SetOrderStateRequest, BulkSetOrderStateRequest, BulkSetOrderStateResponse
+from app.services.admin_overview_services import get_orders_overview, get_orders_list, get_monthly_orders, get_revenue_overview, get_total_revenue, change_order_state, bulk_change_order_state
 
 router = APIRouter(prefix="/admin/orders", tags=["Admin"])
 
@@ -28,4 +28,8 @@ def get_total_revenue_endpoint(db: Session = Depends(get_db)):
 
 @router.post('/setOrderState', response_model=SetOrderStateResponse)
 def set_order_state(request: SetOrderStateRequest, db:Session = Depends(get_db)):
-    return change_order_state(request, db)
\ No newline at end of file
+    return change_order_state(request, db)
+
+@router.post('/bulkSetOrderState', response_model=BulkSetOrderStateResponse)
+def bulk_set_order_state(request: BulkSetOrderStateRequest, db:Session = Depends(get_db)):
+    return bulk_change_order_state(request, db)
\ No newline at end of file
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from app.db.session import get_db
 from app.utilities.stock_utils import sync_stock_status
+from app.services.stock_reconciliation import reconcile_stock_status, get_stock_drift_history
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -9,14 +10,27 @@ router = APIRouter(prefix="/admin", tags=["Admin"])
 def sync_all_stock_status(db: Session = Depends(get_db)):
     """
     Admin endpoint to sync stock status for all products.
-    This will update the in_stock field based on actual quantity values.
+    This will update the in_stock field based on actual quantity values, in id-range chunks,
+    and record the drift it corrected.
     """
-    updated_count = sync_stock_status(db)
+    totals = reconcile_stock_status(db)
     
     return {
         "status": 200,
-        "message": f"Stock status synchronized for {updated_count} products",
-        "updated_count": updated_count
+        "message": f"Stock status synchronized for {totals['drifted_count']} products",
+        "updated_count": totals["drifted_count"],
+        **totals
+    }
+
+@router.get("/stock-drift")
+def stock_drift_history(limit: int = Query(20, ge=1, le=200), db: Session = Depends(get_db)):
+    """
+    Admin endpoint listing recent full stock reconciliations and the products each corrected.
+    """
+    return {
+        "status": 200,
+        "message": "Success",
+        "runs": get_stock_drift_history(db, limit)
     }
 
 @router.post("/sync-stock-status/{product_id}")
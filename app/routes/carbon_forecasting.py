@@ -12,9 +12,11 @@ from datetime import datetime
 from app.db.session import get_db
 from app.services.carbon_forecasting import (
     generate_carbon_forecast,
+    generate_state_forecast,
     get_user_carbon_insights,
     update_forecast_accuracy
 )
+from app.services.forecast_cache import get_cached
 from app.schemas.carbon_forecasting import (
     GenerateForecastRequest, GenerateForecastResponse,
     GetUserInsightsRequest, GetUserInsightsResponse,
@@ -67,12 +69,12 @@ async def update_forecast_accuracy_endpoint(
 ):
 
     try:
-        await update_forecast_accuracy(request.forecast_id, request.actual_sustainability_score, db)
+        accuracy = await update_forecast_accuracy(request.forecast_id, request.actual_sustainability_score, db)
         
         return UpdateForecastAccuracyResponse(
             status="success",
             message="Forecast accuracy logged",
-            accuracy_percentage=85.0  # Placeholder
+            accuracy_percentage=accuracy
         )
             
     except Exception as e:
@@ -86,102 +88,125 @@ async def quick_forecast(
     db: Session = Depends(get_db)
 ):
 
-    try:
-        result = await generate_carbon_forecast(user_id, days, db)
-        
+    async def compute(session: Session):
+        result = await generate_carbon_forecast(user_id, days, session, reuse_stored=True)
         return {
             "predicted_sustainability_score": result["forecast"]["predicted_sustainability_score"],
             "improvement_potential": result["forecast"]["improvement_potential"],
             "confidence": result["forecast"]["confidence_score"],
             "trend": result["forecast"]["trend_direction"]
         }
+
+    try:
+        # Polled by the dashboard widget; served from the per-user cache
+        return await get_cached("quick_forecast", user_id, days, compute, db)
         
     except Exception as e:
         logger.error(f"Error in quick forecast: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/user-score/{user_id}")
-async def get_user_carbon_score(
+@router.get("/state-forecast/{user_id}")
+async def state_forecast(
     user_id: str = Path(..., description="User ID"),
+    days: int = Query(30, ge=1, le=365, description="Forecast horizon in days"),
     db: Session = Depends(get_db)
 ):
+
     try:
-        insights = await get_user_carbon_insights(user_id, db)
-        
-        if not insights.get("shopping_patterns"):
-            return {"score": 50, "level": "Beginner", "message": "Start shopping to get your score"}
-        
-        patterns = insights["shopping_patterns"]
-        forecast = insights.get("latest_forecast", {})
-        
-        # Calculate composite score using accurate 0-100 scoring system
-        # Eco consciousness (30 points max) - based on actual sustainability ratings
-        eco_base = patterns.get("eco_consciousness_score", 50)
-        eco_score = min(30, (eco_base / 100) * 30)  # Scale to 30 points max
-        
-        # Trend score (25 points max) - sustainability improvement trend
-        trend_raw = patterns.get("sustainability_trend_30d", 0)
-        if trend_raw > 10:
-            trend_score = 25  # Excellent positive trend
-        elif trend_raw > 5:
-            trend_score = 20  # Good positive trend
-        elif trend_raw > 0:
-            trend_score = 15  # Slight positive trend
-        elif trend_raw >= -5:
-            trend_score = 10  # Stable/slight decline
-        else:
-            trend_score = 5   # Significant decline
-        
-        # Efficiency score (25 points max) - based on order frequency and value
-        avg_orders_per_week = patterns.get("avg_orders_per_week", 0)
-        if avg_orders_per_week > 0:
-            # Reward consistent but not excessive shopping
-            if 1 <= avg_orders_per_week <= 3:
-                efficiency_score = 25  # Optimal frequency
-            elif avg_orders_per_week <= 5:
-                efficiency_score = 20  # Good frequency
-            elif avg_orders_per_week <= 7:
-                efficiency_score = 15  # High frequency
-            else:
-                efficiency_score = 10   # Excessive shopping
-        else:
-            efficiency_score = 5  # Minimal score for no shopping data
-        
-        # Consistency score (20 points max) - based on forecast confidence and achievement rate
-        confidence = forecast.get("confidence", 0)
-        achievement_rate = patterns.get("goals_achievement_rate", 0)
-        consistency_score = min(20, (confidence * 10) + (achievement_rate * 10))  # Both contribute to consistency
+        return await generate_state_forecast(user_id, days, db)
         
-        total_score = eco_score + trend_score + efficiency_score + consistency_score
-        
-        # More stringent level thresholds
-        if total_score >= 85:
-            level = "Sustainability Champion"
-        elif total_score >= 70:
-            level = "Eco Warrior" 
-        elif total_score >= 55:
-            level = "Green Learner"
-        elif total_score >= 35:
-            level = "Getting Started"
+    except Exception as e:
+        logger.error(f"Error in state forecast: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _carbon_score(insights: dict) -> dict:
+    """Composite 0-100 sustainability score and level from a user's insights"""
+    if not insights.get("shopping_patterns"):
+        return {"score": 50, "level": "Beginner", "message": "Start shopping to get your score"}
+    
+    patterns = insights["shopping_patterns"]
+    forecast = insights.get("latest_forecast", {})
+    
+    # Calculate composite score using accurate 0-100 scoring system
+    # Eco consciousness (30 points max) - based on actual sustainability ratings
+    eco_base = patterns.get("eco_consciousness_score", 50)
+    eco_score = min(30, (eco_base / 100) * 30)  # Scale to 30 points max
+    
+    # Trend score (25 points max) - sustainability improvement trend
+    trend_raw = patterns.get("sustainability_trend_30d", 0)
+    if trend_raw > 10:
+        trend_score = 25  # Excellent positive trend
+    elif trend_raw > 5:
+        trend_score = 20  # Good positive trend
+    elif trend_raw > 0:
+        trend_score = 15  # Slight positive trend
+    elif trend_raw >= -5:
+        trend_score = 10  # Stable/slight decline
+    else:
+        trend_score = 5   # Significant decline
+    
+    # Efficiency score (25 points max) - based on order frequency and value
+    avg_orders_per_week = patterns.get("avg_orders_per_week", 0)
+    if avg_orders_per_week > 0:
+        # Reward consistent but not excessive shopping
+        if 1 <= avg_orders_per_week <= 3:
+            efficiency_score = 25  # Optimal frequency
+        elif avg_orders_per_week <= 5:
+            efficiency_score = 20  # Good frequency
+        elif avg_orders_per_week <= 7:
+            efficiency_score = 15  # High frequency
         else:
-            level = "Needs Improvement"
-        
-        return {
-            "score": round(total_score, 1),
-            "level": level,
-            "breakdown": {
-                "eco_consciousness": round(eco_score, 1),
-                "sustainability_trend": round(trend_score, 1),
-                "efficiency": round(efficiency_score, 1),
-                "consistency": round(consistency_score, 1)
-            },
-            "criteria": {
-                "eco_consciousness": "40% - Based on sustainability ratings of purchased products",
-                "sustainability_trend": "25% - 30-day sustainability improvement trend",
-                "efficiency": "20% - Shopping frequency and value optimization", 
-                "consistency": "15% - Goal achievement and forecast reliability"
-            }
+            efficiency_score = 10   # Excessive shopping
+    else:
+        efficiency_score = 5  # Minimal score for no shopping data
+    
+    # Consistency score (20 points max) - based on forecast confidence and achievement rate
+    confidence = forecast.get("confidence", 0)
+    achievement_rate = patterns.get("goals_achievement_rate", 0)
+    consistency_score = min(20, (confidence * 10) + (achievement_rate * 10))  # Both contribute to consistency
+    
+    total_score = eco_score + trend_score + efficiency_score + consistency_score
+    
+    # More stringent level thresholds
+    if total_score >= 85:
+        level = "Sustainability Champion"
+    elif total_score >= 70:
+        level = "Eco Warrior" 
+    elif total_score >= 55:
+        level = "Green Learner"
+    elif total_score >= 35:
+        level = "Getting Started"
+    else:
+        level = "Needs Improvement"
+    
+    return {
+        "score": round(total_score, 1),
+        "level": level,
+        "breakdown": {
+            "eco_consciousness": round(eco_score, 1),
+            "sustainability_trend": round(trend_score, 1),
+            "efficiency": round(efficiency_score, 1),
+            "consistency": round(consistency_score, 1)
+        },
+        "criteria": {
+            "eco_consciousness": "40% - Based on sustainability ratings of purchased products",
+            "sustainability_trend": "25% - 30-day sustainability improvement trend",
+            "efficiency": "20% - Shopping frequency and value optimization", 
+            "consistency": "15% - Goal achievement and forecast reliability"
         }
+    }
+
+@router.get("/user-score/{user_id}")
+async def get_user_carbon_score(
+    user_id: str = Path(..., description="User ID"),
+    db: Session = Depends(get_db)
+):
+    async def compute(session: Session):
+        return _carbon_score(await get_user_carbon_insights(user_id, session))
+
+    try:
+        # Polled by the dashboard widget; served from the per-user cache
+        return await get_cached("user_score", user_id, 30, compute, db)
         
     except Exception as e:
         logger.error(f"Error calculating user score: {str(e)}")
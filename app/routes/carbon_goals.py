@@ -2,11 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from pydantic import BaseModel
+from typing import Dict, List, Optional
 from app.db.session import get_db
 from app.services.carbon_goals_service import (
     get_user_carbon_goals,
     set_carbon_goal,
     get_carbon_goal,
+    set_carbon_goals,
+    get_carbon_goals,
     get_user_carbon_data
 )
 
@@ -21,6 +24,14 @@ class GetCarbonGoalRequest(BaseModel):
     user_id: str
     month: int
 
+class SetCarbonGoalsRequest(BaseModel):
+    user_id: str
+    goals: Dict[int, float]  # month -> goal_value
+
+class GetCarbonGoalsRequest(BaseModel):
+    user_id: str
+    months: Optional[List[int]] = None  # All 12 months when omitted
+
 class GetCarbonDataRequest(BaseModel):
     user_id: str
 
@@ -39,6 +50,16 @@ async def get_goal(request: GetCarbonGoalRequest, db: Session = Depends(get_db))
     """Get carbon goal for a specific month"""
     return get_carbon_goal(request.user_id, request.month, db)
 
+@router.post("/carbon-goals/bulk-set")
+async def set_goals(request: SetCarbonGoalsRequest, db: Session = Depends(get_db)):
+    """Set or update goals for several months at once (e.g. a yearly plan)"""
+    return set_carbon_goals(request.user_id, request.goals, db)
+
+@router.post("/carbon-goals/bulk-get")
+async def get_goals(request: GetCarbonGoalsRequest, db: Session = Depends(get_db)):
+    """Get goals for several months at once"""
+    return get_carbon_goals(request.user_id, db, request.months)
+
 @router.post("/carbon-data")
 async def get_carbon_data(request: GetCarbonDataRequest, db: Session = Depends(get_db)):
     """Get complete carbon footprint data for user including monthly footprints and goals"""
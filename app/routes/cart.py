@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db.session import get_db  # adjust if your db file has a different name
-from app.schemas.cart import CartItemCreate, CartOut
+from app.schemas.cart import CartItemCreate, CartOut, CartBatchUpdate, CartSummaryOut
 from app.services import cart as cart_service
 
 router = APIRouter(prefix="/cart", tags=["Cart"])
@@ -12,6 +12,11 @@ def add_to_cart(user_id: str, item: CartItemCreate, db: Session = Depends(get_db
     cart = cart_service.get_cart(db, user_id)
     return cart
 
+@router.patch("", response_model=CartSummaryOut)
+def update_cart(user_id: str, batch: CartBatchUpdate, db: Session = Depends(get_db)):
+    """Apply several line changes atomically and return the cart with its prices and totals"""
+    return cart_service.update_cart(db, user_id, batch.operations)
+
 @router.get("/{user_id}", response_model=CartOut)
 def view_cart(user_id: str, db: Session = Depends(get_db)):
     cart = cart_service.get_cart(db, user_id)
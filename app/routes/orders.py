@@ -4,12 +4,13 @@ from sqlalchemy.orm import Session
 from app.db.session import get_db
 from app.schemas.orders import (
     FetchAllOrdersRequest, FetchAllOrdersResponse,
+    FetchOrderHistoryRequest, FetchOrderHistoryResponse,
     FetchOrderByIdRequest, FetchOrderByIdResponse,
     CreateOrderRequest, CreateOrderResponse,
     CancelOrderRequest, CancelledOrderResponse
 )
 from app.services.orders_service import (
-    fetchAllOrders, fetchOrderById, createOrder, cancellOrder
+    fetchAllOrders, fetchOrderHistory, fetchOrderById, createOrder, cancellOrder
 )
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
@@ -18,6 +19,10 @@ router = APIRouter(prefix="/orders", tags=["Orders"])
 def fetch_all_orders(request: FetchAllOrdersRequest, db: Session = Depends(get_db)):
     return fetchAllOrders(request, db)
 
+@router.post("/getOrderHistory", response_model=FetchOrderHistoryResponse)
+def fetch_order_history(request: FetchOrderHistoryRequest, db: Session = Depends(get_db)):
+    return fetchOrderHistory(request, db)
+
 @router.post("/getOrderByID", response_model=FetchOrderByIdResponse)
 def fetch_order_by_id(request: FetchOrderByIdRequest, db: Session = Depends(get_db)):
     return fetchOrderById(request, db)
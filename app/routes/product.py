@@ -1,25 +1,12 @@
 from fastapi import APIRouter, Depends, Body
 from sqlalchemy.orm import Session
 from app.db.session import get_db
-from app.models.product import Product
-from app.models.orders import Order
-from app.models.cart import Cart
-from app.models.cart_item import CartItem
-from sqlalchemy import func
+from app.services.order_line_service import get_product_sales
 
 router = APIRouter(prefix="/products", tags=["Products"])
 @router.post("/sales_metrics")
 def get_product_sales_metrics(product_id: int = Body(...), db: Session = Depends(get_db)):
-    valid_states = ["Preparing Order", "Ready for Delivery", "In Transit", "Delivered"]
-    valid_order_cart_ids = db.query(Order.cart_id).filter(Order.state.in_(valid_states)).subquery()
-    cart_items = db.query(CartItem).filter(
-        CartItem.product_id == product_id,
-        CartItem.cart_id.in_(valid_order_cart_ids)
-    ).all()
-    units_sold = sum(item.quantity for item in cart_items)
-    product = db.query(Product).filter(Product.id == product_id).first()
-    price = float(product.price) if product and product.price else 0.0
-    revenue = sum(item.quantity * price for item in cart_items)
+    units_sold, revenue = get_product_sales(db, product_id)
     return {
         "status": 200,
         "message": "Success",
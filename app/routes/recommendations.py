@@ -3,18 +3,27 @@ FastAPI Routes for Smart-Compliant Recommendation Engine
 Provides fast algorithmic recommendations with OpenAI-powered sustainability Q&A
 """
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 import asyncio
+import json
 import logging
 import os
 from datetime import datetime
 
 from app.db.session import get_db
+from app.db.executor import run_blocking
 from app.services.recommendation_engine import get_recommendation_engine
-from app.services.openai_service import get_openai_service
+from app.services.openai_service import (
+    get_openai_service,
+    get_coalescing_metrics,
+    get_circuit_breaker_state,
+    LATENCY_BUDGETS
+)
 from app.services.product_service import fetchProduct
+from app.services.sustainability_analysis_service import get_stored_analysis
 from app.services.smart_structures import SmartLogger
 from app.models.product import Product
 from app.models.product_images import ProductImage
@@ -37,6 +46,185 @@ else:
 # Initialize services
 smart_logger = SmartLogger()
 
+# Disable proxy buffering so SSE events reach the client as they are produced
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_answer(chunks: AsyncIterator[Tuple[str, bool, Optional[str]]], payload: Dict[str, Any],
+                         openai_service=None) -> AsyncIterator[str]:
+    """
+    Relay a streamed answer as SSE: 'delta' events for tokens, a single 'answer' event
+    for cached answers, then a 'done' event carrying the full response payload
+    """
+    parts = []
+    model_used = None
+    try:
+        async for text, complete, model_used in chunks:
+            parts.append(text)
+            yield _sse_event("answer" if complete else "delta", {"text": text})
+    except Exception as e:
+        logger.error(f"Streaming answer failed: {e}")
+        yield _sse_event("error", {"status": 500, "detail": str(e)})
+        return
+
+    payload = {**payload, "answer": "".join(parts).strip()}
+    if openai_service is not None:
+        payload["degraded"] = openai_service.degraded
+        if "model_used" in payload:
+            payload["model_used"] = model_used
+    yield _sse_event("done", payload)
+
+
+async def _replay_answer(text: str) -> AsyncIterator[Tuple[str, bool, Optional[str]]]:
+    """Replay an already available answer as a single complete chunk"""
+    yield text, True, None
+
+
+async def _stream_explanation(sections: AsyncIterator[Dict[str, Any]], payload: Dict[str, Any],
+                              openai_service=None) -> AsyncIterator[str]:
+    """
+    Relay the 4 concurrently streamed /explain sections as SSE events tagged by section,
+    then a 'done' event carrying the combined explanation
+    """
+    answers: Dict[str, List[str]] = {}
+    async for item in sections:
+        section = item["section"]
+        if "error" in item:
+            answers[section] = [item["error"]]
+            yield _sse_event("error", {"section": section, "detail": item["error"]})
+            continue
+        answers.setdefault(section, []).append(item["text"])
+        event = "answer" if item["complete"] else "delta"
+        yield _sse_event(event, {"section": section, "text": item["text"]})
+
+    payload["ai_explanations"] = {section: "".join(parts).strip() for section, parts in answers.items()}
+    if openai_service is not None:
+        payload["ai_degraded"] = openai_service.degraded
+    yield _sse_event("done", {"status": 200, "data": payload})
+
+
+def _six_recommendations(db: Session, user_id: str) -> List[Dict[str, Any]]:
+    """Algorithmic recommendations padded to exactly 6 with real and fallback products (blocking DB work)"""
+    limit = 6
+    
+    # Get recommendation engine
+    engine = get_recommendation_engine(db)
+    
+    # Generate fast algorithmic recommendations
+    recommendations = engine.get_fast_recommendations(user_id, limit)
+    
+    # Ensure we ALWAYS have exactly 6 recommendations
+    while len(recommendations) < 6:
+        additional_needed = 6 - len(recommendations)
+        exclude_ids = []
+        for rec in recommendations:
+            # Handle both string and int product IDs
+            if hasattr(rec, 'product_id'):
+                exclude_ids.append(str(rec.product_id))
+            elif hasattr(rec, 'product_data') and rec.product_data.get('id'):
+                exclude_ids.append(str(rec.product_data['id']))
+        
+        # Try additional real products first
+        additional_recommendations = engine.get_additional_real_products(additional_needed, exclude_ids)
+        recommendations.extend(additional_recommendations)
+        
+        # If still not enough, use fallback to guarantee 6
+        if len(recommendations) < 6:
+            remaining_needed = 6 - len(recommendations)
+            fallback_recommendations = engine.get_fallback_recommendations(remaining_needed)
+            recommendations.extend(fallback_recommendations)
+            break  # Prevent infinite loop
+    
+    # Trim to exactly 6 recommendations
+    recommendations = recommendations[:6]
+    
+    # Final guarantee - if somehow we still don't have 6, create minimal ones
+    if len(recommendations) < 6:
+        logger.warning("Creating minimal recommendations to reach 6")
+        while len(recommendations) < 6:
+            minimal_rec = engine.create_minimal_recommendation(f"product_{len(recommendations) + 1}")
+            recommendations.append(minimal_rec)
+    
+    # Log final count
+    logger.info(f"Final recommendation count: {len(recommendations)} products (guaranteed 6)")
+    
+    # Convert to response format
+    response_data = []
+    for rec in recommendations:
+        rec_dict = rec.to_dict()
+        response_data.append(rec_dict)
+    return response_data
+
+
+def _recommendation_reasoning(db: Session, user_id: str, product_id: int, product):
+    """Algorithmic recommendation score and reasoning for one product (blocking DB work)"""
+    engine = get_recommendation_engine(db)
+    user_history = engine.get_user_purchase_history(user_id)
+    popularity_scores = engine.get_product_popularity_scores()
+    sustainability_scores = engine.get_sustainability_scores([product_id])
+    
+    # Calculate recommendation reasoning for this specific product
+    return engine.calculate_recommendation_score(
+        product, user_history, popularity_scores, sustainability_scores
+    )
+
+
+def _alternative_candidates(db: Session, product_id: int, category_id: int, current_price: float) -> List[Dict[str, Any]]:
+    """In-stock products from the same category, closest in price, with first image and rating (blocking DB work)"""
+    # Fetch candidate products (price-similar first), exclude the current product
+    candidates = (
+        db.query(Product)
+        .filter(
+            Product.category_id == category_id,
+            Product.id != product_id,
+            Product.in_stock == True,
+        )
+        .order_by(func.abs(Product.price - current_price))
+        .limit(30)
+        .all()
+    )
+
+    # Map first image per candidate
+    candidate_ids = [p.id for p in candidates]
+    images = []
+    if candidate_ids:
+        images = (
+            db.query(ProductImage)
+            .filter(ProductImage.product_id.in_(candidate_ids))
+            .order_by(ProductImage.product_id, ProductImage.id)
+            .all()
+        )
+    image_map = {}
+    for img in images:
+        if img.product_id not in image_map:
+            image_map[img.product_id] = img.image_url or "https://via.placeholder.com/300x300/7BB540/FFFFFF?text=Product"
+
+    # Compute sustainability ratings using existing service (weighted)
+    from app.services.sustainabilityRatings_service import fetchSustainabilityRatings
+    alt_items = []
+    for p in candidates:
+        try:
+            sust = fetchSustainabilityRatings({"product_id": p.id}, db)
+            rating = float(sust.get("rating", 0.0))
+        except Exception:
+            rating = 0.0
+        price_val = float(p.price or 0.0)
+        alt_items.append({
+            "id": p.id,
+            "name": p.name,
+            "price": price_val,
+            "brand": getattr(p, "brand", None),
+            "sustainability_rating": rating,
+            "image_url": image_map.get(p.id, "https://via.placeholder.com/300x300/7BB540/FFFFFF?text=Product"),
+            "price_diff": abs(price_val - current_price),
+        })
+    return alt_items
+
 
 @recommendation_router.get("/recommend/{user_id}", operation_id="get_user_recommendations")
 async def get_recommendations(
@@ -63,55 +251,11 @@ async def get_recommendations(
             
         logger.info(f"Generating exactly {limit} recommendations for user {user_id}")
         
-        # Get recommendation engine
-        engine = get_recommendation_engine(db)
-        
-        # Generate fast algorithmic recommendations
-        recommendations = engine.get_fast_recommendations(user_id, limit)
-        
-        # Ensure we ALWAYS have exactly 6 recommendations
-        while len(recommendations) < 6:
-            additional_needed = 6 - len(recommendations)
-            exclude_ids = []
-            for rec in recommendations:
-                # Handle both string and int product IDs
-                if hasattr(rec, 'product_id'):
-                    exclude_ids.append(str(rec.product_id))
-                elif hasattr(rec, 'product_data') and rec.product_data.get('id'):
-                    exclude_ids.append(str(rec.product_data['id']))
-            
-            # Try additional real products first
-            additional_recommendations = engine.get_additional_real_products(additional_needed, exclude_ids)
-            recommendations.extend(additional_recommendations)
-            
-            # If still not enough, use fallback to guarantee 6
-            if len(recommendations) < 6:
-                remaining_needed = 6 - len(recommendations)
-                fallback_recommendations = engine.get_fallback_recommendations(remaining_needed)
-                recommendations.extend(fallback_recommendations)
-                break  # Prevent infinite loop
-        
-        # Trim to exactly 6 recommendations
-        recommendations = recommendations[:6]
-        
-        # Final guarantee - if somehow we still don't have 6, create minimal ones
-        if len(recommendations) < 6:
-            logger.warning("Creating minimal recommendations to reach 6")
-            while len(recommendations) < 6:
-                minimal_rec = engine.create_minimal_recommendation(f"product_{len(recommendations) + 1}")
-                recommendations.append(minimal_rec)
-        
-        # Log final count
-        logger.info(f"Final recommendation count: {len(recommendations)} products (guaranteed 6)")
-        
-        # Convert to response format
-        response_data = []
-        for rec in recommendations:
-            rec_dict = rec.to_dict()
-            response_data.append(rec_dict)
+        # Recommendation engine queries run on the blocking pool
+        response_data = await run_blocking(_six_recommendations, db, user_id)
         
         execution_time = (datetime.utcnow() - start_time).total_seconds()
-        logger.info(f"Generated {len(recommendations)} recommendations in {execution_time:.2f}s")
+        logger.info(f"Generated {len(response_data)} recommendations in {execution_time:.2f}s")
         
         return {
             "status": 200,
@@ -119,7 +263,7 @@ async def get_recommendations(
             "data": response_data,
             "metadata": {
                 "user_id": user_id,
-                "count": len(recommendations),
+                "count": len(response_data),
                 "execution_time_seconds": execution_time,
                 "Smart_compliant": True,
                 "algorithm_only": True  # No LLM used for recommendations
@@ -138,6 +282,8 @@ async def get_recommendations(
 async def explain_recommendation(
     user_id: str,
     product_id: int,
+    single_call: bool = True,
+    stream: bool = False,
     db: Session = Depends(get_db)
 ):
     """
@@ -147,6 +293,8 @@ async def explain_recommendation(
     Args:
         user_id: User identifier for personalized explanations
         product_id: Product to explain
+        single_call: Answer all 4 questions in one structured completion (falls back to 4 calls)
+        stream: Stream each of the 4 sections independently as server-sent events
         
     Returns:
         Combined algorithmic reasoning and OpenAI-powered explanations
@@ -156,7 +304,7 @@ async def explain_recommendation(
         
         # Get product details
         product_request = {"product_id": product_id}
-        product_response = fetchProduct(product_request, db)
+        product_response = await run_blocking(fetchProduct, product_request, db)
         
         if not product_response or product_response.get("status") != 200:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -174,26 +322,50 @@ async def explain_recommendation(
         }
         
         # Generate algorithmic recommendation reasoning
-        engine = get_recommendation_engine(db)
-        user_history = engine.get_user_purchase_history(user_id)
-        popularity_scores = engine.get_product_popularity_scores()
-        sustainability_scores = engine.get_sustainability_scores([product_id])
-        
-        # Calculate recommendation reasoning for this specific product
-        reasoning = engine.calculate_recommendation_score(
-            product_response["data"], user_history, popularity_scores, sustainability_scores
-        )
+        reasoning = await run_blocking(_recommendation_reasoning, db, user_id, product_id, product_response["data"])
         
-        # Get OpenAI service for deep reasoning
-        openai_service = get_openai_service(OPENAI_API_KEY)
+        # Get OpenAI service for deep reasoning, bounded by the endpoint's latency budget
+        openai_service = get_openai_service(OPENAI_API_KEY, LATENCY_BUDGETS["explain"])
+
+        if stream:
+            streamed_explanation = {
+                "product_id": product_id,
+                "product_data": product_data,
+                "algorithmic_reasoning": reasoning.to_dict(),
+                "combined_insights": {
+                    "overall_score": reasoning.final_recommendation_score,
+                    "tier": "PREMIUM" if reasoning.final_recommendation_score >= 8.0
+                           else "GOOD" if reasoning.final_recommendation_score >= 6.0
+                           else "BASIC",
+                    "confidence_level": reasoning.confidence_level,
+                    "key_strengths": reasoning.reasoning_factors
+                },
+                "Smart_metadata": {
+                    "version": "1.0",
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "explanation_type": "comprehensive_recommendation_analysis"
+                }
+            }
+            sections = openai_service.stream_comprehensive_explanation(
+                user_id=user_id,
+                product_data=product_data,
+                recommendation_reasoning=reasoning.to_dict(),
+                alternative_products=[]  # TODO: Get actual alternatives
+            )
+            return StreamingResponse(
+                _stream_explanation(sections, streamed_explanation, openai_service),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
         
-        # Get comprehensive OpenAI explanations (parallel execution)
+        # Get comprehensive OpenAI explanations (single structured call or parallel execution)
         openai_explanations = await openai_service.get_comprehensive_explanation(
             user_id=user_id,
             product_data=product_data,
             recommendation_reasoning=reasoning.to_dict(),
             current_cart_sustainability=5.0,  # TODO: Get actual cart sustainability
-            alternative_products=[]  # TODO: Get actual alternatives
+            alternative_products=[],  # TODO: Get actual alternatives
+            single_call=single_call
         )
         
         # Combine algorithmic and AI reasoning
@@ -202,6 +374,7 @@ async def explain_recommendation(
             "product_data": product_data,
             "algorithmic_reasoning": reasoning.to_dict(),
             "ai_explanations": openai_explanations,
+            "ai_degraded": openai_service.degraded,
             "combined_insights": {
                 "overall_score": reasoning.final_recommendation_score,
                 "tier": "PREMIUM" if reasoning.final_recommendation_score >= 8.0 
@@ -235,32 +408,27 @@ async def explain_recommendation(
 async def why_recommended(
     user_id: str,
     product_id: int,
+    stream: bool = False,
     db: Session = Depends(get_db)
 ):
     """
     Q1: Why was this product recommended?
     OpenAI-powered explanation of algorithmic reasoning
+    Set stream=true to receive the answer as server-sent events
     """
     try:
         # Get product and reasoning data
         product_request = {"product_id": product_id}
-        product_response = fetchProduct(product_request, db)
+        product_response = await run_blocking(fetchProduct, product_request, db)
         
         if not product_response or product_response.get("status") != 200:
             raise HTTPException(status_code=404, detail="Product not found")
         
         # Generate algorithmic reasoning
-        engine = get_recommendation_engine(db)
-        user_history = engine.get_user_purchase_history(user_id)
-        popularity_scores = engine.get_product_popularity_scores()
-        sustainability_scores = engine.get_sustainability_scores([product_id])
-        
-        reasoning = engine.calculate_recommendation_score(
-            product_response["data"], user_history, popularity_scores, sustainability_scores
-        )
+        reasoning = await run_blocking(_recommendation_reasoning, db, user_id, product_id, product_response["data"])
         
         # Get OpenAI explanation
-        openai_service = get_openai_service(OPENAI_API_KEY)
+        openai_service = get_openai_service(OPENAI_API_KEY, LATENCY_BUDGETS["q1"])
         product_data = {
             "id": product_id,
             "name": product_response["data"].name,
@@ -272,6 +440,21 @@ async def why_recommended(
             "retailer_name": product_response.get("retailer_name", "Unknown")
         }
         
+        if stream:
+            chunks = openai_service.stream_section(
+                user_id, "why_recommended", product_data, reasoning.to_dict()
+            )
+            payload = {
+                "status": 200,
+                "question": "Why was this product recommended?",
+                "algorithmic_scores": reasoning.to_dict()
+            }
+            return StreamingResponse(
+                _stream_answer(chunks, payload, openai_service),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+
         explanation = await openai_service.why_recommended(
             user_id, product_data, reasoning.to_dict()
         )
@@ -280,7 +463,8 @@ async def why_recommended(
             "status": 200,
             "question": "Why was this product recommended?",
             "answer": explanation,
-            "algorithmic_scores": reasoning.to_dict()
+            "algorithmic_scores": reasoning.to_dict(),
+            "degraded": openai_service.degraded
         }
         
     except Exception as e:
@@ -292,16 +476,18 @@ async def why_recommended(
 async def sustainability_analysis(
     user_id: str,
     product_id: int,
+    stream: bool = False,
     db: Session = Depends(get_db)
 ):
     """
     Q2: How sustainable is this product given its score?
     OpenAI-powered sustainability analysis
+    Set stream=true to receive the answer as server-sent events
     """
     try:
         # Get product data
         product_request = {"product_id": product_id}
-        product_response = fetchProduct(product_request, db)
+        product_response = await run_blocking(fetchProduct, product_request, db)
         
         if not product_response or product_response.get("status") != 200:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -317,15 +503,47 @@ async def sustainability_analysis(
             "retailer_name": product_response.get("retailer_name", "Unknown")
         }
         
+        # Serve the pre-generated analysis when it matches the current product content
+        stored_analysis = await run_blocking(get_stored_analysis, db, product_data)
+        if stored_analysis:
+            if stream:
+                chunks = _replay_answer(stored_analysis)
+                payload = {
+                    "status": 200,
+                    "question": "How sustainable is this product given its score?",
+                    "sustainability_rating": product_data["sustainability_rating"]
+                }
+                return StreamingResponse(_stream_answer(chunks, payload), media_type="text/event-stream", headers=SSE_HEADERS)
+            return {
+                "status": 200,
+                "question": "How sustainable is this product given its score?",
+                "answer": stored_analysis,
+                "sustainability_rating": product_data["sustainability_rating"]
+            }
+
         # LLM analysis, constrained to /100 scale and concise output
-        openai_service = get_openai_service(OPENAI_API_KEY)
+        openai_service = get_openai_service(OPENAI_API_KEY, LATENCY_BUDGETS["q2"])
+        if stream:
+            chunks = openai_service.stream_section(user_id, "sustainability_analysis", product_data)
+            payload = {
+                "status": 200,
+                "question": "How sustainable is this product given its score?",
+                "sustainability_rating": product_data["sustainability_rating"]
+            }
+            return StreamingResponse(
+                _stream_answer(chunks, payload, openai_service),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+
         analysis = await openai_service.sustainability_analysis(user_id, product_data)
         
         return {
             "status": 200,
             "question": "How sustainable is this product given its score?",
             "answer": analysis,
-            "sustainability_rating": product_data["sustainability_rating"]
+            "sustainability_rating": product_data["sustainability_rating"],
+            "degraded": openai_service.degraded
         }
         
     except Exception as e:
@@ -346,7 +564,7 @@ async def suggest_alternatives(
     try:
         # Get product data
         product_request = {"product_id": product_id}
-        product_response = fetchProduct(product_request, db)
+        product_response = await run_blocking(fetchProduct, product_request, db)
         
         if not product_response or product_response.get("status") != 200:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -367,53 +585,7 @@ async def suggest_alternatives(
         current_category_id = product_response["data"].category_id
         current_price = float(product_response["data"].price or 0.0)
 
-        # Fetch candidate products (price-similar first), exclude the current product
-        candidates = (
-            db.query(Product)
-            .filter(
-                Product.category_id == current_category_id,
-                Product.id != product_id,
-                Product.in_stock == True,
-            )
-            .order_by(func.abs(Product.price - current_price))
-            .limit(30)
-            .all()
-        )
-
-        # Map first image per candidate
-        candidate_ids = [p.id for p in candidates]
-        images = []
-        if candidate_ids:
-            images = (
-                db.query(ProductImage)
-                .filter(ProductImage.product_id.in_(candidate_ids))
-                .order_by(ProductImage.product_id, ProductImage.id)
-                .all()
-            )
-        image_map = {}
-        for img in images:
-            if img.product_id not in image_map:
-                image_map[img.product_id] = img.image_url or "https://via.placeholder.com/300x300/7BB540/FFFFFF?text=Product"
-
-        # Compute sustainability ratings using existing service (weighted)
-        from app.services.sustainabilityRatings_service import fetchSustainabilityRatings
-        alt_items = []
-        for p in candidates:
-            try:
-                sust = fetchSustainabilityRatings({"product_id": p.id}, db)
-                rating = float(sust.get("rating", 0.0))
-            except Exception:
-                rating = 0.0
-            price_val = float(p.price or 0.0)
-            alt_items.append({
-                "id": p.id,
-                "name": p.name,
-                "price": price_val,
-                "brand": getattr(p, "brand", None),
-                "sustainability_rating": rating,
-                "image_url": image_map.get(p.id, "https://via.placeholder.com/300x300/7BB540/FFFFFF?text=Product"),
-                "price_diff": abs(price_val - current_price),
-            })
+        alt_items = await run_blocking(_alternative_candidates, db, product_id, current_category_id, current_price)
 
         # Pick top 3: highest sustainability, then closest price
         alt_items.sort(key=lambda x: (-x["sustainability_rating"], x["price_diff"]))
@@ -435,16 +607,18 @@ async def suggest_alternatives(
 async def ecometer_impact(
     user_id: str,
     product_id: int,
+    stream: bool = False,
     db: Session = Depends(get_db)
 ):
     """
     Q4: How does this product affect the EcoMeter score?
     OpenAI-powered EcoMeter impact analysis
+    Set stream=true to receive the answer as server-sent events
     """
     try:
         # Get product data
         product_request = {"product_id": product_id}
-        product_response = fetchProduct(product_request, db)
+        product_response = await run_blocking(fetchProduct, product_request, db)
         
         if not product_response or product_response.get("status") != 200:
             raise HTTPException(status_code=404, detail="Product not found")
@@ -462,7 +636,22 @@ async def ecometer_impact(
         
         # LLM impact analysis; pass a cart average (placeholder) and ensure /100 framing in prompt
         current_cart_sustainability = 50.0  # TODO: replace with actual cart average out of 100
-        openai_service = get_openai_service(OPENAI_API_KEY)
+        openai_service = get_openai_service(OPENAI_API_KEY, LATENCY_BUDGETS["q4"])
+        if stream:
+            chunks = openai_service.stream_section(user_id, "ecometer_impact", product_data)
+            payload = {
+                "status": 200,
+                "question": "How does this product affect the EcoMeter score?",
+                "current_cart_sustainability": current_cart_sustainability,
+                "product_sustainability": product_data["sustainability_rating"],
+                "model_used": None
+            }
+            return StreamingResponse(
+                _stream_answer(chunks, payload, openai_service),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+
         impact_analysis = await openai_service.ecometer_impact(
             user_id, product_data, current_cart_sustainability
         )
@@ -473,7 +662,8 @@ async def ecometer_impact(
             "answer": impact_analysis,
             "current_cart_sustainability": current_cart_sustainability,
             "product_sustainability": product_data["sustainability_rating"],
-            "model_used": getattr(openai_service, "last_model_used", None)
+            "model_used": getattr(openai_service, "last_model_used", None),
+            "degraded": openai_service.degraded
         }
         
     except Exception as e:
@@ -534,24 +724,38 @@ async def health_check():
 async def ai_health_check():
     """
     Lightweight AI health check to verify GPT connectivity and response.
-    Returns the first 120 characters of a fixed prompt's response.
+    Returns the first 120 characters of a fixed prompt's response and the circuit breaker state.
     """
     try:
-        openai_service = get_openai_service(OPENAI_API_KEY)
+        openai_service = get_openai_service(OPENAI_API_KEY, LATENCY_BUDGETS["ai_health"])
         prompt = [
             {"role": "system", "content": "You are a concise assistant."},
             {"role": "user", "content": "Reply with a single short sentence confirming AI connectivity for Green-Cart."}
         ]
-        # Call underlying request method for a quick check
-        content = await openai_service._make_openai_request(prompt)
+        # Call underlying request method for a quick check; a cached answer would hide an outage
+        content = await openai_service._make_openai_request(prompt, use_cache=False)
         snippet = (content or "").strip()[:120]
         ok = bool(content)
         return {
             "status": 200 if ok else 500,
             "message": "AI connectivity OK" if ok else "AI connectivity failed",
             "model": openai_service.model,
-            "snippet": snippet
+            "snippet": snippet,
+            "circuit_breaker": get_circuit_breaker_state()
         }
     except Exception as e:
         logger.error(f"AI health check failed: {e}")
         raise HTTPException(status_code=500, detail="AI health check failed")
+
+
+@recommendation_router.get("/ai-metrics", operation_id="recommendation_ai_metrics")
+async def ai_metrics():
+    """
+    OpenAI request coalescing metrics
+    Shows how many identical concurrent calls were served by a single upstream request
+    """
+    return {
+        "status": 200,
+        "timestamp": datetime.utcnow().isoformat(),
+        "coalescing": get_coalescing_metrics()
+    }
@@ -1,5 +1,6 @@
 from datetime import datetime
-from pydantic import BaseModel, EmailStr
+from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
 
 
 
@@ -69,3 +70,19 @@ class SetOrderStateResponse(BaseModel):
 class SetOrderStateRequest(BaseModel):
     order_id: int
     state: str
+
+class BulkSetOrderStateRequest(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=1000)
+    state: str
+    from_state: Optional[str] = None  # Only move orders still in this state
+
+class OrderStateOutcome(BaseModel):
+    order_id: int
+    outcome: str  # transitioned, unchanged, not_found, invalid_transition or conflict
+    state: Optional[str]
+
+class BulkSetOrderStateResponse(BaseModel):
+    status: int
+    message: str
+    transitioned: int
+    outcomes: List[OrderStateOutcome]
@@ -132,6 +132,7 @@ class ImpactMetrics(BaseModel):
     total_lifetime_improvement: Optional[float] = Field(None, description="Total lifetime improvement")
     sustainability_efficiency_score: Optional[float] = Field(None, description="Sustainability score per order")
     percentile_rank: Optional[float] = Field(None, description="Percentile rank among users")
+    sustainability_score_vs_average: Optional[float] = Field(None, description="Sustainability score minus the average user's")
     streak_days: Optional[int] = Field(None, description="Consecutive improvement days")
 
 class LatestForecast(BaseModel):
@@ -1,9 +1,9 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
 class CartItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(..., gt=0)
 
 class CartItemOut(CartItemCreate):
     id: int
@@ -16,3 +16,29 @@ class CartOut(BaseModel):
     items: List[CartItemOut]
     class Config:
         orm_mode = True
+
+class CartOperation(BaseModel):
+    """One change in a batch: add to a line, set its quantity (0 removes it) or remove it"""
+    op: Literal["add", "set", "remove"]
+    product_id: int
+    quantity: int = Field(0, ge=0)
+
+class CartBatchUpdate(BaseModel):
+    operations: List[CartOperation] = Field(..., max_length=100)
+
+class CartSummaryLine(BaseModel):
+    product_id: int
+    name: str
+    price: float
+    quantity: int
+    line_total: float
+    sustainability_rating: float
+    image_url: Optional[str] = None
+
+class CartSummaryOut(BaseModel):
+    id: int
+    user_id: str
+    items: List[CartSummaryLine]
+    item_count: int
+    total_amount: float
+    average_sustainability: float
@@ -22,6 +22,26 @@ class FetchAllOrdersResponse(BaseModel):
     message: str
     orders: List[OrderResponse]
 
+class FetchOrderHistoryRequest(BaseModel):
+    userID: str
+    limit: int = 20
+    cursor: Optional[str] = None  # next_cursor from the previous page
+
+class OrderHistoryItem(BaseModel):
+    id: int
+    cart_id: int
+    state: str
+    created_at: Optional[datetime]
+    item_count: int
+    total_amount: Decimal
+    average_sustainability: Decimal
+
+class FetchOrderHistoryResponse(BaseModel):
+    status: int
+    message: str
+    orders: List[OrderHistoryItem]
+    next_cursor: Optional[str]
+
 class FetchOrderByIdRequest(BaseModel):
     userID: str
     orderID: int
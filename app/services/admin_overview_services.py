@@ -2,11 +2,10 @@ from sqlalchemy.orm import Session
 from app.models.orders import Order
 from app.models.user import User
 from app.models.address import Address
-from app.models.cart_item import CartItem
-from app.models.product import Product
+from app.services.order_state_service import transition_order, transition_orders
 from datetime import date
 from datetime import timedelta
-from sqlalchemy import extract
+from sqlalchemy import extract, func
 from calendar import month_name
 from decimal import Decimal
 
@@ -129,60 +128,31 @@ def get_revenue_overview(period, db: Session):
     else:
         time_filter = date.today() - timedelta(days=365)
 
-    
-    orders = db.query(Order).filter(Order.created_at >= time_filter, Order.state != 'Cancelled').all()
-    lost_orders = db.query(Order).filter(Order.created_at >= time_filter, Order.state == 'Cancelled').all()
-    cart_items = db.query(CartItem).all()
-    products = db.query(Product).all()
-
-    total_revenue = Decimal('0.0')
-    lost_revenue = Decimal('0.0')
-
-    for o in orders:
-        for c in cart_items:
-            if c.cart_id == o.cart_id:
-                for p in products:
-                    if p.id == c.product_id:
-                        total_revenue += p.price * c.quantity
-                        break
-
-    for o in lost_orders:
-        for c in cart_items:
-            if c.cart_id == o.cart_id:
-                for p in products:
-                    if p.id == c.product_id:
-                        lost_revenue += p.price * c.quantity
-                        break
-            
+
+    # Revenue is read from the totals stored at checkout, so price changes do not rewrite history
+    total_revenue, lost_revenue = (
+        db.query(
+            func.coalesce(func.sum(Order.total_amount).filter(Order.state != 'Cancelled'), 0),
+            func.coalesce(func.sum(Order.total_amount).filter(Order.state == 'Cancelled'), 0)
+        )
+        .filter(Order.created_at >= time_filter)
+        .one()
+    )
 
     this_month = date.today().month
     last_month = this_month - 1 if this_month > 1 else 12
 
-    # These Two
-    current_month_orders = db.query(Order).filter(Order.state != 'Cancelled', extract('month', Order.created_at) == this_month).all()
-    last_month_orders = db.query(Order).filter(Order.state != 'Cancelled', extract('month', Order.created_at) == last_month).all()
-
-    last_month_revenue = Decimal('0.0')
-    this_month_revenue = Decimal('0.0')
-
-    for o in current_month_orders:
-        for c in cart_items:
-            if c.cart_id == o.cart_id:
-                for p in products:
-                    if p.id == c.product_id:
-                        this_month_revenue += p.price * c.quantity
-                        break
-
-    for o in last_month_orders:
-        for c in cart_items:
-            if c.cart_id == o.cart_id:
-                for p in products:
-                    if p.id == c.product_id:
-                        last_month_revenue += p.price * c.quantity
-                        break
-
-    if last_month_revenue == '0.0':
-        percent_change = '1.0' if this_month_revenue > '0.0' else '0.0'
+    this_month_revenue, last_month_revenue = (
+        db.query(
+            func.coalesce(func.sum(Order.total_amount).filter(extract('month', Order.created_at) == this_month), 0),
+            func.coalesce(func.sum(Order.total_amount).filter(extract('month', Order.created_at) == last_month), 0)
+        )
+        .filter(Order.state != 'Cancelled')
+        .one()
+    )
+
+    if last_month_revenue == 0:
+        percent_change = Decimal('1.0') if this_month_revenue > 0 else Decimal('0.0')
     else:
         percent_change = (this_month_revenue - last_month_revenue) / last_month_revenue
 
@@ -197,19 +167,11 @@ def get_revenue_overview(period, db: Session):
     }
 
 def get_total_revenue(db: Session):
-    orders = db.query(Order).filter(Order.state != 'Cancelled').all()
-    cart_items = db.query(CartItem).all()
-    products = db.query(Product).all()
-
-    total_revenue = Decimal('0.0')
-
-    for o in orders:
-        for c in cart_items:
-            if c.cart_id == o.cart_id:
-                for p in products:
-                    if p.id == c.product_id:
-                        total_revenue += p.price * c.quantity
-                        break
+    total_revenue = (
+        db.query(func.coalesce(func.sum(Order.total_amount), 0))
+        .filter(Order.state != 'Cancelled')
+        .scalar()
+    )
 
     return {
         "status": 200,
@@ -218,17 +180,19 @@ def get_total_revenue(db: Session):
     }
 
 def change_order_state(request, db : Session):
-    order_id = request.order_id
-    state = request.state
-
-    order = db.query(Order).filter(Order.id == order_id).first()
+    transition_order(db, request.order_id, request.state)
 
-    order.state = state
+    return {
+        'status': 200,
+        'message': 'Order state set successfully'
+    }
 
-    db.commit()
-    db.refresh(order)
+def bulk_change_order_state(request, db: Session):
+    result = transition_orders(db, request.order_ids, request.state, from_state=request.from_state)
 
     return {
         'status': 200,
-        'message': 'Order state set successfully'
+        'message': f"{result['transitioned']} of {len(result['outcomes'])} orders set to {request.state}",
+        'transitioned': result['transitioned'],
+        'outcomes': result['outcomes']
     }
@@ -0,0 +1,314 @@
+"""
+Nightly batch forecasting for every user with orders
+Per-order sustainability is streamed from order_sustainability_summary in one query ordered by user,
+cut into shards of whole users, and each shard is forecast with NumPy array operations in a process pool.
+The results mirror SimpleCarbonForecastingEngine (same 50-order window, monthly averaging, trend,
+variance-based confidence and behavioural score) and are bulk inserted into carbon_forecasts,
+where load_stored_forecast picks them up until the user's next order
+
+Run with:
+    python -m app.services.batch_forecasting --workers 4 --users-per-shard 50000
+"""
+import argparse
+import json
+import logging
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Iterator, Tuple
+
+import numpy as np
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from app.models.carbon_forecasting import CarbonForecast
+from app.models.order_sustainability_summary import OrderSustainabilitySummary
+from app.services.carbon_forecasting import FORECAST_HORIZON_DAYS
+from app.services.order_summary_service import UNRATED_ORDER_SUSTAINABILITY
+
+logger = logging.getLogger(__name__)
+
+# Same window the request-time engine reads per user
+ORDERS_PER_USER = 50
+INSERT_CHUNK_SIZE = 5000
+
+# Months are encoded as months since 1970-01 so (user, month) pairs pack into one int64 key
+_MONTH_KEY_SPAN = 1_000_000
+
+
+def to_sustainability_scores(ratings: np.ndarray) -> np.ndarray:
+    """Vectorized version of the engine's 0-5 / 0-10 / 0-100 rating normalisation"""
+    return np.where(ratings <= 5.0, ratings * 20, np.where(ratings <= 10.0, ratings * 10, np.minimum(100.0, ratings)))
+
+
+def _month_label(month_index: int) -> str:
+    return f"{1970 + month_index // 12}-{month_index % 12 + 1:02d}"
+
+
+def forecast_shard(user_ids: np.ndarray, months: np.ndarray, ratings: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Forecast every user in a shard
+    Inputs are parallel arrays of one entry per order, grouped by user and newest first within a user;
+    months are months since 1970-01 and ratings the per-order average sustainability rating
+    Returns carbon_forecasts rows ready for a bulk insert
+    """
+    if len(user_ids) == 0:
+        return []
+
+    users, first_index, codes = np.unique(user_ids, return_index=True, return_inverse=True)
+    user_count = len(users)
+
+    # Keep each user's newest ORDERS_PER_USER orders, like the engine's LIMIT 50
+    rank = np.arange(len(codes)) - first_index[codes]
+    window = rank < ORDERS_PER_USER
+    codes, months, ratings = codes[window], months[window], ratings[window]
+
+    order_counts = np.bincount(codes, minlength=user_count)
+    scores = to_sustainability_scores(ratings)
+    valid = ratings > 0
+    valid_counts = np.bincount(codes, weights=valid, minlength=user_count)
+    valid_sums = np.bincount(codes, weights=np.where(valid, scores, 0.0), minlength=user_count)
+
+    # Monthly averages per (user, month), ordered by user then month
+    keys = codes[valid].astype(np.int64) * _MONTH_KEY_SPAN + months[valid]
+    month_keys, month_group = np.unique(keys, return_inverse=True)
+    month_averages = np.bincount(month_group, weights=scores[valid]) / np.bincount(month_group)
+    group_user = month_keys // _MONTH_KEY_SPAN
+    group_month = month_keys % _MONTH_KEY_SPAN
+
+    month_counts = np.bincount(group_user, minlength=user_count)
+    first_group = np.searchsorted(group_user, np.arange(user_count))
+    position = np.arange(len(month_keys)) - first_group[group_user]
+
+    # Last three months are "recent", everything before them "older"
+    recent = position >= month_counts[group_user] - 3
+    with np.errstate(invalid="ignore", divide="ignore"):
+        recent_avg = (np.bincount(group_user, weights=month_averages * recent, minlength=user_count)
+                      / np.bincount(group_user, weights=recent, minlength=user_count))
+        older_counts = np.bincount(group_user, weights=~recent, minlength=user_count)
+        older_avg = np.bincount(group_user, weights=month_averages * ~recent, minlength=user_count) / older_counts
+        trend_change = np.where(older_counts > 0, recent_avg - older_avg, 0.0)
+
+        mean_monthly = np.bincount(group_user, weights=month_averages, minlength=user_count) / month_counts
+        variance = (np.bincount(group_user, weights=(month_averages - mean_monthly[group_user]) ** 2, minlength=user_count)
+                    / month_counts)
+
+    predicted = np.clip(recent_avg + trend_change * 0.3, 0.0, 100.0)
+    improvement = np.minimum(15.0, 100.0 - predicted)
+    confidence = np.where(variance < 100, 0.8, np.where(variance < 400, 0.6, 0.4)) * np.minimum(1.0, month_counts / 6)
+    behavioral = np.minimum(0.9, 1.0 - variance / 1000)
+    trend_direction = np.where(
+        trend_change > 5, "improving",
+        np.where(trend_change < -5, "declining", np.where(variance > 400, "volatile", "stable"))
+    )
+
+    target_date = datetime.utcnow() + timedelta(days=FORECAST_HORIZON_DAYS)
+    rows = []
+    for code in range(user_count):
+        count = int(order_counts[code])
+        if count < 3:
+            row = _early_prediction_row(count, valid_counts[code], valid_sums[code])
+        elif month_counts[code] == 0:
+            row = _limited_data_row(count)
+        else:
+            groups = slice(first_group[code], first_group[code] + month_counts[code])
+            row = {
+                "predicted_sustainability_score": float(predicted[code]),
+                "improvement_potential": float(improvement[code]),
+                "confidence_score": float(confidence[code]),
+                "trend_direction": str(trend_direction[code]),
+                "behavioral_score": float(behavioral[code]),
+                "prediction_factors": {
+                    "monthly_averages": {
+                        _month_label(int(m)): float(a) for m, a in zip(group_month[groups], month_averages[groups])
+                    },
+                    "goal_achievements": {},
+                    "recent_avg": float(recent_avg[code]),
+                    "trend_change": float(trend_change[code]),
+                    "data_months": int(month_counts[code]),
+                    "score_variance": float(variance[code])
+                },
+                "algorithm_metadata": {
+                    "algorithm": "simple_behavior_analysis",
+                    "version": "3.0",
+                    "approach": "monthly_sustainability_average_with_goal_tracking"
+                }
+            }
+        row["algorithm_metadata"]["source"] = "nightly_batch"
+        row.update({
+            "user_id": str(users[code]),
+            "forecast_type": "monthly",
+            "target_date": target_date,
+            "forecast_horizon_days": FORECAST_HORIZON_DAYS,
+            "seasonal_factor": 1.0
+        })
+        rows.append(row)
+    return rows
+
+
+def _early_prediction_row(order_count: int, valid_count: float, valid_sum: float) -> Dict[str, Any]:
+    """Users with 1-2 orders, as in _simple_prediction_from_orders"""
+    if valid_count > 0:
+        predicted = valid_sum / valid_count
+        improvement = min(20.0, 100.0 - predicted)
+        confidence = 0.4 if order_count == 2 else 0.25
+    else:
+        predicted, improvement, confidence = 50.0, 20.0, 0.2
+    return {
+        "predicted_sustainability_score": float(predicted),
+        "improvement_potential": float(improvement),
+        "confidence_score": float(confidence),
+        "trend_direction": "stable",
+        "behavioral_score": 0.5,
+        "prediction_factors": {
+            "status": "early_prediction",
+            "current_orders": order_count,
+            "actual_avg_sustainability": float(predicted),
+            "message": f"Prediction based on your {order_count} order(s) with {predicted:.1f} average sustainability",
+            "recommendation": f"Make {3 - order_count} more purchase(s) to unlock more accurate trend analysis"
+        },
+        "algorithm_metadata": {"algorithm": "simple_order_average", "version": "3.0", "data_points": order_count}
+    }
+
+
+def _limited_data_row(order_count: int) -> Dict[str, Any]:
+    """Users with 3+ orders but no rated ones, as in _insufficient_data_forecast"""
+    return {
+        "predicted_sustainability_score": 55.0,
+        "improvement_potential": 15.0,
+        "confidence_score": 0.3,
+        "trend_direction": "stable",
+        "behavioral_score": 0.4,
+        "prediction_factors": {
+            "status": "limited_data_fallback",
+            "current_orders": order_count,
+            "recommended_orders": 3,
+            "message": "Fallback prediction - improve with more purchase history",
+            "recommendation": "Make more purchases to get personalized forecasting"
+        },
+        "algorithm_metadata": {"algorithm": "limited_data_fallback", "version": "3.0", "data_points": order_count}
+    }
+
+
+def stream_order_shards(db: Session, users_per_shard: int = 50000,
+                        fetch_size: int = 50000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Stream non-cancelled order summaries for all users in one query and yield shards of whole users
+    as (user_ids, months since 1970-01, ratings) arrays
+    """
+    query = (
+        select(
+            OrderSustainabilitySummary.user_id,
+            OrderSustainabilitySummary.order_created_at,
+            OrderSustainabilitySummary.avg_sustainability
+        )
+        .where(OrderSustainabilitySummary.cancelled.is_(False))
+        .order_by(OrderSustainabilitySummary.user_id, OrderSustainabilitySummary.order_created_at.desc())
+        .execution_options(yield_per=fetch_size)
+    )
+
+    carry = None
+    for partition in db.execute(query).partitions():
+        user_ids, created_at, ratings = zip(*partition)
+        user_ids = np.array(user_ids, dtype=object)
+        months = np.array(created_at, dtype="datetime64[M]").astype(np.int64)
+        ratings = np.array([UNRATED_ORDER_SUSTAINABILITY if r is None else r for r in ratings], dtype=np.float64)
+
+        if carry is not None:
+            user_ids, months, ratings = (np.concatenate(pair) for pair in zip(carry, (user_ids, months, ratings)))
+
+        # Emit full shards of complete users; the last user may continue in the next partition
+        user_starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+        shard_start = 0
+        for next_user in range(users_per_shard, len(user_starts), users_per_shard):
+            shard_end = user_starts[next_user]
+            yield user_ids[shard_start:shard_end], months[shard_start:shard_end], ratings[shard_start:shard_end]
+            shard_start = shard_end
+        carry = (user_ids[shard_start:], months[shard_start:], ratings[shard_start:])
+
+    if carry is not None and len(carry[0]):
+        yield carry
+
+
+def write_forecasts(db: Session, rows: List[Dict[str, Any]]):
+    """Bulk insert forecast rows in chunks and commit"""
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(insert(CarbonForecast), rows[start:start + INSERT_CHUNK_SIZE])
+    db.commit()
+
+
+def _peak_memory_mb() -> Dict[str, float]:
+    # ru_maxrss is reported in kilobytes on Linux
+    return {
+        "main_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "workers_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    }
+
+
+def run_batch_forecasting(db: Session, workers: int = 4, users_per_shard: int = 50000,
+                          dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Forecast all users shard by shard; with workers <= 1 shards are computed in-process
+    Summaries are streamed on a session of their own, since committing the writes on `db` would
+    close the server-side cursor mid-stream
+    Returns throughput and memory statistics
+    """
+    start_time = time.monotonic()
+    totals = {"users": 0, "orders": 0, "shards": 0}
+
+    def handle(rows: List[Dict[str, Any]]):
+        if not dry_run:
+            write_forecasts(db, rows)
+        totals["users"] += len(rows)
+        totals["shards"] += 1
+        logger.info(f"Batch forecasting progress: {totals}")
+
+    with Session(bind=db.get_bind()) as stream_db:
+        shards = stream_order_shards(stream_db, users_per_shard=users_per_shard)
+        if workers <= 1:
+            for user_ids, months, ratings in shards:
+                totals["orders"] += len(user_ids)
+                handle(forecast_shard(user_ids, months, ratings))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = []
+                for user_ids, months, ratings in shards:
+                    totals["orders"] += len(user_ids)
+                    pending.append(pool.submit(forecast_shard, user_ids, months, ratings))
+                    # Bound the shards held in memory to a couple per worker
+                    while len(pending) >= workers * 2:
+                        handle(pending.pop(0).result())
+                for future in pending:
+                    handle(future.result())
+
+    elapsed = time.monotonic() - start_time
+    totals["elapsed_seconds"] = round(elapsed, 2)
+    totals["users_per_second"] = round(totals["users"] / elapsed, 1) if elapsed > 0 else 0.0
+    totals.update(_peak_memory_mb())
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nightly batch carbon forecasting for all users")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes; 1 computes in-process")
+    parser.add_argument("--users-per-shard", type=int, default=50000, help="Users per shard sent to a worker")
+    parser.add_argument("--dry-run", action="store_true", help="Compute forecasts without writing them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        totals = run_batch_forecasting(
+            db, workers=args.workers, users_per_shard=args.users_per_shard, dry_run=args.dry_run
+        )
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
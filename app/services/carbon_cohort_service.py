@@ -0,0 +1,154 @@
+"""
+Cohort comparison of user sustainability scores
+Each user's score is the average sustainability of their rated, non-cancelled orders, capped at 100.
+A periodic job sorts every user's score into one compact float32 array stored in
+carbon_score_distributions; any user's percentile rank and difference from the average user are
+then a binary search over that array instead of a scan over all users
+
+Rebuild with:
+    python -m app.services.carbon_cohort_service
+"""
+import json
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.carbon_forecasting import CarbonScoreDistribution
+from app.models.order_sustainability_summary import OrderSustainabilitySummary
+
+logger = logging.getLogger(__name__)
+
+# How long a loaded distribution is reused before checking for a newer build
+DISTRIBUTION_RELOAD_SECONDS = 600
+
+_SCORE_DTYPE = np.dtype("<f4")
+
+_loaded: Dict[str, Any] = {"distribution": None, "loaded_at": 0.0}
+_loaded_lock = threading.Lock()
+
+
+class ScoreDistribution:
+    """Sorted per-user scores with their mean"""
+
+    def __init__(self, sorted_scores: np.ndarray, mean_score: Optional[float], built_at=None):
+        self.sorted_scores = sorted_scores
+        self.mean_score = mean_score
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.sorted_scores)
+
+    def position(self, score: float) -> Dict[str, float]:
+        """Mid-rank percentile (0-100, higher is more sustainable) and difference from the mean, in O(log n)"""
+        # Compare at stored precision so the user's own entry counts as a tie
+        stored = _SCORE_DTYPE.type(score)
+        below = int(np.searchsorted(self.sorted_scores, stored, side="left"))
+        at_or_below = int(np.searchsorted(self.sorted_scores, stored, side="right"))
+        percentile = (below + at_or_below) / 2 / len(self.sorted_scores) * 100
+        return {
+            "percentile_rank": round(percentile, 1),
+            "sustainability_score_vs_average": round(score - self.mean_score, 1)
+        }
+
+
+def _rated_orders(query):
+    return query.filter(
+        OrderSustainabilitySummary.cancelled.is_(False),
+        OrderSustainabilitySummary.avg_sustainability.isnot(None)
+    )
+
+
+def get_user_sustainability_score(db: Session, user_id: str) -> Optional[float]:
+    """The user's cohort score, read with the (user_id, order_created_at) index"""
+    score = _rated_orders(
+        db.query(func.avg(OrderSustainabilitySummary.avg_sustainability))
+        .filter(OrderSustainabilitySummary.user_id == user_id)
+    ).scalar()
+    return min(100.0, float(score)) if score is not None else None
+
+
+def build_score_distribution(db: Session) -> Dict[str, Any]:
+    """Aggregate every user's score, store them sorted as one row and drop older builds"""
+    start_time = time.monotonic()
+    rows = _rated_orders(
+        db.query(func.avg(OrderSustainabilitySummary.avg_sustainability))
+        .group_by(OrderSustainabilitySummary.user_id)
+    ).all()
+
+    scores = np.fromiter((row[0] for row in rows), dtype=_SCORE_DTYPE, count=len(rows))
+    scores = np.sort(np.minimum(scores, 100.0))
+    mean_score = float(scores.mean(dtype=np.float64)) if len(scores) else None
+
+    distribution = CarbonScoreDistribution(
+        user_count=len(scores),
+        mean_score=mean_score,
+        sorted_scores=scores.tobytes()
+    )
+    db.add(distribution)
+    db.flush()
+    db.query(CarbonScoreDistribution).filter(CarbonScoreDistribution.id != distribution.id).delete()
+    db.commit()
+
+    return {
+        "users": len(scores),
+        "mean_score": mean_score,
+        "bytes": len(distribution.sorted_scores),
+        "elapsed_seconds": round(time.monotonic() - start_time, 2)
+    }
+
+
+def load_score_distribution(db: Session) -> Optional[ScoreDistribution]:
+    """Latest stored distribution, decoded once and reused for DISTRIBUTION_RELOAD_SECONDS"""
+    with _loaded_lock:
+        if time.monotonic() - _loaded["loaded_at"] < DISTRIBUTION_RELOAD_SECONDS:
+            return _loaded["distribution"]
+
+    row = db.query(CarbonScoreDistribution).order_by(CarbonScoreDistribution.built_at.desc()).first()
+    distribution = None
+    if row is not None and row.user_count:
+        distribution = ScoreDistribution(
+            np.frombuffer(row.sorted_scores, dtype=_SCORE_DTYPE), row.mean_score, row.built_at
+        )
+
+    with _loaded_lock:
+        _loaded["distribution"] = distribution
+        _loaded["loaded_at"] = time.monotonic()
+    return distribution
+
+
+def get_user_cohort_metrics(user_id: str, db: Session) -> Optional[Dict[str, Any]]:
+    """Impact metrics comparing the user with everyone, or None until they have rated orders and a build exists"""
+    score = get_user_sustainability_score(db, user_id)
+    if score is None:
+        return None
+    distribution = load_score_distribution(db)
+    if distribution is None:
+        return None
+
+    return {
+        "total_lifetime_sustainability_score": round(score, 1),
+        **distribution.position(score)
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    CarbonScoreDistribution.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        totals = build_score_distribution(db)
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
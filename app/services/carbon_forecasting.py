@@ -9,6 +9,13 @@ from dataclasses import dataclass
 from enum import Enum
 from decimal import Decimal
 
+from app.db.executor import run_blocking
+from app.models.carbon_forecasting import CarbonForecast, CarbonForecastAccuracy, UserShoppingPattern
+from app.models.order_sustainability_summary import OrderSustainabilitySummary
+from app.services.order_summary_service import get_user_order_summaries
+from app.services.forecast_state_service import get_forecast_state, state_statistics
+from app.services.carbon_cohort_service import get_user_cohort_metrics
+
 logger = logging.getLogger(__name__)
 
 def safe_float_convert(value) -> float:
@@ -24,6 +31,27 @@ def safe_float_convert(value) -> float:
     except (ValueError, TypeError):
         return 0.0
 
+def _json_safe(value):
+    """Convert numpy scalars inside prediction factors into plain JSON types"""
+    if isinstance(value, dict):
+        return {str(k): _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+# Stored forecasts are reused until the user's next order (or cancellation) or until this TTL passes
+FORECAST_TTL = timedelta(hours=24)
+
+# Horizon the engine forecasts whatever horizon is requested; stored rows record it and reuse matches on it
+FORECAST_HORIZON_DAYS = 30
+
+# Trend values the carbon_forecasts.trend_direction enum accepts
+STORABLE_TRENDS = ("improving", "declining", "stable", "volatile")
+
 class ForecastAlgorithm(Enum):
     LINEAR_REGRESSION = "linear_regression"
     EXPONENTIAL_SMOOTHING = "exponential_smoothing"
@@ -52,7 +80,7 @@ class SimpleCarbonForecastingEngine:
         forecast_horizon_days: int = 30
     ) -> ForecastResult:
         # Always use 30 days for forecasting accuracy
-        forecast_horizon_days = 30
+        forecast_horizon_days = FORECAST_HORIZON_DAYS
         """Generate carbon emissions forecast using existing data"""
         
         logger.info(f"Generating forecast for user {user_id}")
@@ -77,28 +105,14 @@ class SimpleCarbonForecastingEngine:
         return forecast
     
     async def _gather_user_data(self, user_id: str) -> Dict[str, Any]:
-        """Gather user data from existing tables"""
-        
-        # Get order history with sustainability data
-        orders_query = text("""
-            SELECT 
-                o.id,
-                o.created_at,
-                COALESCE(SUM(ci.quantity * p.price), 0) as order_value,
-                COALESCE(AVG(sr.value), 2.5) as avg_sustainability_rating,
-                COUNT(ci.id) as item_count
-            FROM orders o
-            LEFT JOIN carts c ON o.cart_id = c.id
-            LEFT JOIN cart_items ci ON c.id = ci.cart_id
-            LEFT JOIN products p ON ci.product_id = p.id
-            LEFT JOIN sustainability_ratings sr ON p.id = sr.product_id
-            WHERE o.user_id = :user_id AND o.state != 'Cancelled'
-            GROUP BY o.id, o.created_at
-            ORDER BY o.created_at DESC
-            LIMIT 50
-        """)
+        """Gather user data from existing tables, off the event loop"""
+        return await run_blocking(self._load_user_data, user_id)
+    
+    def _load_user_data(self, user_id: str) -> Dict[str, Any]:
+        """Order history and carbon goals from existing tables"""
         
-        orders_result = self.db.execute(orders_query, {"user_id": user_id}).fetchall()
+        # Order history with sustainability data from the per-order rollup
+        orders = get_user_order_summaries(self.db, user_id, limit=50)
         
         # Get carbon goals with better error handling
         goals_query = text("""
@@ -117,7 +131,7 @@ class SimpleCarbonForecastingEngine:
             goals_result = []
         
         return {
-            "orders": [dict(row._mapping) for row in orders_result],
+            "orders": orders,
             "goals": {row.month: float(row.goal_value) for row in goals_result} if goals_result else {},
             "user_id": user_id
         }
@@ -481,12 +495,254 @@ class SimpleCarbonForecastingEngine:
             }
         )
 
+# Forecast persistence
+def load_stored_forecast(
+    user_id: str,
+    db: Session,
+    horizon_days: int = FORECAST_HORIZON_DAYS
+) -> Optional[CarbonForecast]:
+    """
+    Latest stored forecast for a user over `horizon_days` if it is still fresh:
+    younger than FORECAST_TTL and no order placed or cancelled since it was made
+    """
+    newer_activity = db.query(OrderSustainabilitySummary.order_id).filter(
+        OrderSustainabilitySummary.user_id == user_id,
+        OrderSustainabilitySummary.updated_at > CarbonForecast.created_at
+    ).exists()
+
+    return (
+        db.query(CarbonForecast)
+        .filter(
+            CarbonForecast.user_id == user_id,
+            CarbonForecast.forecast_horizon_days == horizon_days,
+            CarbonForecast.created_at >= func.now() - FORECAST_TTL,
+            ~newer_activity
+        )
+        .order_by(CarbonForecast.created_at.desc())
+        .first()
+    )
+
+def forecast_from_stored(row: CarbonForecast) -> ForecastResult:
+    """Rebuild a ForecastResult from a stored carbon_forecasts row"""
+    return ForecastResult(
+        predicted_emissions=row.predicted_sustainability_score,
+        predicted_reduction=row.improvement_potential,
+        confidence_score=row.confidence_score,
+        trend_direction=row.trend_direction,
+        seasonal_factor=row.seasonal_factor if row.seasonal_factor is not None else 1.0,
+        behavioral_score=row.behavioral_score if row.behavioral_score is not None else 0.0,
+        prediction_factors=row.prediction_factors or {},
+        algorithm_metadata=row.algorithm_metadata or {}
+    )
+
+def store_forecast(
+    user_id: str,
+    forecast: ForecastResult,
+    horizon_days: int,
+    db: Session,
+    shopping_patterns: Optional[Dict[str, Any]] = None
+) -> Optional[CarbonForecast]:
+    """
+    Persist a forecast, and optionally the user's shopping patterns, in one commit
+    `horizon_days` is the horizon the forecast was computed over, not the one requested
+    Forecasts without an order-based trend (no orders yet) are not stored
+    """
+    if forecast.trend_direction not in STORABLE_TRENDS:
+        return None
+
+    try:
+        row = CarbonForecast(
+            user_id=user_id,
+            forecast_type="monthly",
+            predicted_sustainability_score=float(forecast.predicted_emissions),
+            improvement_potential=float(forecast.predicted_reduction),
+            confidence_score=float(forecast.confidence_score),
+            target_date=datetime.utcnow() + timedelta(days=horizon_days),
+            forecast_horizon_days=horizon_days,
+            trend_direction=forecast.trend_direction,
+            seasonal_factor=float(forecast.seasonal_factor),
+            behavioral_score=float(forecast.behavioral_score),
+            prediction_factors=_json_safe(forecast.prediction_factors),
+            algorithm_metadata=_json_safe(forecast.algorithm_metadata)
+        )
+        db.add(row)
+
+        if shopping_patterns is not None:
+            pattern = db.query(UserShoppingPattern).filter(UserShoppingPattern.user_id == user_id).first()
+            if pattern is None:
+                pattern = UserShoppingPattern(user_id=user_id)
+                db.add(pattern)
+            for field, value in _json_safe(shopping_patterns).items():
+                setattr(pattern, field, value)
+            pattern.last_calculated = func.now()
+
+        db.commit()
+        return row
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Could not store forecast for user {user_id}: {str(e)}")
+        return None
+
+def _forecast_recommendations(forecast: ForecastResult) -> List[str]:
+    """Recommendations derived from a forecast's trend, confidence and behaviour"""
+    recommendations = []
+    if forecast.trend_direction == "declining":
+        recommendations.append("Consider choosing more sustainable products to improve your sustainability trend")
+    if forecast.confidence_score < 0.6:
+        recommendations.append("More shopping data will improve forecast accuracy")
+    if forecast.behavioral_score < 0.6:
+        recommendations.append("Try to maintain consistent sustainable shopping habits")
+    return recommendations
+
+def _latest_forecast_insight(forecast: ForecastResult, created_at: datetime) -> Dict[str, Any]:
+    return {
+        "predicted_sustainability_score": max(0.0, min(100.0, forecast.predicted_emissions * 2.5)),  # Convert to 0-100 scale
+        "improvement_potential": max(0.0, min(100.0, forecast.predicted_reduction * 3.0)),  # Convert to 0-100 scale  
+        "confidence": forecast.confidence_score,
+        "trend": forecast.trend_direction,
+        "created_at": created_at.isoformat()
+    }
+
+def _insights_from_stored(
+    user_id: str, row: CarbonForecast, insights: Dict[str, Any], db: Session
+) -> Optional[Dict[str, Any]]:
+    """
+    Fill insights from a stored forecast and the shopping patterns saved alongside it
+    Returns None when no patterns were saved with this forecast (e.g. one written by the nightly batch)
+    """
+    pattern = db.query(UserShoppingPattern).filter(UserShoppingPattern.user_id == user_id).first()
+    # Patterns are written in the same commit as the forecast; older rows belong to an earlier forecast
+    if pattern is None or not pattern.last_calculated or pattern.last_calculated < row.created_at:
+        return None
+
+    forecast = forecast_from_stored(row)
+    insights["latest_forecast"] = _latest_forecast_insight(forecast, row.created_at)
+    insights["shopping_patterns"] = {
+        "avg_orders_per_week": pattern.avg_orders_per_week,
+        "eco_consciousness_score": pattern.eco_consciousness_score,
+        "sustainability_trend_30d": pattern.sustainability_trend_30d,
+        "goals_achievement_rate": pattern.goals_achievement_rate
+    }
+    insights["recommendations"] = _forecast_recommendations(forecast)
+    return insights
+
+def forecast_from_state(state, horizon_days: int = 30) -> ForecastResult:
+    """
+    Forecast any horizon from a user's online forecast state without reading order history
+    The 30-day decayed mean is the current level, its gap to the 90-day mean the trend,
+    continued conservatively (30% per 30 days) as in _calculate_forecast
+    """
+    engine = SimpleCarbonForecastingEngine(None)
+    stats = state_statistics(state) if state is not None else None
+    if stats is None or stats["order_count"] <= 0:
+        return engine._no_orders_forecast()
+
+    order_count = stats["order_count"]
+    if stats["fast_mean"] is None:
+        if order_count < 3:
+            predicted, improvement, confidence = 50.0, 20.0, 0.2
+        else:
+            return engine._insufficient_data_forecast(order_count)
+    else:
+        level = stats["fast_mean"]
+        trend_change = level - stats["slow_mean"]
+        variance = stats["slow_variance"]
+        if order_count < 3:
+            predicted = level
+            improvement = min(20.0, 100.0 - predicted)
+            confidence = 0.4 if order_count == 2 else 0.25
+        else:
+            predicted = max(0.0, min(100.0, level + trend_change * 0.3 * horizon_days / 30))
+            improvement = min(15.0, 100.0 - predicted)
+            if variance < 100:
+                confidence = 0.8
+            elif variance < 400:
+                confidence = 0.6
+            else:
+                confidence = 0.4
+            confidence *= min(1.0, stats["rated_order_count"] / 6)
+
+    if order_count < 3 or stats["fast_mean"] is None:
+        trend_direction, behavioral_score = "stable", 0.5
+    else:
+        if trend_change > 5:
+            trend_direction = "improving"
+        elif trend_change < -5:
+            trend_direction = "declining"
+        elif variance > 400:
+            trend_direction = "volatile"
+        else:
+            trend_direction = "stable"
+        behavioral_score = min(0.9, 1.0 - variance / 1000)
+
+    interval = stats["interval_mean_days"]
+    return ForecastResult(
+        predicted_emissions=float(predicted),
+        predicted_reduction=float(improvement),
+        confidence_score=float(confidence),
+        trend_direction=trend_direction,
+        seasonal_factor=1.0,
+        behavioral_score=float(behavioral_score),
+        prediction_factors={
+            "current_level": stats["fast_mean"],
+            "long_term_level": stats["slow_mean"],
+            "score_variance": stats["slow_variance"],
+            "order_count": order_count,
+            "avg_days_between_orders": interval,
+            "expected_orders_in_horizon": round(horizon_days / interval, 2) if interval else None,
+            "last_order_at": stats["last_order_at"].isoformat() if stats["last_order_at"] else None
+        },
+        algorithm_metadata={
+            "algorithm": "online_decayed_state",
+            "version": "1.0",
+            "horizon_days": horizon_days
+        }
+    )
+
+def _reusable_forecast(user_id: str, horizon_days: int, db: Session) -> Optional[ForecastResult]:
+    try:
+        stored = load_stored_forecast(user_id, db, horizon_days)
+        return forecast_from_stored(stored) if stored is not None else None
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Stored forecast lookup failed for user {user_id}: {str(e)}")
+        return None
+
+def _reusable_insights(user_id: str, insights: Dict[str, Any], db: Session) -> Optional[Dict[str, Any]]:
+    try:
+        stored = load_stored_forecast(user_id, db, FORECAST_HORIZON_DAYS)
+        return _insights_from_stored(user_id, stored, insights, db) if stored is not None else None
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Stored insights lookup failed for user {user_id}: {str(e)}")
+        return None
+
+def _cohort_metrics(user_id: str, db: Session) -> Optional[Dict[str, Any]]:
+    try:
+        return get_user_cohort_metrics(user_id, db)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Cohort metrics lookup failed for user {user_id}: {str(e)}")
+        return None
+
 # Service Functions
-async def generate_carbon_forecast(user_id: str, horizon_days: int, db: Session) -> Dict[str, Any]:
-    """Generate carbon forecast for user"""
+async def generate_carbon_forecast(
+    user_id: str,
+    horizon_days: int,
+    db: Session,
+    reuse_stored: bool = False
+) -> Dict[str, Any]:
+    """Generate carbon forecast for user, or serve the stored one while it is fresh when reuse_stored is set"""
     
-    engine = SimpleCarbonForecastingEngine(db)
-    forecast = await engine.generate_forecast(user_id, horizon_days)
+    forecast = None
+    if reuse_stored:
+        # The engine runs FORECAST_HORIZON_DAYS for every request, so that is the row to match
+        forecast = await run_blocking(_reusable_forecast, user_id, FORECAST_HORIZON_DAYS, db)
+    
+    if forecast is None:
+        engine = SimpleCarbonForecastingEngine(db)
+        forecast = await engine.generate_forecast(user_id, horizon_days)
+        await run_blocking(store_forecast, user_id, forecast, FORECAST_HORIZON_DAYS, db)
     
     return {
         "status": "success",
@@ -502,6 +758,24 @@ async def generate_carbon_forecast(user_id: str, horizon_days: int, db: Session)
         }
     }
 
+async def generate_state_forecast(user_id: str, horizon_days: int, db: Session) -> Dict[str, Any]:
+    """Forecast for any horizon from the user's online forecast state (one primary-key read)"""
+    forecast = forecast_from_state(await run_blocking(get_forecast_state, db, user_id), horizon_days)
+    
+    return {
+        "status": "success",
+        "forecast": {
+            "predicted_sustainability_score": forecast.predicted_emissions,
+            "improvement_potential": forecast.predicted_reduction,
+            "confidence_score": forecast.confidence_score,
+            "trend_direction": forecast.trend_direction,
+            "seasonal_factor": forecast.seasonal_factor,
+            "behavioral_score": forecast.behavioral_score,
+            "prediction_factors": forecast.prediction_factors,
+            "algorithm_metadata": forecast.algorithm_metadata
+        }
+    }
+
 async def get_user_carbon_insights(user_id: str, db: Session) -> Dict[str, Any]:
     """Get user carbon insights using existing data"""
     
@@ -524,6 +798,14 @@ async def get_user_carbon_insights(user_id: str, db: Session) -> Dict[str, Any]:
         "recommendations": ["Start shopping to see personalized insights"]
     }
     
+    # Percentile and vs-average come from the periodically rebuilt score distribution
+    insights["impact_metrics"] = await run_blocking(_cohort_metrics, user_id, db)
+    
+    # Serve the stored forecast and patterns while they are fresh
+    stored_insights = await run_blocking(_reusable_insights, user_id, dict(insights), db)
+    if stored_insights is not None:
+        return stored_insights
+    
     try:
         engine = SimpleCarbonForecastingEngine(db)
         user_data = await engine._gather_user_data(user_id)
@@ -533,13 +815,7 @@ async def get_user_carbon_insights(user_id: str, db: Session) -> Dict[str, Any]:
             # Generate fresh forecast
             forecast = await engine.generate_forecast(user_id, 30)
             
-            insights["latest_forecast"] = {
-                "predicted_sustainability_score": max(0.0, min(100.0, forecast.predicted_emissions * 2.5)),  # Convert to 0-100 scale
-                "improvement_potential": max(0.0, min(100.0, forecast.predicted_reduction * 3.0)),  # Convert to 0-100 scale  
-                "confidence": forecast.confidence_score,
-                "trend": forecast.trend_direction,
-                "created_at": datetime.utcnow().isoformat()
-            }
+            insights["latest_forecast"] = _latest_forecast_insight(forecast, datetime.utcnow())
             
             # Calculate shopping patterns
             order_values = [safe_float_convert(o["order_value"]) for o in orders if o["order_value"]]
@@ -668,22 +944,50 @@ async def get_user_carbon_insights(user_id: str, db: Session) -> Dict[str, Any]:
                 }
             
             # Generate recommendations based on sustainability scores
-            recommendations = []
-            if forecast.trend_direction == "declining":
-                recommendations.append("Consider choosing more sustainable products to improve your sustainability trend")
-            if forecast.confidence_score < 0.6:
-                recommendations.append("More shopping data will improve forecast accuracy")
-            if forecast.behavioral_score < 0.6:
-                recommendations.append("Try to maintain consistent sustainable shopping habits")
+            insights["recommendations"] = _forecast_recommendations(forecast)
             
-            insights["recommendations"] = recommendations
+            # Store the forecast and patterns so later dashboard loads reuse them
+            await run_blocking(
+                store_forecast, user_id, forecast, FORECAST_HORIZON_DAYS, db,
+                shopping_patterns=dict(insights["shopping_patterns"], avg_order_value=avg_order_value) if order_values else None
+            )
     except Exception as e:
         logger.error(f"Error processing user insights for user {user_id}: {str(e)}")
         # Keep the default insights from the first try-catch block
     
     return insights
 
-async def update_forecast_accuracy(forecast_id: int, actual_sustainability_score: float, db: Session):
-    """Placeholder for sustainability score accuracy tracking"""
-    logger.info(f"Would track accuracy for forecast {forecast_id} vs actual sustainability score {actual_sustainability_score}")
-    pass
\ No newline at end of file
+def forecast_accuracy_fields(predicted_score: float, actual_score: float) -> Dict[str, Any]:
+    """
+    Accuracy of a predicted 0-100 sustainability score against the measured one
+    Accuracy is 100 minus the absolute error in score points, floored at 0
+    """
+    error = float(predicted_score) - float(actual_score)
+    if abs(error) < 1e-9:
+        direction = "exact"
+    elif error > 0:
+        direction = "over_predicted"
+    else:
+        direction = "under_predicted"
+    return {
+        "actual_sustainability_score": float(actual_score),
+        "accuracy_percentage": max(0.0, 100.0 - abs(error)),
+        "error_magnitude": abs(error),
+        "error_direction": direction
+    }
+
+async def update_forecast_accuracy(forecast_id: int, actual_sustainability_score: float, db: Session) -> float:
+    """Record how a stored forecast compared with the actual sustainability score; returns the accuracy percentage"""
+    return await run_blocking(record_forecast_accuracy, forecast_id, actual_sustainability_score, db)
+
+def record_forecast_accuracy(forecast_id: int, actual_sustainability_score: float, db: Session) -> float:
+    forecast = db.query(CarbonForecast).filter(CarbonForecast.id == forecast_id).first()
+    if forecast is None:
+        raise ValueError(f"Forecast {forecast_id} not found")
+    
+    fields = forecast_accuracy_fields(forecast.predicted_sustainability_score, actual_sustainability_score)
+    db.add(CarbonForecastAccuracy(forecast_id=forecast_id, **fields))
+    db.commit()
+    
+    logger.info(f"Forecast {forecast_id} accuracy: {fields['accuracy_percentage']:.1f}%")
+    return fields["accuracy_percentage"]
\ No newline at end of file
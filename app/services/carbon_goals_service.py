@@ -2,11 +2,38 @@ from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from decimal import Decimal
+import copy
 import logging
+import math
+import os
+import threading
+import time
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.order_summary_service import (
+    add_order_listener,
+    get_monthly_order_sustainability,
+    get_monthly_order_sustainability_totals
+)
 
 logger = logging.getLogger(__name__)
 
+# Seconds a user's yearly carbon data is served from memory; 0 disables the cache.
+# Entries are dropped when the user's orders or goals change in this process, the TTL bounds staleness across workers
+CARBON_DATA_CACHE_SECONDS = float(os.getenv("CARBON_DATA_CACHE_SECONDS", "300"))
+
+_carbon_data_cache: Dict[Tuple[str, int, int], Tuple[float, dict]] = {}
+_carbon_data_cache_lock = threading.Lock()
+
+def invalidate_carbon_data_cache(user_id: str):
+    """Drop every cached yearly view for the user"""
+    with _carbon_data_cache_lock:
+        for key in [key for key in _carbon_data_cache if key[0] == user_id]:
+            del _carbon_data_cache[key]
+
+add_order_listener(invalidate_carbon_data_cache)
+
 def get_user_carbon_goals(user_id: str, db: Session):
     """Get all carbon goals for a user"""
     try:
@@ -39,6 +66,7 @@ def set_carbon_goal(user_id: str, month: int, goal_value: float, db: Session):
         
         if success:
             db.commit()
+            invalidate_carbon_data_cache(user_id)
             return {
                 "status": 200,
                 "message": "Carbon goal updated successfully",
@@ -75,38 +103,15 @@ def get_carbon_goal(user_id: str, month: int, db: Session):
 def get_monthly_carbon_footprint(user_id: str, month: int, year: int, db: Session):
     """Get carbon footprint score (0-100) for a specific month from orders"""
     try:
-        # Get all orders for the user in the specified month/year
-        query = """
-        SELECT o.id, o.created_at, AVG(sr.value) as avg_sustainability
-        FROM orders o
-        JOIN cart_items ci ON ci.cart_id = o.cart_id
-        JOIN products p ON p.id = ci.product_id
-        LEFT JOIN sustainability_ratings sr ON sr.product_id = p.id
-        WHERE o.user_id = :user_id 
-        AND EXTRACT(MONTH FROM o.created_at) = :month
-        AND EXTRACT(YEAR FROM o.created_at) = :year
-        AND o.state != 'Cancelled'
-        AND sr.value IS NOT NULL
-        GROUP BY o.id, o.created_at
-        """
-        
-        result = db.execute(
-            text(query),
-            {"user_id": user_id, "month": month, "year": year}
-        )
-        orders = result.fetchall()
+        # Per-order averages for the month from the sustainability rollup
+        order_scores = get_monthly_order_sustainability(db, user_id, month, year)
         
-        if not orders:
+        if not order_scores:
             return None  # Return None if no orders for this month
         
         # Calculate average sustainability score across all orders
-        total_sustainability = 0.0
-        valid_orders = 0
-        
-        for order in orders:
-            avg_rating = order.avg_sustainability if order.avg_sustainability else 50.0
-            total_sustainability += avg_rating
-            valid_orders += 1
+        total_sustainability = sum(order_scores)
+        valid_orders = len(order_scores)
         
         # Return average sustainability score (higher = better environmental impact)
         average_score = total_sustainability / valid_orders if valid_orders > 0 else None
@@ -117,49 +122,138 @@ def get_monthly_carbon_footprint(user_id: str, month: int, year: int, db: Sessio
         logger.error(f"Error calculating monthly footprint for user {user_id}: {str(e)}")
         return None  # Return None on error instead of default score
 
+def get_monthly_carbon_goals(user_id: str, db: Session, months: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """Goals for the given months (default all 12) in one round trip, including the defaults get_carbon_goal applies"""
+    result = db.execute(
+        text(
+            "SELECT m AS month, public.get_carbon_goal(:user_id, m) AS goal_value "
+            "FROM unnest(CAST(:months AS integer[])) AS m ORDER BY m"
+        ),
+        {"user_id": user_id, "months": sorted(months) if months is not None else list(range(1, 13))}
+    )
+    return {int(row.month): float(row.goal_value) for row in result.fetchall()}
+
+def _validate_goal_months(months: Iterable[int]) -> List[str]:
+    return [f"month {month} must be between 1 and 12" for month in months if not 1 <= month <= 12]
+
+def set_carbon_goals(user_id: str, goals: Dict[int, float], db: Session):
+    """Set or update goals for any set of months in one statement and one transaction, returning the full goal map"""
+    errors = _validate_goal_months(goals)
+    errors += [
+        f"goal for month {month} must be between 0 and 100"
+        for month, goal_value in goals.items()
+        if not (math.isfinite(goal_value) and 0 <= goal_value <= 100)
+    ]
+    if not goals:
+        errors.append("at least one month goal is required")
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(errors))
+
+    months = sorted(goals)
+    try:
+        success = db.execute(
+            text(
+                "SELECT bool_and(public.set_carbon_goal(:user_id, g.month, g.goal_value)) "
+                "FROM unnest(CAST(:months AS integer[]), CAST(:goal_values AS numeric[])) AS g(month, goal_value)"
+            ),
+            {"user_id": user_id, "months": months, "goal_values": [goals[month] for month in months]}
+        ).scalar()
+        if not success:
+            raise HTTPException(status_code=400, detail="Failed to update carbon goals")
+
+        # Read back inside the same transaction so the map reflects exactly what was written
+        goal_map = get_monthly_carbon_goals(user_id, db)
+        db.commit()
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error setting carbon goals for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error setting carbon goals: {str(e)}")
+
+    invalidate_carbon_data_cache(user_id)
+    return {
+        "status": 200,
+        "message": "Carbon goals updated successfully",
+        "updated_months": months,
+        "goals": goal_map
+    }
+
+def get_carbon_goals(user_id: str, db: Session, months: Optional[List[int]] = None):
+    """Get goals for any set of months (default all 12) in one statement"""
+    errors = _validate_goal_months(months or [])
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(errors))
+
+    try:
+        goal_map = get_monthly_carbon_goals(user_id, db, set(months) if months else None)
+    except Exception as e:
+        logger.error(f"Error fetching carbon goals for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching carbon goals: {str(e)}")
+
+    return {
+        "status": 200,
+        "message": "Success",
+        "goals": goal_map
+    }
+
 def get_user_carbon_data(user_id: str, db: Session):
     """Get complete carbon data for the user including monthly sustainability scores and goals"""
     try:
         current_date = datetime.now()
         current_month = current_date.month
         current_year = current_date.year
-        
+
+        # The headline figures depend on the current month, so it is part of the key
+        cache_key = (user_id, current_year, current_month)
+        if CARBON_DATA_CACHE_SECONDS > 0:
+            with _carbon_data_cache_lock:
+                cached = _carbon_data_cache.get(cache_key)
+            if cached and time.monotonic() - cached[0] < CARBON_DATA_CACHE_SECONDS:
+                return copy.deepcopy(cached[1])
+
+        last_month = current_month - 1
+        last_year = current_year
+        if last_month == 0:
+            last_month = 12
+            last_year -= 1
+
+        # One grouped query covers this year and, in January, last December
+        monthly_totals = get_monthly_order_sustainability_totals(
+            db, user_id,
+            min(datetime(current_year, 1, 1), datetime(last_year, last_month, 1)),
+            datetime(current_year + 1, 1, 1)
+        )
+        goals = get_monthly_carbon_goals(user_id, db)
+
+        def month_score(year: int, month: int):
+            total, orders = monthly_totals.get((year, month), (0.0, 0))
+            return round(total / orders, 1) if orders else None
+
         # Get monthly data for all 12 months of the current year
         monthly_data = []
         valid_monthly_scores = []  # Only scores from months with actual orders
-        
+
         for month_num in range(1, 13):  # January to December
-            # Get month name
             month_name = datetime(current_year, month_num, 1).strftime('%b')
-            
-            # Get sustainability score for this month (0-100)
-            score = get_monthly_carbon_footprint(user_id, month_num, current_year, db)
-            
-            # Get goal for this month
-            goal_result = get_carbon_goal(user_id, month_num, db)
-            goal = goal_result["goal_value"]
-            
+            score = month_score(current_year, month_num)
+
             monthly_data.append({
                 "month": month_name,
                 "footprint": score if score is not None else 0,  # Use 0 for months with no orders
-                "goal": goal
+                "goal": goals[month_num]
             })
-            
+
             # Only include months with actual orders in yearly average calculation
             if score is not None and score > 0:
                 valid_monthly_scores.append(score)
                 logger.info(f"Including {month_name} ({month_num}) with score {score} in yearly average")
-        
+
         # Calculate current and last month scores
-        monthly_score = get_monthly_carbon_footprint(user_id, current_month, current_year, db)
-        
-        last_month = current_month - 1
-        last_year = current_year
-        if last_month == 0:
-            last_month = 12
-            last_year -= 1
-        last_month_score = get_monthly_carbon_footprint(user_id, last_month, last_year, db)
-        
+        monthly_score = month_score(current_year, current_month)
+        last_month_score = month_score(last_year, last_month)
+
         # Calculate average score for the year (only from months with actual orders)
         if len(valid_monthly_scores) > 0:
             average_yearly_score = sum(valid_monthly_scores) / len(valid_monthly_scores)
@@ -167,10 +261,10 @@ def get_user_carbon_data(user_id: str, db: Session):
         else:
             average_yearly_score = 0
             logger.info("No months with orders found, yearly average = 0")
-        
+
         logger.info(f"User {user_id} - Yearly calculation: valid_scores={valid_monthly_scores}, average={average_yearly_score}")
-        
-        return {
+
+        carbon_data = {
             "status": 200,
             "message": "Success",
             "data": {
@@ -181,7 +275,12 @@ def get_user_carbon_data(user_id: str, db: Session):
                 "monthlyData": monthly_data
             }
         }
-        
+
+        if CARBON_DATA_CACHE_SECONDS > 0:
+            with _carbon_data_cache_lock:
+                _carbon_data_cache[cache_key] = (time.monotonic(), copy.deepcopy(carbon_data))
+        return carbon_data
+
     except Exception as e:
         logger.error(f"Error fetching carbon data for user {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching carbon data: {str(e)}")
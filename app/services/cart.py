@@ -1,8 +1,44 @@
-from sqlalchemy.orm import Session
+"""
+Cart service
+Every mutation runs in one transaction with one commit. The user's current cart is the one with
+status "active" (a partial unique index keeps it to one per user), so finding it is a single indexed
+lookup instead of a cart query plus an order lookup. Lines are written with
+INSERT ... ON CONFLICT (cart_id, product_id) DO UPDATE after their stock hold is moved to the new
+quantity (see app.services.stock_reservation), which is the stock check. A batch of line changes
+(PATCH /cart) is folded per product and written with one DELETE and one upsert, and the cart comes
+back with its prices and totals from one query
+
+Add the status column and unique indexes to an existing database with:
+    python -m app.services.cart
+It marks carts that are already in an order as ordered, keeps only each user's latest other cart
+active, merges duplicate cart lines and is safe to re-run
+"""
+import json
+import logging
+from typing import Dict, Any, List
+
+from fastapi import HTTPException
+from sqlalchemy import delete, exists, func, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload
+
 from app.models.cart import Cart
 from app.models.cart_item import CartItem
 from app.models.orders import Order
-from app.schemas.cart import CartItemCreate
+from app.models.product import Product
+from app.models.product_images import ProductImage
+from app.schemas.cart import CartItemCreate, CartOperation
+from app.services.stock_reservation import cart_availability, hold_stock
+from app.services.sustainabilityRatings_service import dynamicSustainabilityScoreSubquery
+
+logger = logging.getLogger(__name__)
+
+CART_ACTIVE = "active"
+CART_ORDERED = "ordered"
+CART_ABANDONED = "abandoned"
+
+# The cart page's EcoMeter counts products without a score (or scoring 0) as poor
+UNRATED_CART_SUSTAINABILITY = 30
 
 def get_or_create_cart(db: Session, user_id: str):
     cart = db.query(Cart).filter(Cart.user_id == user_id).first()
@@ -13,79 +49,298 @@ def get_or_create_cart(db: Session, user_id: str):
         db.refresh(cart)
     return cart
 
-def add_item(db: Session, user_id: str, item: CartItemCreate):
-    from app.models.product import Product
-    from fastapi import HTTPException
-    from app.utilities.stock_utils import sync_stock_status, is_product_available
-    
-    # Check if product exists
-    product = db.query(Product).filter(Product.id == item.product_id).first()
+def _active_cart_id(db: Session, user_id: str) -> int:
+    """Id of the user's active cart, inserted in the caller's transaction if they have none"""
+    active = select(Cart.id).where(Cart.user_id == user_id, Cart.status == CART_ACTIVE)
+    cart_id = db.execute(active).scalar()
+    if cart_id is None:
+        cart_id = db.execute(
+            pg_insert(Cart)
+            .values(user_id=user_id, status=CART_ACTIVE)
+            .on_conflict_do_nothing(index_elements=[Cart.user_id], index_where=text(f"status = '{CART_ACTIVE}'"))
+            .returning(Cart.id)
+        ).scalar()
+    if cart_id is None:
+        # A concurrent request created it first; its row is visible once that insert commits
+        cart_id = db.execute(active).scalar_one()
+    return cart_id
+
+def _add_item_error(db: Session, cart_id: int, item: CartItemCreate, existing: int) -> HTTPException:
+    """Why the hold wasn't taken: the product is missing or the cart's new quantity isn't available"""
+    product = cart_availability(db, cart_id, [item.product_id]).get(item.product_id)
     if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Sync stock status first to ensure data consistency
-    sync_stock_status(db, product.id)
-    
-    # Refresh product data after sync
-    db.refresh(product)
-    
-    # Check if product is available for the requested quantity
-    is_available, reason = is_product_available(product, item.quantity)
-    if not is_available:
-        raise HTTPException(status_code=400, detail=reason)
-    
-    cart = get_cart(db, user_id)
-    existing = db.query(CartItem).filter_by(cart_id=cart.id, product_id=item.product_id).first()
+        return HTTPException(status_code=404, detail="Product not found")
 
-    if existing:
-        # Check if adding more would exceed available stock
-        new_quantity = existing.quantity + item.quantity
-        is_available, reason = is_product_available(product, new_quantity)
-        if not is_available:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Cannot add {item.quantity} more of '{product.name}'. You already have {existing.quantity} in cart. {reason}"
-            )
-        existing.quantity = new_quantity
+    available = max(0, product.available)
+    if available <= 0:
+        reason = f"Product '{product.name}' is out of stock"
     else:
-        existing = CartItem(cart_id=cart.id, product_id=item.product_id, quantity=item.quantity)
-        db.add(existing)
+        reason = f"Not enough stock for '{product.name}'. Available: {available}, Requested: {existing + item.quantity}"
+    if existing:
+        reason = f"Cannot add {item.quantity} more of '{product.name}'. You already have {existing} in cart. {reason}"
+    return HTTPException(status_code=400, detail=reason)
+
+def _write_lines(db: Session, cart_id: int, quantities: Dict[int, int]):
+    """Upsert the cart's lines to the given quantities"""
+    upsert = pg_insert(CartItem).values([
+        {"cart_id": cart_id, "product_id": product_id, "quantity": quantity}
+        for product_id, quantity in sorted(quantities.items())
+    ])
+    return db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.product_id],
+            set_={"quantity": upsert.excluded.quantity}
+        ).returning(CartItem.id, CartItem.cart_id, CartItem.product_id, CartItem.quantity)
+    )
+
+def add_item(db: Session, user_id: str, item: CartItemCreate) -> Dict[str, Any]:
+    """Add to the user's active cart (creating it if needed), holding the stock for it, with one commit"""
+    cart_id = _active_cart_id(db, user_id)
 
+    existing = db.execute(
+        select(CartItem.quantity)
+        .where(CartItem.cart_id == cart_id, CartItem.product_id == item.product_id)
+        .with_for_update()
+    ).scalar() or 0
+    quantity = existing + item.quantity
+
+    # The hold is the stock check: it only succeeds if the product has that much unreserved
+    if hold_stock(db, cart_id, {item.product_id: quantity}):
+        error = _add_item_error(db, cart_id, item, existing)
+        db.rollback()
+        raise error
+
+    row = _write_lines(db, cart_id, {item.product_id: quantity}).first()
     db.commit()
-    db.refresh(existing)
-    return existing
+    return dict(row._mapping)
 
 def get_cart(db: Session, user_id: str):
-    cart = db.query(Cart).filter(Cart.user_id == user_id).order_by(Cart.created_at.desc()).first()
-    
-    # If no cart exists for this user, create a new one
+    """The user's active cart with its items, created (and committed) if they have none"""
+    active = (
+        db.query(Cart)
+        .options(selectinload(Cart.items))
+        .filter(Cart.user_id == user_id, Cart.status == CART_ACTIVE)
+    )
+    cart = active.first()
     if not cart:
-        cart = Cart(user_id=user_id)
-        db.add(cart)
+        _active_cart_id(db, user_id)
         db.commit()
-        db.refresh(cart)
-        return cart
-    
-    # Check if this cart is already used in an order
-    order = db.query(Order).filter(Order.user_id == user_id, Order.cart_id == cart.id).first()
-    if order:
-        # If cart is already used in an order, create a new cart
-        cart = Cart(user_id=user_id)
-        db.add(cart)
-        db.commit()
-        db.refresh(cart)
-
+        cart = active.first()
     return cart
 
+def mark_cart_ordered(db: Session, cart_id: int):
+    """Take the cart out of use in the caller's (checkout) transaction; the user's next mutation starts a new one"""
+    db.execute(
+        update(Cart)
+        .where(Cart.id == cart_id)
+        .values(status=CART_ORDERED)
+        .execution_options(synchronize_session=False)
+    )
+
 def remove_item(db: Session, user_id: str, product_id: int):
-    cart = db.query(Cart).filter(Cart.user_id == user_id).order_by(Cart.created_at.desc()).first()
-    if not cart:
+    """Delete the product's line from the user's active cart and release its hold"""
+    cart_id = db.execute(select(Cart.id).where(Cart.user_id == user_id, Cart.status == CART_ACTIVE)).scalar()
+    if cart_id is None:
         return False
-    item = db.query(CartItem).filter_by(cart_id=cart.id, product_id=product_id).first()
-    if item:
-        db.delete(item)
-        db.commit()
-        return True
-    return False
+    removed = db.execute(
+        delete(CartItem)
+        .where(CartItem.cart_id == cart_id, CartItem.product_id == product_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    hold_stock(db, cart_id, {product_id: 0})
+    db.commit()
+    return removed > 0
+
+def _cart_targets(current: Dict[int, int], operations: List[CartOperation]) -> Dict[int, int]:
+    """Apply the operations in order to the current line quantities; 0 means the line is removed"""
+    targets = dict(current)
+    for operation in operations:
+        if operation.op == "add":
+            targets[operation.product_id] = targets.get(operation.product_id, 0) + operation.quantity
+        elif operation.op == "set":
+            targets[operation.product_id] = operation.quantity
+        else:
+            targets[operation.product_id] = 0
+    return targets
+
+def _batch_error(db: Session, cart_id: int, short: Dict[int, int]) -> HTTPException:
+    """404 for products that don't exist, otherwise 400 naming each line that can't be held"""
+    products = cart_availability(db, cart_id, short)
+    missing = sorted(set(short) - set(products))
+    if missing:
+        return HTTPException(status_code=404, detail=f"Products not found: {missing}")
+    return HTTPException(status_code=400, detail="; ".join(
+        f"Not enough stock for '{products[product_id].name}'. Available: {max(0, products[product_id].available)}, "
+        f"Requested: {quantity}"
+        for product_id, quantity in sorted(short.items())
+    ))
+
+def update_cart(db: Session, user_id: str, operations: List[CartOperation]) -> Dict[str, Any]:
+    """
+    Apply a batch of add, set and remove operations to the user's active cart atomically and return its summary
+    The touched lines are read (and locked) once and the batch is folded into a target quantity per product;
+    the holds are moved to those targets, then one DELETE and one upsert write the lines. If any line
+    can't be held nothing is applied
+    """
+    cart_id = _active_cart_id(db, user_id)
+    touched = sorted({operation.product_id for operation in operations})
+
+    current = {}
+    if touched:
+        current = dict(db.execute(
+            select(CartItem.product_id, CartItem.quantity)
+            .where(CartItem.cart_id == cart_id, CartItem.product_id.in_(touched))
+            .with_for_update()
+        ).all())
+    targets = _cart_targets(current, operations)
+
+    short = hold_stock(db, cart_id, {product_id: targets[product_id] for product_id in touched})
+    if short:
+        error = _batch_error(db, cart_id, {product_id: targets[product_id] for product_id in short})
+        db.rollback()
+        raise error
+
+    removed = [product_id for product_id in touched if targets[product_id] == 0 and product_id in current]
+    if removed:
+        db.execute(
+            delete(CartItem)
+            .where(CartItem.cart_id == cart_id, CartItem.product_id.in_(removed))
+            .execution_options(synchronize_session=False)
+        )
+    changed = {
+        product_id: targets[product_id]
+        for product_id in touched
+        if targets[product_id] > 0 and targets[product_id] != current.get(product_id)
+    }
+    if changed:
+        _write_lines(db, cart_id, changed)
+
+    db.commit()
+    return get_cart_summary(db, cart_id)
+
+def get_cart_summary(db: Session, cart_id: int) -> Dict[str, Any]:
+    """
+    The cart's lines with current prices, weighted sustainability scores and first images from one query,
+    plus its totals. As in the EcoMeter, unrated products count as UNRATED_CART_SUSTAINABILITY;
+    lines whose product is gone are left out
+    """
+    rating = func.coalesce(func.nullif(dynamicSustainabilityScoreSubquery(Product.id), 0), UNRATED_CART_SUSTAINABILITY)
+    first_image = (
+        select(ProductImage.image_url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        select(
+            Cart.id.label("cart_id"),
+            Cart.user_id,
+            Product.id.label("product_id"),
+            Product.name,
+            func.coalesce(Product.price, 0).label("price"),
+            CartItem.quantity,
+            (CartItem.quantity * func.coalesce(Product.price, 0)).label("line_total"),
+            rating.label("sustainability_rating"),
+            first_image.label("image_url")
+        )
+        .select_from(Cart)
+        .outerjoin(CartItem, CartItem.cart_id == Cart.id)
+        .outerjoin(Product, Product.id == CartItem.product_id)
+        .where(Cart.id == cart_id)
+        .order_by(CartItem.id)
+    ).all()
+
+    items = [
+        {
+            "product_id": row.product_id,
+            "name": row.name,
+            "price": float(row.price),
+            "quantity": row.quantity,
+            "line_total": float(row.line_total),
+            "sustainability_rating": float(row.sustainability_rating),
+            "image_url": row.image_url
+        }
+        for row in rows if row.product_id is not None
+    ]
+    ratings = [item["sustainability_rating"] for item in items]
+    return {
+        "id": rows[0].cart_id,
+        "user_id": rows[0].user_id,
+        "items": items,
+        "item_count": sum(item["quantity"] for item in items),
+        "total_amount": round(sum((item["line_total"] for item in items), 0.0), 2),
+        "average_sustainability": round(sum(ratings) / len(ratings), 2) if ratings else 0.0
+    }
+
+def migrate_carts(db: Session) -> Dict[str, int]:
+    """Backfill cart statuses and merge duplicate lines so the unique indexes can be built"""
+    ordered = db.execute(
+        update(Cart)
+        .where(Cart.status == CART_ACTIVE, exists().where(Order.cart_id == Cart.id))
+        .values(status=CART_ORDERED)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # The old lookup used each user's newest cart (a fresh one if that was ordered), so older carts are abandoned
+    newest = (
+        select(
+            Cart.id,
+            func.row_number().over(partition_by=Cart.user_id, order_by=(Cart.created_at.desc(), Cart.id.desc())).label("rank")
+        )
+        .subquery()
+    )
+    abandoned = db.execute(
+        update(Cart)
+        .where(Cart.status == CART_ACTIVE, Cart.id.in_(select(newest.c.id).where(newest.c.rank > 1)))
+        .values(status=CART_ABANDONED)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    duplicates = db.execute(
+        select(
+            CartItem.cart_id,
+            CartItem.product_id,
+            func.min(CartItem.id).label("keep_id"),
+            func.sum(CartItem.quantity).label("quantity")
+        )
+        .group_by(CartItem.cart_id, CartItem.product_id)
+        .having(func.count() > 1)
+    ).all()
+    merged = 0
+    if duplicates:
+        db.execute(update(CartItem), [{"id": row.keep_id, "quantity": int(row.quantity)} for row in duplicates])
+        merged = db.execute(
+            delete(CartItem)
+            .where(
+                tuple_(CartItem.cart_id, CartItem.product_id).in_([(row.cart_id, row.product_id) for row in duplicates]),
+                CartItem.id.notin_([row.keep_id for row in duplicates])
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    db.commit()
+    return {"ordered": ordered, "abandoned": abandoned, "merged_lines": merged}
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE carts ADD COLUMN IF NOT EXISTS status VARCHAR(16) NOT NULL DEFAULT 'active'"))
+
+    db = SessionLocal()
+    try:
+        totals = migrate_carts(db)
+    finally:
+        db.close()
+
+    for index in list(Cart.__table__.indexes) + list(CartItem.__table__.indexes):
+        if index.unique:
+            index.create(bind=engine, checkfirst=True)
+    print(json.dumps(totals))
 
 
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,37 @@
 import os
+import json
+import uuid
 import boto3
 from botocore.exceptions import ClientError
 from typing import Dict, List, Optional
 from jinja2 import Template
 import logging
 from datetime import datetime, timedelta
+from pathlib import Path
 import base64
 
+from app.db.executor import run_blocking
+
 logger = logging.getLogger(__name__)
 
+class FileEmailSink:
+    """Local stand-in for the SES client that writes each sent message to a JSON file (EMAIL_SINK_DIR)"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def send_email(self, Source: str, Destination: Dict, Message: Dict, **kwargs) -> Dict:
+        message_id = uuid.uuid4().hex
+        (self.directory / f"{message_id}.json").write_text(json.dumps({
+            "MessageId": message_id,
+            "Source": Source,
+            "Destination": Destination,
+            "Message": Message,
+            "sent_at": datetime.utcnow().isoformat()
+        }))
+        return {"MessageId": message_id}
+
 class EmailService:
     def __init__(self):
         self.ses_client = None
@@ -23,6 +46,12 @@ class EmailService:
         logger.info(f"AWS_ACCESS_KEY_ID: {'SET' if os.getenv('AWS_ACCESS_KEY_ID') else 'NOT SET'}")
         logger.info(f"AWS_SECRET_ACCESS_KEY: {'SET' if os.getenv('AWS_SECRET_ACCESS_KEY') else 'NOT SET'}")
         
+        sink_dir = os.getenv('EMAIL_SINK_DIR')
+        if sink_dir:
+            self.ses_client = FileEmailSink(sink_dir)
+            logger.info(f"Writing emails to {sink_dir} instead of sending them through SES")
+            return
+        
         try:
             self.ses_client = boto3.client(
                 'ses',
@@ -636,7 +665,9 @@ class EmailService:
             return False
         
         try:
-            response = self.ses_client.send_email(
+            # boto3 is synchronous; keep the SES round trip off the event loop
+            response = await run_blocking(
+                self.ses_client.send_email,
                 Source=f"{self.from_name} <{self.from_email}>",
                 Destination={
                     'ToAddresses': [to_email]
@@ -0,0 +1,111 @@
+"""
+In-process cache for the dashboard's polled forecast endpoints
+Results are kept per (kind, user, horizon). Within FORECAST_CACHE_FRESH_SECONDS they are served as is;
+after that, up to FORECAST_CACHE_MAX_STALE_SECONDS, the cached value is still served while a background
+task recomputes it on its own session (stale-while-revalidate). An order placed or cancelled by the user
+drops their entries, so the next poll recomputes against the new order
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.services.order_summary_service import add_order_listener
+
+logger = logging.getLogger(__name__)
+
+FORECAST_CACHE_FRESH_SECONDS = 300
+FORECAST_CACHE_MAX_STALE_SECONDS = 6 * 3600
+
+CacheKey = Tuple[str, str, int]  # (kind, user_id, horizon_days)
+Compute = Callable[[Session], Awaitable[Any]]
+
+
+@dataclass
+class _Entry:
+    value: Any
+    computed_at: float
+
+
+_entries: Dict[CacheKey, _Entry] = {}
+_generations: Dict[str, int] = {}  # Bumped per user on every invalidation
+_refreshing: Set[CacheKey] = set()
+_refresh_tasks: Set[asyncio.Task] = set()
+_lock = threading.Lock()
+
+
+def invalidate_user(user_id: str):
+    """Drop every cached result for the user; refreshes already running for them are discarded"""
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        for key in [key for key in _entries if key[1] == user_id]:
+            del _entries[key]
+
+
+add_order_listener(invalidate_user)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _generations.clear()
+        _refreshing.clear()
+
+
+def _store(key: CacheKey, value: Any, generation: int):
+    with _lock:
+        # An order event since the computation started makes the value outdated
+        if _generations.get(key[1], 0) == generation:
+            _entries[key] = _Entry(value, time.monotonic())
+
+
+async def _refresh(key: CacheKey, compute: Compute, generation: int):
+    from app.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        _store(key, await compute(db), generation)
+    except Exception as e:
+        logger.warning(f"Background refresh of {key} failed: {str(e)}")
+    finally:
+        db.close()
+        with _lock:
+            _refreshing.discard(key)
+
+
+def _schedule_refresh(key: CacheKey, compute: Compute):
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+        generation = _generations.get(key[1], 0)
+    task = asyncio.get_running_loop().create_task(_refresh(key, compute, generation))
+    _refresh_tasks.add(task)  # Keep a reference until the task finishes
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def get_cached(kind: str, user_id: str, horizon_days: int, compute: Compute, db: Session) -> Any:
+    """
+    Cached result of compute for the key, computing it with the request's session on a miss
+    compute must build its result from the session it is given; cached values are shared and must not be mutated
+    """
+    key = (kind, user_id, horizon_days)
+    with _lock:
+        entry = _entries.get(key)
+        generation = _generations.get(user_id, 0)
+
+    if entry is not None:
+        age = time.monotonic() - entry.computed_at
+        if age < FORECAST_CACHE_FRESH_SECONDS:
+            return entry.value
+        if age < FORECAST_CACHE_MAX_STALE_SECONDS:
+            _schedule_refresh(key, compute)
+            return entry.value
+
+    value = await compute(db)
+    _store(key, value, generation)
+    return value
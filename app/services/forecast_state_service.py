@@ -0,0 +1,208 @@
+"""
+Online per-user forecast state
+Each order folds into time-decayed sums of its sustainability score and of the gap since the previous
+order, so placing or cancelling an order is an O(1) update of one user_forecast_state row.
+Decayed sums make cancellation exact: an order's contribution is its decayed weight, which can be
+subtracted again without reading the order history
+
+Rebuild all states from order_sustainability_summary with:
+    python -m app.services.forecast_state_service
+"""
+import json
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.carbon_forecasting import UserForecastState
+from app.models.order_sustainability_summary import OrderSustainabilitySummary
+
+logger = logging.getLogger(__name__)
+
+FAST_DECAY_DAYS = 30.0  # Same recency weighting as SimpleCarbonForecastingEngine._calculate_time_weight
+SLOW_DECAY_DAYS = 90.0
+
+# Rating used by forecasting for orders whose products have no sustainability ratings
+UNRATED_ORDER_SUSTAINABILITY = 2.5
+
+_SCORE_SUMS = ("fast_weight", "fast_score_sum", "fast_score_sq_sum",
+               "slow_weight", "slow_score_sum", "slow_score_sq_sum")
+
+
+def order_sustainability_score(rating: Optional[float]) -> float:
+    """Order rating normalised to 0-100 the same way the forecasting engine does"""
+    rating = UNRATED_ORDER_SUSTAINABILITY if rating is None else float(rating)
+    if rating <= 0:
+        return 0.0
+    if rating <= 5.0:
+        return rating * 20
+    if rating <= 10.0:
+        return rating * 10
+    return min(100.0, rating)
+
+
+def _days_between(later: datetime, earlier: datetime) -> float:
+    return (later - earlier).total_seconds() / 86400
+
+
+def apply_order_event(state: UserForecastState, created_at: datetime, rating: Optional[float], sign: int = 1):
+    """
+    Fold an order into (sign=1) or out of (sign=-1) the state
+    Sums are kept relative to reference_at, the newest order time seen; older orders enter with their decayed weight
+    """
+    for field in _SCORE_SUMS + ("interval_weight", "interval_sum", "interval_sq_sum"):
+        if getattr(state, field) is None:
+            setattr(state, field, 0.0)
+    state.order_count = (state.order_count or 0) + sign
+    state.rated_order_count = state.rated_order_count or 0
+
+    if state.reference_at is None or created_at > state.reference_at:
+        if state.reference_at is not None:
+            age = _days_between(created_at, state.reference_at)
+            fast, slow = math.exp(-age / FAST_DECAY_DAYS), math.exp(-age / SLOW_DECAY_DAYS)
+            state.fast_weight *= fast
+            state.fast_score_sum *= fast
+            state.fast_score_sq_sum *= fast
+            state.slow_weight *= slow
+            state.slow_score_sum *= slow
+            state.slow_score_sq_sum *= slow
+            state.interval_weight *= slow
+            state.interval_sum *= slow
+            state.interval_sq_sum *= slow
+        state.reference_at = created_at
+        fast_weight = slow_weight = 1.0
+    else:
+        age = _days_between(state.reference_at, created_at)
+        fast_weight, slow_weight = math.exp(-age / FAST_DECAY_DAYS), math.exp(-age / SLOW_DECAY_DAYS)
+
+    score = order_sustainability_score(rating)
+    if score > 0:
+        state.rated_order_count += sign
+        state.fast_weight += sign * fast_weight
+        state.fast_score_sum += sign * fast_weight * score
+        state.fast_score_sq_sum += sign * fast_weight * score * score
+        state.slow_weight += sign * slow_weight
+        state.slow_score_sum += sign * slow_weight * score
+        state.slow_score_sq_sum += sign * slow_weight * score * score
+        if state.rated_order_count <= 0:
+            # Nothing left to describe; drop floating point residue
+            state.rated_order_count = 0
+            for field in _SCORE_SUMS:
+                setattr(state, field, 0.0)
+
+    # Order timing only moves forward: a cancelled order still marks when the user shopped
+    if sign > 0 and (state.last_order_at is None or created_at > state.last_order_at):
+        if state.last_order_at is not None:
+            gap = _days_between(created_at, state.last_order_at)
+            state.interval_weight += slow_weight
+            state.interval_sum += slow_weight * gap
+            state.interval_sq_sum += slow_weight * gap * gap
+        state.last_order_at = created_at
+
+
+def state_statistics(state: UserForecastState) -> Dict[str, Any]:
+    """Means and variances of order sustainability and order intervals described by the state"""
+
+    def mean_and_variance(weight, total, squares):
+        if not weight or weight <= 1e-12:
+            return None, 0.0
+        mean = total / weight
+        return mean, max(0.0, squares / weight - mean * mean)
+
+    fast_mean, fast_variance = mean_and_variance(state.fast_weight, state.fast_score_sum, state.fast_score_sq_sum)
+    slow_mean, slow_variance = mean_and_variance(state.slow_weight, state.slow_score_sum, state.slow_score_sq_sum)
+    interval_mean, interval_variance = mean_and_variance(
+        state.interval_weight, state.interval_sum, state.interval_sq_sum
+    )
+    return {
+        "order_count": state.order_count or 0,
+        "rated_order_count": state.rated_order_count or 0,
+        "fast_mean": fast_mean,
+        "fast_variance": fast_variance,
+        "slow_mean": slow_mean,
+        "slow_variance": slow_variance,
+        "interval_mean_days": interval_mean,
+        "interval_variance_days": interval_variance,
+        "last_order_at": state.last_order_at
+    }
+
+
+def record_order_event(db: Session, user_id: str, created_at: datetime, rating: Optional[float], sign: int = 1):
+    """Apply an order event to the user's state row inside the caller's transaction"""
+    state = (
+        db.query(UserForecastState)
+        .filter(UserForecastState.user_id == user_id)
+        .with_for_update()
+        .first()
+    )
+    if state is None:
+        state = UserForecastState(user_id=user_id)
+        db.add(state)
+    apply_order_event(state, created_at, rating, sign)
+
+
+def get_forecast_state(db: Session, user_id: str) -> Optional[UserForecastState]:
+    return db.query(UserForecastState).filter(UserForecastState.user_id == user_id).first()
+
+
+def rebuild_forecast_states(db: Session, batch_size: int = 5000) -> Dict[str, Any]:
+    """
+    Recreate every user's state by replaying non-cancelled order summaries in time order
+    Rows are streamed per user, and each user's state is written once
+    """
+    start_time = time.monotonic()
+    db.query(UserForecastState).delete()
+
+    rows = (
+        db.query(
+            OrderSustainabilitySummary.user_id,
+            OrderSustainabilitySummary.order_created_at,
+            OrderSustainabilitySummary.avg_sustainability
+        )
+        .filter(OrderSustainabilitySummary.cancelled.is_(False))
+        .order_by(OrderSustainabilitySummary.user_id, OrderSustainabilitySummary.order_created_at)
+        .yield_per(batch_size)
+    )
+
+    totals = {"users": 0, "orders": 0}
+    state = None
+    pending = []
+    for user_id, created_at, rating in rows:
+        if state is None or state.user_id != user_id:
+            state = UserForecastState(user_id=user_id)
+            pending.append(state)
+            totals["users"] += 1
+        apply_order_event(state, created_at, rating)
+        totals["orders"] += 1
+
+        if len(pending) > batch_size:
+            # Flush finished users; the current one may still receive orders
+            db.add_all(pending[:-1])
+            db.flush()
+            pending = pending[-1:]
+
+    db.add_all(pending)
+    db.commit()
+    totals["elapsed_seconds"] = round(time.monotonic() - start_time, 2)
+    return totals
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    UserForecastState.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        totals = rebuild_forecast_states(db)
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
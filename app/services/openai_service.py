@@ -3,8 +3,12 @@ OpenAI Integration Service for Sustainability Q&A
 Handles 4 specific sustainability reasoning endpoints using GPT-5 Nano via OpenAI SDK
 """
 import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, Any, Optional
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable, AsyncIterator
 from datetime import datetime
 
 from app.services.smart_structures import SmartLogger
@@ -13,13 +17,272 @@ from openai import AsyncOpenAI
 logger = logging.getLogger(__name__)
 
 
+class SingleFlight:
+    """
+    Request coalescing for identical concurrent OpenAI calls
+    The first caller for a key starts the call; later callers await the same task
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.total_calls = 0
+        self.leader_calls = 0
+        self.coalesced_calls = 0
+        self.max_waiters = 0
+
+    def get(self, key: str) -> Optional[asyncio.Future]:
+        """Return the in-flight task for a key, if any"""
+        return self._inflight.get(key)
+
+    def lead(self, key: str) -> asyncio.Future:
+        """
+        Register the caller as the in-flight call for a key and return the future it must resolve
+        Used by streamed calls; concurrent callers of run() with the same key await its final result
+        """
+        self.total_calls += 1
+        self.leader_calls += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._waiters[key] = 0
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run call() once per key at a time and share its result with every concurrent caller"""
+        self.total_calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.leader_calls += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced_calls += 1
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+        # Shield so one disconnecting client does not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        # Mark the exception as retrieved when every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Coalescing metrics for monitoring endpoints"""
+        return {
+            "total_calls": self.total_calls,
+            "upstream_calls": self.leader_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "dedup_ratio": round(self.coalesced_calls / self.total_calls, 4) if self.total_calls else 0.0,
+            "in_flight": len(self._inflight),
+            "current_waiters": sum(self._waiters.values()),
+            "max_waiters": self.max_waiters,
+        }
+
+
+class ResponseCache:
+    """
+    Small in-process TTL cache of completed OpenAI responses keyed by prompt
+    Oldest entries are evicted once max_entries is reached
+    """
+
+    def __init__(self, ttl_seconds: int = 900, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[str]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Return (content, model_used) for a fresh entry, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, content, model_used = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return content, model_used
+
+    def set(self, key: str, content: str, model_used: Optional[str]):
+        self._entries[key] = (time.monotonic(), content, model_used)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: str):
+        self._entries.pop(key, None)
+
+
+class CircuitBreaker:
+    """
+    Stops calling OpenAI after repeated failed requests
+    closed -> open after failure_threshold consecutive failures; after reset_timeout
+    one probe request is let through (half_open) and its outcome closes or reopens the breaker
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.total_failures = 0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                logger.warning(f"OpenAI circuit breaker opened after {self.consecutive_failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def get_state(self) -> Dict[str, Any]:
+        """Breaker state for health endpoints"""
+        retry_in = None
+        if self.state == "open" and self.opened_at is not None:
+            retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "total_failures": self.total_failures,
+            "times_opened": self.times_opened,
+            "retry_in_seconds": retry_in,
+        }
+
+
+# Shared across service instances, which are created per request
+_inflight_requests = SingleFlight()
+_response_cache = ResponseCache()
+_circuit_breaker = CircuitBreaker()
+
+# End-to-end latency budgets (seconds) per endpoint; retries stop once the budget is spent
+LATENCY_BUDGETS = {
+    "q1": 8.0,
+    "q2": 8.0,
+    "q4": 8.0,
+    "explain": 12.0,
+    "ai_health": 5.0,
+}
+
+# Reported as the model for answers built from templates instead of an LLM
+TEMPLATE_MODEL = "template"
+
+# The 4 /explain sections and the question logged for each
+EXPLANATION_QUESTIONS = {
+    "why_recommended": "Why was this product recommended?",
+    "sustainability_analysis": "How sustainable is this product?",
+    "alternatives_comparison": "What are alternatives and why is this product better?",
+    "ecometer_impact": "How does this product affect the EcoMeter score?",
+}
+EXPLANATION_KEYS = list(EXPLANATION_QUESTIONS)
+EXPLANATION_FALLBACKS = {
+    "why_recommended": "Unable to generate explanation",
+    "sustainability_analysis": "Unable to analyze sustainability",
+    "alternatives_comparison": "Unable to suggest alternatives",
+    "ecometer_impact": "Unable to calculate EcoMeter impact",
+}
+
+# Structured output schema for answering all 4 questions in one completion
+COMBINED_EXPLANATION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sustainability_explanation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {key: {"type": "string"} for key in EXPLANATION_KEYS},
+            "required": EXPLANATION_KEYS,
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def _sustainability_level(score: float) -> str:
+    if score >= 70:
+        return "high"
+    if score >= 40:
+        return "moderate"
+    return "low"
+
+
+def templated_explanation(section: str, product_data: Dict[str, Any],
+                          recommendation_reasoning: Dict[str, Any] = None) -> str:
+    """
+    Deterministic explanation for one /explain section, built from the product's
+    sustainability rating and the algorithmic RecommendationReasoning
+    """
+    reasoning = recommendation_reasoning or {}
+    name = product_data.get('name') or "This product"
+    score = min(product_data.get('sustainability_rating', 0) or 0, 100.0)
+    level = _sustainability_level(score)
+
+    if section == "why_recommended":
+        factors = reasoning.get('reasoning_factors') or []
+        text = (
+            f"{name} was recommended with an overall score of "
+            f"{reasoning.get('final_recommendation_score', 0):.1f}/10. "
+            f"It scored {reasoning.get('sustainability_score', 0):.1f}/10 for sustainability, "
+            f"{reasoning.get('purchase_history_score', 0):.1f}/10 for your purchase history, "
+            f"{reasoning.get('popularity_score', 0):.1f}/10 for popularity and "
+            f"{reasoning.get('category_preference_score', 0):.1f}/10 for category preference."
+        )
+        if factors:
+            text += f" Key factors: {', '.join(factors)}."
+        return text
+    if section == "sustainability_analysis":
+        return f"Sustainability score: {score:.1f}/100. {name} has a {level} sustainability level."
+    if section == "alternatives_comparison":
+        return (
+            f"{name} scores {score:.1f}/100 for sustainability, a {level} level. "
+            f"Compare alternatives in the {product_data.get('category_name', 'same')} category "
+            f"by their sustainability score and price before deciding."
+        )
+    if section == "ecometer_impact":
+        impact = "Positive" if score >= 60 else "Neutral" if score >= 40 else "Negative"
+        return (
+            f"{impact} impact: this product scores {score:.1f}/100 for sustainability. "
+            f"Choosing products rated 60/100 or higher keeps your EcoMeter moving in the right direction."
+        )
+    raise ValueError(f"Unknown explanation section: {section}")
+
+
 class OpenAISustainabilityService:
     """
     OpenAI integration for sustainability reasoning and Q&A
     Optimized for fast, contextual responses about product sustainability
     """
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, budget_seconds: Optional[float] = None):
         self.api_key = api_key
         # Using OpenAI SDK (Async) with GPT-5 Nano
         self.model = "gpt-5-nano"
@@ -30,44 +293,212 @@ class OpenAISustainabilityService:
         self.client = AsyncOpenAI(api_key=self.api_key)
         # Telemetry for last model actually used (primary or fallback)
         self.last_model_used: Optional[str] = None
+        # End-to-end deadline shared by every call made through this (per-request) instance
+        self.deadline: Optional[float] = time.monotonic() + budget_seconds if budget_seconds else None
+        # Set when any answer had to be built from a template
+        self.degraded = False
+
+    def _remaining_budget(self) -> Optional[float]:
+        """Seconds left before the deadline, or None when no budget applies"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def _timeout_kwargs(self) -> Dict[str, Any]:
+        """Per-call SDK timeout so a single slow upstream call cannot outlive the budget"""
+        remaining = self._remaining_budget()
+        return {"timeout": max(remaining, 0.1)} if remaining is not None else {}
     
-    async def _make_openai_request(self, messages: list, max_retries: int = 3) -> Optional[str]:
+    def _prompt_key(self, messages: list, max_retries: int, max_tokens: int,
+                    response_format: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Build a stable key for a prompt so identical concurrent requests can share one call
+        """
+        payload = json.dumps(
+            {
+                "model": self.model,
+                "max_tokens": max_tokens,
+                "retries": max_retries,
+                "response_format": response_format,
+                "messages": messages,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _make_openai_request(self, messages: list, max_retries: int = 3,
+                                   max_tokens: Optional[int] = None,
+                                   response_format: Optional[Dict[str, Any]] = None,
+                                   use_cache: bool = True) -> Optional[str]:
         """
         Make async request to OpenAI API with retry logic using OpenAI SDK
+        Concurrent callers with an identical prompt await the same in-flight call;
+        with use_cache=False the answer is neither read from nor written to the response cache
+        """
+        content, self.last_model_used = await self._request(
+            messages, max_retries, max_tokens, response_format, use_cache=use_cache
+        )
+        return content
+
+    async def _request(self, messages: list, max_retries: int = 3, max_tokens: Optional[int] = None,
+                       response_format: Optional[Dict[str, Any]] = None,
+                       use_cache: bool = True) -> Tuple[Optional[str], Optional[str]]:
+        """_make_openai_request returning (content, model_used) for this call instead of through the instance"""
+        max_tokens = max_tokens or self.max_tokens
+        key = self._prompt_key(messages, max_retries, max_tokens, response_format)
+        cached = _response_cache.get(key) if use_cache else None
+        if cached:
+            content, model_used = cached
+        elif _inflight_requests.get(key) is None and not _circuit_breaker.allow_request():
+            logger.warning("OpenAI circuit breaker is open; skipping request")
+            return None, None
+        else:
+            remaining = self._remaining_budget()
+            if remaining is not None and remaining <= 0:
+                logger.warning("OpenAI latency budget already spent; skipping request")
+                return None, None
+            try:
+                # A caller never waits past its own deadline, even on a shared in-flight call
+                content, model_used = await asyncio.wait_for(
+                    _inflight_requests.run(
+                        key, lambda: self._guarded_call(messages, max_retries, max_tokens, response_format)
+                    ),
+                    timeout=remaining,
+                )
+            except asyncio.TimeoutError:
+                logger.warning("OpenAI request exceeded its latency budget")
+                return None, None
+            if content and use_cache:
+                _response_cache.set(key, content, model_used)
+        return content, model_used
+
+    async def _guarded_call(self, messages: list, max_retries: int, max_tokens: int,
+                            response_format: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Run the upstream call once and report its outcome to the circuit breaker"""
+        try:
+            content, model_used = await self._call_openai(messages, max_retries, max_tokens, response_format)
+        except Exception:
+            _circuit_breaker.record_failure()
+            raise
+        if content:
+            _circuit_breaker.record_success()
+        else:
+            _circuit_breaker.record_failure()
+        return content, model_used
+
+    async def stream_openai_request(self, messages: list) -> AsyncIterator[Tuple[str, bool, Optional[str]]]:
+        """
+        Stream a completion as (text, complete, model_used) using the SDK's streaming interface
+        Token deltas are yielded with complete=False; cached, already in-flight or
+        fallback answers are yielded once as the whole text with complete=True
+        A stream registers as the in-flight call for its prompt, so identical concurrent
+        requests (streamed or not) wait for its final text instead of opening their own
+        """
+        key = self._prompt_key(messages, 3, self.max_tokens)
+        cached = _response_cache.get(key)
+        if cached:
+            content, model_used = cached
+            yield content, True, model_used
+            return
+
+        if _inflight_requests.get(key) is not None:
+            content, model_used = await self._request(messages)
+            if content:
+                yield content, True, model_used
+            return
+
+        if not _circuit_breaker.allow_request():
+            logger.warning("OpenAI circuit breaker is open; skipping streamed request")
+            return
+        remaining = self._remaining_budget()
+        if remaining is not None and remaining <= 0:
+            return
+
+        kwargs = {"model": self.model, "messages": messages, "stream": True, **self._timeout_kwargs()}
+        if str(self.model).lower().startswith("gpt-5"):
+            kwargs["extra_body"] = {"max_completion_tokens": self.max_tokens}
+        else:
+            kwargs["max_tokens"] = self.max_tokens
+
+        leader = _inflight_requests.lead(key)
+        content, model_used, parts = None, None, []
+        try:
+            try:
+                stream = await self.client.chat.completions.create(**kwargs)
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield delta, False, self.model
+            except Exception as e:
+                if parts:
+                    _circuit_breaker.record_failure()
+                    raise
+                # Nothing sent yet, so the retrying non-streaming path can still answer; it reports
+                # the outcome, so the request counts once against the breaker
+                logger.warning(f"OpenAI stream failed before first token, using standard request: {e}")
+            else:
+                content = "".join(parts).strip() or None
+
+            if content:
+                _circuit_breaker.record_success()
+                model_used = self.model
+            else:
+                # Failed or empty stream: the retrying path with its fallback model answers,
+                # run directly since this stream is already the in-flight call for the prompt
+                content, model_used = await self._guarded_call(messages, 3, self.max_tokens)
+                if content:
+                    yield content, True, model_used
+        finally:
+            if content:
+                _response_cache.set(key, content, model_used)
+            # Followers get the final text, or nothing if the stream broke or was abandoned
+            if not leader.done():
+                leader.set_result((content, model_used))
+
+    async def _call_openai(self, messages: list, max_retries: int, max_tokens: int,
+                           response_format: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Perform the OpenAI request with retries and fallback model
+        Returns (content, model_used); content is None when every attempt failed
         """
-        # Reset telemetry for this request
-        self.last_model_used = None
         primary_model = self.model
         fallback_model: Optional[str] = "gpt-4o-mini"  # Use if primary model unavailable
+        # Optional structured output settings shared by primary and fallback calls
+        format_kwargs = {"response_format": response_format} if response_format else {}
 
         for attempt in range(max_retries):
+            remaining = self._remaining_budget()
+            if remaining is not None and remaining <= 0:
+                logger.warning(f"OpenAI latency budget spent after {attempt} attempt(s); giving up")
+                break
             try:
                 # Call OpenAI Chat Completions API via SDK
-                kwargs = {"model": primary_model, "messages": messages}
+                kwargs = {"model": primary_model, "messages": messages, **format_kwargs, **self._timeout_kwargs()}
                 # gpt-5-nano expects 'max_completion_tokens' not 'max_tokens'
                 if str(primary_model).lower().startswith("gpt-5"):
-                    kwargs["extra_body"] = {"max_completion_tokens": self.max_tokens}
+                    kwargs["extra_body"] = {"max_completion_tokens": max_tokens}
                 else:
-                    kwargs["max_tokens"] = self.max_tokens
+                    kwargs["max_tokens"] = max_tokens
 
                 resp = await self.client.chat.completions.create(**kwargs)
                 # Parse response content
                 content = (resp.choices[0].message.content or "").strip()
                 if content:
                     logger.info(f"OpenAI API success via {primary_model}: {content[:100]}...")
-                    self.last_model_used = primary_model
-                    return content
+                    return content, primary_model
                 else:
                     logger.warning(f"OpenAI returned empty content via {primary_model}; attempting fallback model if available.")
                     if fallback_model:
                         try:
-                            alt_kwargs = {"model": fallback_model, "messages": messages, "max_tokens": self.max_tokens}
+                            alt_kwargs = {"model": fallback_model, "messages": messages, "max_tokens": max_tokens, **format_kwargs, **self._timeout_kwargs()}
                             alt_resp = await self.client.chat.completions.create(**alt_kwargs)
                             alt_content = (alt_resp.choices[0].message.content or "").strip()
                             if alt_content:
                                 logger.info(f"OpenAI API success via {fallback_model}: {alt_content[:100]}...")
-                                self.last_model_used = fallback_model
-                                return alt_content
+                                return alt_content, fallback_model
                             else:
                                 logger.error(f"Fallback model {fallback_model} also returned empty content.")
                         except Exception as e2:
@@ -91,13 +522,12 @@ class OpenAISustainabilityService:
                 if should_fallback and fallback_model and attempt == 0:  # Only try fallback once, on first attempt
                     try:
                         logger.info(f"Trying fallback model {fallback_model} due to model-specific error")
-                        alt_kwargs = {"model": fallback_model, "messages": messages, "max_tokens": self.max_tokens}
+                        alt_kwargs = {"model": fallback_model, "messages": messages, "max_tokens": max_tokens, **format_kwargs, **self._timeout_kwargs()}
                         alt_resp = await self.client.chat.completions.create(**alt_kwargs)
                         alt_content = (alt_resp.choices[0].message.content or "").strip()
                         if alt_content:
                             logger.info(f"OpenAI API success via fallback {fallback_model}: {alt_content[:100]}...")
-                            self.last_model_used = fallback_model
-                            return alt_content
+                            return alt_content, fallback_model
                     except Exception as e2:
                         logger.error(f"Fallback model {fallback_model} also failed: {e2}")
                         fallback_model = None
@@ -105,11 +535,22 @@ class OpenAISustainabilityService:
                 # For network/timeout issues, retry with exponential backoff
                 if attempt < max_retries - 1:
                     wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
+                    remaining = self._remaining_budget()
+                    if remaining is not None and wait_time >= remaining:
+                        logger.warning("Not retrying: backoff would exceed the latency budget")
+                        break
                     logger.info(f"Retrying in {wait_time} seconds...")
                     await asyncio.sleep(wait_time)
         
-        return None
+        return None, None
     
+    def _templated_answer(self, section: str, product_data: Dict[str, Any],
+                          recommendation_reasoning: Dict[str, Any] = None) -> str:
+        """Degraded-mode answer built from algorithmic data when the LLM is unavailable"""
+        self.degraded = True
+        self.last_model_used = TEMPLATE_MODEL
+        return templated_explanation(section, product_data, recommendation_reasoning)
+
     def _build_product_context(self, product_data: Dict[str, Any]) -> str:
         """
         Build concise product context for OpenAI prompts
@@ -135,15 +576,11 @@ class OpenAISustainabilityService:
 
         return "\n".join(context_parts)
     
-    async def why_recommended(self, user_id: str, product_data: Dict[str, Any], 
-                            recommendation_reasoning: Dict[str, Any]) -> str:
-        """
-        Q1: Why was this product recommended?
-        Explain the algorithmic reasoning in user-friendly terms
-        """
+    def _why_recommended_messages(self, product_data: Dict[str, Any], recommendation_reasoning: Dict[str, Any]) -> list:
+        """Build Q1 prompt messages"""
         product_context = self._build_product_context(product_data)
         
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": """You are a sustainability expert explaining product recommendations. 
@@ -168,6 +605,15 @@ Key Factors: {', '.join(recommendation_reasoning.get('reasoning_factors', []))}
 Explain in simple terms why this product is a good match for the user."""
             }
         ]
+
+    async def why_recommended(self, user_id: str, product_data: Dict[str, Any], 
+                            recommendation_reasoning: Dict[str, Any], allow_template: bool = True) -> str:
+        """
+        Q1: Why was this product recommended?
+        Explain the algorithmic reasoning in user-friendly terms
+        Falls back to a templated answer when the LLM is unavailable, unless allow_template is False
+        """
+        messages = self._why_recommended_messages(product_data, recommendation_reasoning)
         
         response = await self._make_openai_request(messages)
         
@@ -179,20 +625,19 @@ Explain in simple terms why this product is a good match for the user."""
         
         if not response:
             logger.error(f"OpenAI API failed to provide response for why_recommended - user_id: {user_id}")
+            if allow_template:
+                return self._templated_answer("why_recommended", product_data, recommendation_reasoning)
             raise Exception("OpenAI API failed to provide a response")
         return response
     
-    async def sustainability_analysis(self, user_id: str, product_data: Dict[str, Any]) -> str:
-        """
-        Q2: How sustainable is this product given its score?
-        Provide detailed sustainability analysis
-        """
+    def _sustainability_analysis_messages(self, product_data: Dict[str, Any]) -> list:
+        """Build Q2 prompt messages"""
         product_context = self._build_product_context(product_data)
         # Ensure sustainability score doesn't exceed 100
         raw_score = product_data.get('sustainability_rating', 0)
         sustainability_score = min(raw_score, 100.0)
         
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": """You are a sustainability expert analyzing product environmental impact.
@@ -220,6 +665,15 @@ MANDATORY: Write "high sustainability level" NOT "High sustainability level" in
 Do not mention EcoMeter, cart averages, or checkout adjustments."""
             }
         ]
+
+    async def sustainability_analysis(self, user_id: str, product_data: Dict[str, Any],
+                                      allow_template: bool = True) -> str:
+        """
+        Q2: How sustainable is this product given its score?
+        Provide detailed sustainability analysis
+        Falls back to a templated answer when the LLM is unavailable, unless allow_template is False
+        """
+        messages = self._sustainability_analysis_messages(product_data)
         
         response = await self._make_openai_request(messages)
         
@@ -231,15 +685,13 @@ Do not mention EcoMeter, cart averages, or checkout adjustments."""
         
         if not response:
             logger.error(f"OpenAI API failed to provide response for sustainability_analysis - user_id: {user_id}")
+            if allow_template:
+                return self._templated_answer("sustainability_analysis", product_data)
             raise Exception("OpenAI API failed to provide a response")
         return response
     
-    async def suggest_alternatives(self, user_id: str, product_data: Dict[str, Any], 
-                                 alternative_products: list = None) -> str:
-        """
-        Q3: Suggest 3 alternatives and explain why this product is better
-        Compare with alternatives and justify the recommendation
-        """
+    def _suggest_alternatives_messages(self, product_data: Dict[str, Any], alternative_products: list = None) -> list:
+        """Build Q3 prompt messages"""
         product_context = self._build_product_context(product_data)
         
         alternatives_context = ""
@@ -247,7 +699,7 @@ Do not mention EcoMeter, cart averages, or checkout adjustments."""
             for i, alt in enumerate(alternative_products[:3], 1):
                 alternatives_context += f"\\nAlternative {i}: {alt.get('name', 'Unknown')} - ${alt.get('price', 0):.2f} (Sustainability: {alt.get('sustainability_rating', 0):.1f}/10)"
         
-        messages = [
+        return [
             {
                 "role": "system", 
                 "content": """You are a product comparison expert focusing on sustainability and value.
@@ -270,6 +722,15 @@ Suggest 3 alternative products in the same category and explain:
 Focus on sustainability and value proposition."""
             }
         ]
+
+    async def suggest_alternatives(self, user_id: str, product_data: Dict[str, Any], 
+                                 alternative_products: list = None, allow_template: bool = True) -> str:
+        """
+        Q3: Suggest 3 alternatives and explain why this product is better
+        Compare with alternatives and justify the recommendation
+        Falls back to a templated answer when the LLM is unavailable, unless allow_template is False
+        """
+        messages = self._suggest_alternatives_messages(product_data, alternative_products)
         
         response = await self._make_openai_request(messages)
         
@@ -281,21 +742,19 @@ Focus on sustainability and value proposition."""
         
         if not response:
             logger.error(f"OpenAI API failed to provide response for competitive_analysis - user_id: {user_id}")
+            if allow_template:
+                return self._templated_answer("alternatives_comparison", product_data)
             raise Exception("OpenAI API failed to provide a response")
         return response
     
-    async def ecometer_impact(self, user_id: str, product_data: Dict[str, Any], 
-                            current_cart_sustainability: float = 0.0) -> str:
-        """
-        Q4: How does this product affect the EcoMeter score?
-        Explain impact on average sustainability rating at checkout
-        """
+    def _ecometer_impact_messages(self, product_data: Dict[str, Any]) -> list:
+        """Build Q4 prompt messages"""
         product_context = self._build_product_context(product_data)
         # Ensure sustainability score doesn't exceed 100
         raw_sustainability = product_data.get('sustainability_rating', 0)
         product_sustainability = min(raw_sustainability, 100.0)
         
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": """You are an EcoMeter expert explaining environmental impact scores.
@@ -322,6 +781,15 @@ Provide:
 Include only the product score in your answer (e.g., 'product {product_sustainability:.1f}/100'). Do not mention cart averages or checkout adjustments."""
             }
         ]
+
+    async def ecometer_impact(self, user_id: str, product_data: Dict[str, Any], 
+                            current_cart_sustainability: float = 0.0, allow_template: bool = True) -> str:
+        """
+        Q4: How does this product affect the EcoMeter score?
+        Explain impact on average sustainability rating at checkout
+        Falls back to a templated answer when the LLM is unavailable, unless allow_template is False
+        """
+        messages = self._ecometer_impact_messages(product_data)
         
         response = await self._make_openai_request(messages)
         
@@ -333,16 +801,214 @@ Include only the product score in your answer (e.g., 'product {product_sustainab
         
         if not response:
             logger.error(f"OpenAI API failed to provide response for cart_impact_analysis - user_id: {user_id}")
+            if allow_template:
+                return self._templated_answer("ecometer_impact", product_data)
             raise Exception("OpenAI API failed to provide a response")
         return response
     
+    def _build_combined_messages(self, product_data: Dict[str, Any],
+                                 recommendation_reasoning: Dict[str, Any],
+                                 alternative_products: list = None) -> list:
+        """
+        Build one prompt that asks all 4 questions with the product context included once
+        """
+        product_context = self._build_product_context(product_data)
+        sustainability_score = min(product_data.get('sustainability_rating', 0), 100.0)
+
+        alternatives_context = ""
+        if alternative_products:
+            for i, alt in enumerate(alternative_products[:3], 1):
+                alternatives_context += f"\nAlternative {i}: {alt.get('name', 'Unknown')} - ${alt.get('price', 0):.2f} (Sustainability: {alt.get('sustainability_rating', 0):.1f}/10)"
+
+        return [
+            {
+                "role": "system",
+                "content": """You are a sustainability expert answering four questions about one product.
+                IMPORTANT: Treat all sustainability ratings as out of 100.
+                Respond ONLY with a JSON object containing the keys why_recommended, sustainability_analysis,
+                alternatives_comparison and ecometer_impact, each holding a plain-text answer.
+                Always use lowercase "high", "moderate", or "low" when describing sustainability levels."""
+            },
+            {
+                "role": "user",
+                "content": f"""Product context:
+
+{product_context}
+{alternatives_context if alternatives_context else ""}
+
+Recommendation Scores:
+- Purchase History Match: {recommendation_reasoning.get('purchase_history_score', 0):.1f}/10
+- Sustainability Score: {recommendation_reasoning.get('sustainability_score', 0):.1f}/10
+- Popularity Score: {recommendation_reasoning.get('popularity_score', 0):.1f}/10
+- Category Preference: {recommendation_reasoning.get('category_preference_score', 0):.1f}/10
+- Final Score: {recommendation_reasoning.get('final_recommendation_score', 0):.1f}/10
+
+Key Factors: {', '.join(recommendation_reasoning.get('reasoning_factors', []))}
+
+Answer each key:
+- why_recommended: In 3-4 sentences, explain in simple terms why this product is a good match for the user.
+- sustainability_analysis: In 2-3 sentences, include 'Sustainability score: {sustainability_score:.1f}/100', a brief assessment of the level and one optional tip. Do not mention EcoMeter, cart averages, or checkout adjustments.
+- alternatives_comparison: In 4-5 sentences, suggest 3 alternatives in the same category, why the recommended product is better and when someone might prefer an alternative.
+- ecometer_impact: In 2-3 sentences, classify the EcoMeter impact as Positive (score >= 60), Neutral (40 <= score < 60) or Negative (score < 40), give a rationale tied to 'product {sustainability_score:.1f}/100' and one actionable tip. Do not mention cart averages."""
+            }
+        ]
+
+    def _parse_combined_explanation(self, content: Optional[str]) -> Optional[Dict[str, str]]:
+        """
+        Validate a combined JSON response and split it into the 4 explanation fields
+        Returns None if the response is missing, not JSON, or lacks any answer
+        """
+        if not content:
+            return None
+        text = content.strip()
+        # Tolerate models that wrap JSON in a markdown code fence
+        if text.startswith("```"):
+            text = text.strip("`")
+            if text.lower().startswith("json"):
+                text = text[4:]
+        try:
+            parsed = json.loads(text)
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(parsed, dict):
+            return None
+
+        results = {}
+        for key in EXPLANATION_KEYS:
+            value = parsed.get(key)
+            if not isinstance(value, str) or not value.strip():
+                return None
+            results[key] = value.strip()
+        return results
+
+    async def _get_combined_explanation(self, user_id: str, product_data: Dict[str, Any],
+                                        recommendation_reasoning: Dict[str, Any],
+                                        alternative_products: list = None) -> Optional[Dict[str, str]]:
+        """
+        Ask all 4 questions in one structured completion
+        Returns None only when a response arrived but could not be parsed, so the caller can fall back
+        to separate calls; when no response arrived every section is templated instead
+        """
+        messages = self._build_combined_messages(product_data, recommendation_reasoning, alternative_products)
+        try:
+            content = await self._make_openai_request(
+                messages,
+                max_tokens=self.max_tokens * len(EXPLANATION_KEYS),
+                response_format=COMBINED_EXPLANATION_FORMAT,
+            )
+        except Exception as e:
+            logger.error(f"Combined explanation request failed: {e}")
+            content = None
+
+        if not content:
+            # Failure, timeout or open breaker: 4 more calls would only add load to a failing upstream
+            logger.warning(f"No combined explanation for product {product_data.get('id')}; using templated answers")
+            return {
+                key: self._templated_answer(key, product_data, recommendation_reasoning)
+                for key in EXPLANATION_KEYS
+            }
+
+        results = self._parse_combined_explanation(content)
+        if results is None:
+            # Do not keep serving an unusable response from the cache
+            _response_cache.discard(self._prompt_key(
+                messages, 3, self.max_tokens * len(EXPLANATION_KEYS), COMBINED_EXPLANATION_FORMAT
+            ))
+            logger.warning(f"Combined explanation could not be parsed for product {product_data.get('id')}; falling back to separate calls")
+            return None
+
+        for key, question in EXPLANATION_QUESTIONS.items():
+            self.smart_logger.log_openai_interaction(user_id, product_data.get('id'), question, results[key])
+        return results
+
+    def _section_messages(self, section: str, product_data: Dict[str, Any],
+                          recommendation_reasoning: Dict[str, Any] = None,
+                          alternative_products: list = None) -> list:
+        """Build prompt messages for one of the 4 explanation sections"""
+        if section == "why_recommended":
+            return self._why_recommended_messages(product_data, recommendation_reasoning or {})
+        if section == "sustainability_analysis":
+            return self._sustainability_analysis_messages(product_data)
+        if section == "alternatives_comparison":
+            return self._suggest_alternatives_messages(product_data, alternative_products)
+        if section == "ecometer_impact":
+            return self._ecometer_impact_messages(product_data)
+        raise ValueError(f"Unknown explanation section: {section}")
+
+    async def stream_section(self, user_id: str, section: str, product_data: Dict[str, Any],
+                             recommendation_reasoning: Dict[str, Any] = None,
+                             alternative_products: list = None) -> AsyncIterator[Tuple[str, bool, Optional[str]]]:
+        """
+        Stream one explanation section as (text, complete, model_used)
+        Logs the full answer once the stream finishes
+        """
+        messages = self._section_messages(section, product_data, recommendation_reasoning, alternative_products)
+        parts = []
+        async for text, complete, model_used in self.stream_openai_request(messages):
+            parts.append(text)
+            yield text, complete, model_used
+
+        response = "".join(parts).strip()
+        self.smart_logger.log_openai_interaction(
+            user_id, product_data.get('id'), EXPLANATION_QUESTIONS[section], response or "No response"
+        )
+        if not response:
+            logger.error(f"OpenAI API failed to provide streamed response for {section} - user_id: {user_id}; using template")
+            self.degraded = True
+            yield templated_explanation(section, product_data, recommendation_reasoning), True, TEMPLATE_MODEL
+
+    async def stream_comprehensive_explanation(self, user_id: str, product_data: Dict[str, Any],
+                                               recommendation_reasoning: Dict[str, Any],
+                                               alternative_products: list = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream all 4 explanation sections concurrently, each independently
+        Yields {"section", "text", "complete"} items as they arrive, or {"section", "error"} on failure
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump(section: str):
+            try:
+                async for text, complete, _ in self.stream_section(
+                    user_id, section, product_data, recommendation_reasoning, alternative_products
+                ):
+                    await queue.put({"section": section, "text": text, "complete": complete})
+            except Exception as e:
+                logger.error(f"Streaming {section} failed: {e}")
+                await queue.put({"section": section, "error": EXPLANATION_FALLBACKS[section]})
+            finally:
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(pump(section)) for section in EXPLANATION_KEYS]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                item = await queue.get()
+                if item is None:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            # Stop upstream streams if the client disconnects
+            for task in tasks:
+                task.cancel()
+
     async def get_comprehensive_explanation(self, user_id: str, product_data: Dict[str, Any],
                                           recommendation_reasoning: Dict[str, Any],
                                           current_cart_sustainability: float = 0.0,
-                                          alternative_products: list = None) -> Dict[str, str]:
+                                          alternative_products: list = None,
+                                          single_call: bool = True) -> Dict[str, str]:
         """
-        Get all 4 sustainability explanations in parallel for the /explain endpoint
+        Get all 4 sustainability explanations for the /explain endpoint
+        With single_call, one structured completion answers all 4 questions; the 4 parallel calls
+        are only used if that response arrives but cannot be parsed
         """
+        if single_call:
+            combined = await self._get_combined_explanation(
+                user_id, product_data, recommendation_reasoning, alternative_products
+            )
+            if combined is not None:
+                return combined
+
         try:
             # Execute all 4 questions concurrently for speed
             tasks = [
@@ -373,7 +1039,16 @@ Include only the product score in your answer (e.g., 'product {product_sustainab
                 "ecometer_impact": "Unable to calculate EcoMeter impact"
             }
 
+def get_openai_service(api_key: str, budget_seconds: Optional[float] = None) -> OpenAISustainabilityService:
+    """Factory function to create OpenAI service instance with an optional end-to-end latency budget"""
+    return OpenAISustainabilityService(api_key, budget_seconds)
+
+
+def get_coalescing_metrics() -> Dict[str, Any]:
+    """Request coalescing metrics shared by all OpenAI service instances"""
+    return _inflight_requests.get_metrics()
+
 
-def get_openai_service(api_key: str) -> OpenAISustainabilityService:
-    """Factory function to create OpenAI service instance"""
-    return OpenAISustainabilityService(api_key)
+def get_circuit_breaker_state() -> Dict[str, Any]:
+    """OpenAI circuit breaker state shared by all OpenAI service instances"""
+    return _circuit_breaker.get_state()
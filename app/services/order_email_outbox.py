@@ -0,0 +1,320 @@
+"""
+Transactional outbox for order emails
+Checkout adds an order_email_outbox row in the order's own transaction and returns as soon as it
+commits, so a confirmation is queued exactly when an order exists and checkout never waits on SES.
+A background worker started with the app claims due rows (FOR UPDATE SKIP LOCKED, so several app
+processes can run one each), renders and sends them, and retries failures with exponential backoff
+until OUTBOX_MAX_ATTEMPTS, after which the row is left as failed with its last error. Order state
+transitions queue an order_status_update row the same way
+
+Send everything that is due and exit with:
+    python -m app.services.order_email_outbox --once
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.db.executor import run_blocking
+from app.models.order_email_outbox import OrderEmailOutbox
+from app.models.order_line import OrderLine
+from app.models.orders import Order
+from app.models.product import Product
+from app.models.product_images import ProductImage
+from app.models.user import User
+from app.services.email_service import email_service
+from app.services.sustainabilityRatings_service import fetchSustainabilityRatingsForProducts
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 3600
+# A claimed row is due again after this long, so an email whose worker died mid-send is retried
+OUTBOX_CLAIM_SECONDS = 300
+
+Claim = Tuple[int, int, int, str]  # (outbox_id, order_id, attempts including this one, kind)
+
+_wake: Optional[asyncio.Event] = None
+_stopping = False
+_worker_task: Optional[asyncio.Task] = None
+
+
+def enqueue_order_confirmation(db: Session, order):
+    """Queue the order's confirmation email; it is committed or rolled back with the caller's transaction"""
+    db.add(OrderEmailOutbox(order_id=order.id, kind="order_confirmation"))
+
+
+def enqueue_order_status_updates(db: Session, order_ids: List[int]):
+    """Queue a status update email per order in the caller's transaction; it reports the state when sent"""
+    db.add_all([OrderEmailOutbox(order_id=order_id, kind="order_status_update") for order_id in order_ids])
+
+
+def retry_delay(attempts: int) -> int:
+    """Seconds to wait after the given number of failed attempts: 30s, 1m, 2m, ... capped at an hour"""
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+
+
+def claim_due_emails(db: Session, limit: int = OUTBOX_BATCH_SIZE) -> List[Claim]:
+    """Lease up to `limit` due rows for OUTBOX_CLAIM_SECONDS, counting the attempt, and commit"""
+    due = (
+        select(OrderEmailOutbox.id)
+        .where(OrderEmailOutbox.status == "pending", OrderEmailOutbox.next_attempt_at <= func.now())
+        .order_by(OrderEmailOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = db.execute(
+        update(OrderEmailOutbox)
+        .where(OrderEmailOutbox.id.in_(due))
+        .values(
+            attempts=OrderEmailOutbox.attempts + 1,
+            next_attempt_at=func.now() + timedelta(seconds=OUTBOX_CLAIM_SECONDS)
+        )
+        .returning(OrderEmailOutbox.id, OrderEmailOutbox.order_id, OrderEmailOutbox.attempts, OrderEmailOutbox.kind)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return [tuple(row) for row in claimed]
+
+
+def _order_email_data(order, lines, ratings: Dict[int, float]):
+    """
+    Order details, items with images and ratings, and impact estimates for the confirmation email
+    Prices and the total are the ones snapshotted at checkout, not the products' current prices
+    """
+    # Calculate estimated delivery date (5-7 business days)
+    delivery_date = datetime.now() + timedelta(days=6)  # 6 days for business days
+
+    email_items = [
+        {
+            'name': line.name,
+            'quantity': line.quantity,
+            'price': float(line.unit_price),
+            'sustainability_rating': ratings[line.product_id],
+            'image_url': line.image_url
+        }
+        for line in lines
+    ]
+    sustainability_ratings = [item['sustainability_rating'] for item in email_items]
+
+    # Calculate average sustainability
+    average_sustainability = sum(sustainability_ratings) / len(sustainability_ratings) if sustainability_ratings else 0
+
+    return {
+        'order_id': order.id,
+        'order_date': order.created_at.strftime('%Y-%m-%d %H:%M') if order.created_at else datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'delivery_date': delivery_date.strftime('%Y-%m-%d'),
+        'status': order.state,
+        'items': email_items,
+        'total_amount': float(order.total_amount or Decimal('0.00')),
+        'average_sustainability': float(average_sustainability),
+        'co2_saved': f"{float(average_sustainability) * 0.05:.1f}",  # Estimated based on sustainability
+        'water_saved': f"{len(email_items) * 3 + int(float(average_sustainability) * 0.2)}",  # Estimated
+        'waste_reduced': f"{min(int(float(average_sustainability) * 0.8), 95)}"  # Estimated percentage
+    }
+
+
+def load_order_confirmation(db: Session, order_id: int) -> Optional[Dict[str, Any]]:
+    """Recipient and template data for the order's confirmation, or None if there is nobody to send it to"""
+    order = db.query(Order).filter(Order.id == order_id).first()
+    if not order:
+        return None
+    user = db.query(User).filter(User.id == order.user_id).first()
+    if not user or not user.email:
+        return None
+
+    # The order's lines with their products' names and first images in one query; lines whose product is gone are skipped
+    first_image = (
+        select(ProductImage.image_url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    lines = db.execute(
+        select(OrderLine.product_id, OrderLine.quantity, OrderLine.unit_price, Product.name,
+               first_image.label("image_url"))
+        .join(Product, Product.id == OrderLine.product_id)
+        .where(OrderLine.order_id == order.id)
+        .order_by(OrderLine.id)
+    ).all()
+    ratings = fetchSustainabilityRatingsForProducts({line.product_id for line in lines}, db)
+    return {
+        "customer_email": user.email,
+        "customer_name": user.name or "Valued Customer",
+        "order_data": _order_email_data(order, lines, ratings)
+    }
+
+
+def load_order_status_update(db: Session, order_id: int) -> Optional[Dict[str, Any]]:
+    """Recipient and current state for an order status update, or None if there is nobody to send it to"""
+    row = (
+        db.query(Order.id, Order.state, User.email, User.name)
+        .join(User, User.id == Order.user_id)
+        .filter(Order.id == order_id)
+        .first()
+    )
+    if not row or not row.email:
+        return None
+    return {
+        "customer_email": row.email,
+        "customer_name": row.name or "Valued Customer",
+        "order_id": str(row.id),
+        "status": row.state
+    }
+
+
+def record_attempt(db: Session, outbox_id: int, attempts: int, error: Optional[str] = None,
+                   retry: bool = True) -> str:
+    """Mark the row sent, or schedule its retry (failed once attempts run out); returns the outcome"""
+    if error is None:
+        outcome = "sent"
+        values = {"status": "sent", "sent_at": func.now(), "last_error": None}
+    elif retry and attempts < OUTBOX_MAX_ATTEMPTS:
+        outcome = "retrying"
+        values = {
+            "next_attempt_at": func.now() + timedelta(seconds=retry_delay(attempts)),
+            "last_error": error
+        }
+    else:
+        outcome = "failed"
+        values = {"status": "failed", "last_error": error}
+
+    db.execute(
+        update(OrderEmailOutbox)
+        .where(OrderEmailOutbox.id == outbox_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return outcome
+
+
+async def process_due_emails(db: Session, limit: int = OUTBOX_BATCH_SIZE) -> Dict[str, int]:
+    """Claim one batch of due emails and send each; the session is only used on the blocking pool"""
+    claimed = await run_blocking(claim_due_emails, db, limit)
+    totals = {"claimed": len(claimed), "sent": 0, "retrying": 0, "failed": 0}
+
+    for outbox_id, order_id, attempts, kind in claimed:
+        error, retry = None, True
+        if kind == "order_status_update":
+            load, send = load_order_status_update, email_service.send_order_status_update
+        else:
+            load, send = load_order_confirmation, email_service.send_order_confirmation
+        try:
+            message = await run_blocking(load, db, order_id)
+            if message is None:
+                error, retry = f"Order {order_id} has no customer email to send to", False
+            elif not await send(**message):
+                error = "Email service did not accept the message"
+        except Exception as e:
+            await run_blocking(db.rollback)
+            error = f"Error preparing email: {str(e)}"
+
+        outcome = await run_blocking(record_attempt, db, outbox_id, attempts, error, retry)
+        totals[outcome] += 1
+        if error:
+            logger.warning(f"Order {order_id} email attempt {attempts} {outcome}: {error}")
+
+    return totals
+
+
+async def _run_worker(poll_seconds: float):
+    from app.db.database import SessionLocal
+
+    while not _stopping:
+        _wake.clear()
+        db = SessionLocal()
+        try:
+            totals = await process_due_emails(db)
+        except Exception as e:
+            logger.warning(f"Order email outbox pass failed: {str(e)}")
+            totals = {"claimed": 0}
+        finally:
+            await run_blocking(db.close)
+
+        # A full batch means more are probably due; otherwise sleep until woken or the next poll
+        if totals["claimed"] < OUTBOX_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(_wake.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+
+def wake_outbox_worker():
+    """Have this process's worker check the outbox now rather than at its next poll"""
+    if _wake is not None:
+        _wake.set()
+
+
+def start_outbox_worker(poll_seconds: float = OUTBOX_POLL_SECONDS):
+    """Start the background sender on the running event loop"""
+    global _wake, _stopping, _worker_task
+    if _worker_task is not None and not _worker_task.done():
+        return
+    _wake = asyncio.Event()
+    _stopping = False
+    _worker_task = asyncio.get_running_loop().create_task(_run_worker(poll_seconds))
+
+
+async def stop_outbox_worker():
+    """Let an email being sent finish, then stop the worker"""
+    global _stopping, _worker_task
+    if _worker_task is None:
+        return
+    _stopping = True
+    _wake.set()
+    await _worker_task
+    _worker_task = None
+
+
+async def drain_outbox(db: Session) -> Dict[str, int]:
+    """Process batches until no due email is left"""
+    totals = {"claimed": 0, "sent": 0, "retrying": 0, "failed": 0}
+    while True:
+        batch = await process_due_emails(db)
+        for key in totals:
+            totals[key] += batch[key]
+        if batch["claimed"] < OUTBOX_BATCH_SIZE:
+            return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send queued order emails")
+    parser.add_argument("--once", action="store_true", help="Send what is due and exit instead of polling")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    OrderEmailOutbox.__table__.create(bind=engine, checkfirst=True)
+
+    if not args.once:
+        async def serve():
+            start_outbox_worker()
+            await _worker_task
+
+        asyncio.run(serve())
+        return
+
+    db = SessionLocal()
+    try:
+        totals = asyncio.run(drain_outbox(db))
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Order line snapshots
+Checkout writes one order_lines row per product with the quantity and the unit price paid, and stores
+the order's total in orders.total_amount. Revenue reports sum these rows instead of joining every
+cart item to the product's current price, which was slow and changed past revenue whenever a price did
+
+Create order_lines, add orders.total_amount and backfill existing orders with:
+    python -m app.services.order_line_service --batch-size 500
+Run it before deploying code that reads orders.total_amount. Orders placed before the snapshot existed
+have no recorded price, so the backfill snapshots the products' current prices; it only touches orders
+without a total and is safe to re-run
+"""
+import argparse
+import json
+import logging
+import time
+from decimal import Decimal
+from typing import Dict, Any, Iterable, Tuple
+
+from sqlalchemy import func, insert, text, update
+from sqlalchemy.orm import Session
+
+from app.models.cart_item import CartItem
+from app.models.order_line import OrderLine
+from app.models.orders import Order
+from app.models.product import Product
+
+logger = logging.getLogger(__name__)
+
+
+def requested_quantities(cart_items: Iterable) -> Dict[int, int]:
+    """Total quantity per product id; a cart can hold several lines for the same product"""
+    quantities = {}
+    for item in cart_items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+
+def order_total(quantities: Dict[int, int], products: Dict[int, Any]) -> Decimal:
+    """Order value at the given product rows' prices"""
+    return sum(
+        ((products[product_id].price or Decimal("0")) * quantity for product_id, quantity in quantities.items()),
+        Decimal("0")
+    )
+
+
+def add_order_lines(db: Session, order: Order, quantities: Dict[int, int], products: Dict[int, Any]):
+    """Snapshot the order's lines from the product rows locked at checkout, in the caller's transaction"""
+    db.add_all([
+        OrderLine(
+            order_id=order.id,
+            product_id=product_id,
+            retailer_id=products[product_id].retailer_id,
+            quantity=quantity,
+            unit_price=products[product_id].price or Decimal("0")
+        )
+        for product_id, quantity in sorted(quantities.items())
+    ])
+
+
+def get_product_sales(db: Session, product_id: int) -> Tuple[int, float]:
+    """Units sold and revenue at purchase prices for one product, read from its order lines"""
+    units_sold, revenue = (
+        db.query(func.sum(OrderLine.quantity), func.sum(OrderLine.quantity * OrderLine.unit_price))
+        .join(Order, Order.id == OrderLine.order_id)
+        .filter(OrderLine.product_id == product_id, Order.state != "Cancelled")
+        .one()
+    )
+    return int(units_sold or 0), float(revenue or 0)
+
+
+def backfill_order_lines(db: Session, batch_size: int = 500) -> Dict[str, Any]:
+    """Snapshot lines and totals for orders that have no total yet, walking orders by id and committing each batch"""
+    start_time = time.monotonic()
+    totals = {"orders": 0, "lines": 0, "batches": 0}
+    after_id = 0
+
+    while True:
+        orders = (
+            db.query(Order.id, Order.cart_id)
+            .filter(Order.id > after_id, Order.total_amount.is_(None))
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not orders:
+            break
+        after_id = orders[-1].id
+
+        orders_by_cart = {}
+        for order in orders:
+            orders_by_cart.setdefault(order.cart_id, []).append(order.id)
+        order_totals = {order.id: Decimal("0") for order in orders}
+
+        # Items whose product no longer exists are left out, as the old revenue joins did
+        items = (
+            db.query(
+                CartItem.cart_id,
+                CartItem.product_id,
+                func.sum(CartItem.quantity).label("quantity"),
+                func.coalesce(Product.price, 0).label("unit_price"),
+                Product.retailer_id
+            )
+            .join(Product, Product.id == CartItem.product_id)
+            .filter(CartItem.cart_id.in_(list(orders_by_cart)))
+            .group_by(CartItem.cart_id, CartItem.product_id, Product.price, Product.retailer_id)
+            .all()
+        )
+        lines = []
+        for item in items:
+            for order_id in orders_by_cart[item.cart_id]:
+                lines.append({
+                    "order_id": order_id,
+                    "product_id": item.product_id,
+                    "retailer_id": item.retailer_id,
+                    "quantity": int(item.quantity),
+                    "unit_price": Decimal(item.unit_price)
+                })
+                order_totals[order_id] += Decimal(item.unit_price) * int(item.quantity)
+
+        if lines:
+            db.execute(insert(OrderLine), lines)
+        db.execute(update(Order), [{"id": order_id, "total_amount": total} for order_id, total in order_totals.items()])
+        db.commit()
+
+        totals["orders"] += len(orders)
+        totals["lines"] += len(lines)
+        totals["batches"] += 1
+        logger.info(f"Order line backfill progress: {totals}")
+
+    totals["elapsed_seconds"] = round(time.monotonic() - start_time, 2)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create order line snapshots and backfill existing orders")
+    parser.add_argument("--batch-size", type=int, default=500, help="Orders snapshotted and committed per batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    OrderLine.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS total_amount NUMERIC(12, 2)"))
+
+    db = SessionLocal()
+    try:
+        totals = backfill_order_lines(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
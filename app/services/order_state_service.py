@@ -0,0 +1,178 @@
+"""
+Order state machine
+Orders only move along ORDER_TRANSITIONS. A transition is a compare-and-set UPDATE ... WHERE
+id = ANY(:ids) AND state = :from, one statement per source state however many orders are moved, so
+an order changed by someone else since it was read is reported as a conflict instead of overwritten.
+Every transition writes an order_state_events row in the same transaction and is handed to the
+registered handlers there (summaries mirror cancellations, customers get a status email through the
+outbox), so downstream state commits or rolls back with the order
+
+Create the events table with:
+    python -m app.services.order_state_service
+"""
+import argparse
+import json
+import logging
+from typing import Callable, Dict, Any, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import ARRAY, Integer, any_, literal, select, update
+from sqlalchemy.orm import Session
+
+from app.models.order_state_event import OrderStateEvent
+from app.models.orders import Order
+from app.services.order_email_outbox import enqueue_order_status_updates, wake_outbox_worker
+from app.services.order_summary_service import set_order_summaries_cancelled
+
+logger = logging.getLogger(__name__)
+
+CANCELLED = "Cancelled"
+
+# Allowed next states; a cancelled order can only be reinstated to preparation. Orders in transit or
+# delivered can still be cancelled, which is how returns are recorded (the admin Returned action sets Cancelled)
+ORDER_TRANSITIONS: Dict[str, List[str]] = {
+    "Preparing Order": ["Ready for Delivery", CANCELLED],
+    "Ready for Delivery": ["In Transit", "Preparing Order", CANCELLED],
+    "In Transit": ["Delivered", CANCELLED],
+    "Delivered": [CANCELLED],
+    CANCELLED: ["Preparing Order"],
+}
+
+# Handlers run with the session and each batch of events, inside the transaction that made them
+_state_handlers: List[Callable[[Session, List[OrderStateEvent]], None]] = []
+
+
+def add_order_state_handler(handler: Callable[[Session, List[OrderStateEvent]], None]):
+    """Register a consumer of order transitions; an exception in it rolls the transitions back"""
+    if handler not in _state_handlers:
+        _state_handlers.append(handler)
+
+
+def can_transition(from_state: str, to_state: str) -> bool:
+    return to_state in ORDER_TRANSITIONS.get(from_state, [])
+
+
+def _id_array(order_ids: List[int]):
+    # One array parameter, so the statement is the same whatever the batch size
+    return any_(literal(order_ids, ARRAY(Integer)))
+
+
+def _current_states(db: Session, order_ids: List[int]) -> Dict[int, str]:
+    return dict(db.execute(select(Order.id, Order.state).where(Order.id == _id_array(order_ids))).all())
+
+
+def _outcome(order_id: int, state: Optional[str], to_state: str) -> Dict[str, Any]:
+    """Why an order was not moved, from the state it is in now"""
+    if state is None:
+        outcome = "not_found"
+    elif state == to_state:
+        outcome = "unchanged"
+    elif not can_transition(state, to_state):
+        outcome = "invalid_transition"
+    else:
+        # Allowed from where it is now, but it was not in the expected state when updated
+        outcome = "conflict"
+    return {"order_id": order_id, "outcome": outcome, "state": state}
+
+
+def transition_orders(db: Session, order_ids: Iterable[int], to_state: str,
+                      from_state: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Move the orders to `to_state` and commit, reporting one outcome per order
+    With `from_state`, only orders still in that state are moved; otherwise each order moves from the
+    state it is read in. Outcomes are transitioned, unchanged, not_found, invalid_transition or conflict
+    """
+    if to_state not in ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown order state: {to_state}")
+    if from_state is not None and from_state not in ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown order state: {from_state}")
+    order_ids = list(dict.fromkeys(order_ids))
+    if not order_ids:
+        return {"to_state": to_state, "transitioned": 0, "outcomes": []}
+
+    if from_state is not None:
+        by_source = {from_state: order_ids}
+    else:
+        by_source = {}
+        for order_id, state in _current_states(db, order_ids).items():
+            by_source.setdefault(state, []).append(order_id)
+
+    events = []
+    try:
+        for source, ids in sorted(by_source.items()):
+            if not can_transition(source, to_state):
+                continue
+            moved = db.execute(
+                update(Order)
+                .where(Order.id == _id_array(sorted(ids)), Order.state == source)
+                .values(state=to_state)
+                .returning(Order.id, Order.user_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+            events.extend(
+                OrderStateEvent(order_id=row.id, user_id=row.user_id, from_state=source, to_state=to_state)
+                for row in moved
+            )
+        if events:
+            db.add_all(events)
+            for handler in _state_handlers:
+                handler(db, events)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    moved_ids = {event.order_id for event in events}
+    missed = [order_id for order_id in order_ids if order_id not in moved_ids]
+    states = _current_states(db, missed) if missed else {}
+    outcomes = [
+        {"order_id": order_id, "outcome": "transitioned", "state": to_state} if order_id in moved_ids
+        else _outcome(order_id, states.get(order_id), to_state)
+        for order_id in order_ids
+    ]
+    if events:
+        logger.info(f"Moved {len(events)} of {len(order_ids)} orders to {to_state}")
+        wake_outbox_worker()
+    return {"to_state": to_state, "transitioned": len(events), "outcomes": outcomes}
+
+
+def transition_order(db: Session, order_id: int, to_state: str) -> Dict[str, Any]:
+    """Move one order, raising 404 if it does not exist and 409 if it cannot move to `to_state`"""
+    outcome = transition_orders(db, [order_id], to_state)["outcomes"][0]
+    if outcome["outcome"] == "not_found":
+        raise HTTPException(status_code=404, detail="Order not found")
+    if outcome["outcome"] in ("invalid_transition", "conflict"):
+        raise HTTPException(status_code=409, detail=f"Order cannot move from {outcome['state']} to {to_state}")
+    return outcome
+
+
+def _mirror_cancellations(db: Session, events: List[OrderStateEvent]):
+    cancelled = [event.order_id for event in events if event.to_state == CANCELLED]
+    reinstated = [event.order_id for event in events if event.from_state == CANCELLED]
+    if cancelled:
+        set_order_summaries_cancelled(db, cancelled, True)
+    if reinstated:
+        set_order_summaries_cancelled(db, reinstated, False)
+
+
+def _queue_status_emails(db: Session, events: List[OrderStateEvent]):
+    enqueue_order_status_updates(db, [event.order_id for event in events])
+
+
+add_order_state_handler(_mirror_cancellations)
+add_order_state_handler(_queue_status_emails)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the order state events table")
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import engine
+    OrderStateEvent.__table__.create(bind=engine, checkfirst=True)
+    print(json.dumps({"created": OrderStateEvent.__tablename__}))
+
+
+if __name__ == "__main__":
+    main()
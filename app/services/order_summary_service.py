@@ -0,0 +1,327 @@
+"""
+Per-order sustainability rollups
+Order value, item count and average sustainability are aggregated once when an order is placed
+and kept in order_sustainability_summary, so carbon goals and forecasting read one row per order
+instead of re-joining orders -> cart_items -> products -> sustainability_ratings on every call
+
+Backfill existing orders with:
+    python -m app.services.order_summary_service --batch-size 500
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session
+
+from app.models.orders import Order
+from app.models.cart_item import CartItem
+from app.models.product import Product
+from app.models.sustainability_ratings import SustainabilityRating
+from app.models.order_sustainability_summary import OrderSustainabilitySummary
+from app.services.forecast_state_service import record_order_event, UNRATED_ORDER_SUSTAINABILITY
+
+logger = logging.getLogger(__name__)
+
+# Callbacks run with the user_id once a change to one of the user's order summaries has committed
+_order_listeners: List[Callable[[str], None]] = []
+# Session.info key for the user ids to notify when the session's transaction commits
+_PENDING_LISTENER_USERS = "order_listener_user_ids"
+
+
+def add_order_listener(listener: Callable[[str], None]):
+    """Register a callback (e.g. a cache invalidation) for changes to a user's orders"""
+    if listener not in _order_listeners:
+        _order_listeners.append(listener)
+
+
+def _notify_order_listeners(user_id: str):
+    for listener in _order_listeners:
+        try:
+            listener(user_id)
+        except Exception as e:
+            logger.warning(f"Order listener {listener.__name__} failed for user {user_id}: {e}")
+
+
+def _queue_order_listeners(db: Session, user_id: str):
+    """
+    Notify the listeners about the user once the caller's transaction commits
+    Notifying earlier would let a cache refill from data the transaction has not committed yet
+    """
+    db.info.setdefault(_PENDING_LISTENER_USERS, []).append(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session: Session):
+    for user_id in dict.fromkeys(session.info.pop(_PENDING_LISTENER_USERS, [])):
+        _notify_order_listeners(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session: Session, previous_transaction):
+    # A savepoint rolling back leaves the outer transaction, and what it queued, in place
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING_LISTENER_USERS, None)
+
+
+def build_order_summaries(db: Session, orders: List[Order]) -> List[OrderSustainabilitySummary]:
+    """
+    Aggregate summaries for a batch of orders with two grouped queries over their carts
+    Ratings are averaged per rating row, matching the joins the carbon features used before
+    """
+    cart_ids = list({order.cart_id for order in orders})
+    if not cart_ids:
+        return []
+
+    line_totals = {
+        row.cart_id: row
+        for row in db.query(
+            CartItem.cart_id,
+            func.coalesce(func.sum(CartItem.quantity * Product.price), 0).label("order_value"),
+            func.count(CartItem.id).label("item_count")
+        )
+        .outerjoin(Product, Product.id == CartItem.product_id)
+        .filter(CartItem.cart_id.in_(cart_ids))
+        .group_by(CartItem.cart_id)
+        .all()
+    }
+    rating_averages = dict(
+        db.query(CartItem.cart_id, func.avg(SustainabilityRating.value))
+        .join(SustainabilityRating, SustainabilityRating.product_id == CartItem.product_id)
+        .filter(CartItem.cart_id.in_(cart_ids))
+        .group_by(CartItem.cart_id)
+        .all()
+    )
+
+    summaries = []
+    for order in orders:
+        totals = line_totals.get(order.cart_id)
+        avg_rating = rating_averages.get(order.cart_id)
+        summaries.append(OrderSustainabilitySummary(
+            order_id=order.id,
+            user_id=order.user_id,
+            order_created_at=order.created_at or datetime.utcnow(),
+            cancelled=order.state == "Cancelled",
+            order_value=totals.order_value if totals else 0,
+            item_count=totals.item_count if totals else 0,
+            avg_sustainability=float(avg_rating) if avg_rating is not None else None
+        ))
+    return summaries
+
+
+def record_order_summary(db: Session, order: Order) -> Optional[OrderSustainabilitySummary]:
+    """
+    Write the summary for a newly placed order inside the caller's transaction
+    Runs in a savepoint so a missing summary table never fails the order itself
+    """
+    savepoint = db.begin_nested()
+    try:
+        summaries = build_order_summaries(db, [order])
+        summary = db.merge(summaries[0]) if summaries else None
+        db.flush()
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.warning(f"Could not record sustainability summary for order {order.id}: {e}")
+        return None
+
+    if summary is not None:
+        _update_forecast_state(db, summary, sign=1)
+        _queue_order_listeners(db, summary.user_id)
+    return summary
+
+
+def set_order_summary_cancelled(db: Session, order_id: int, cancelled: bool = True):
+    """Mirror an order's cancellation onto its summary and forecast state inside the caller's transaction"""
+    savepoint = db.begin_nested()
+    try:
+        summary = (
+            db.query(OrderSustainabilitySummary)
+            .filter(OrderSustainabilitySummary.order_id == order_id)
+            .with_for_update()
+            .first()
+        )
+        changed = summary is not None and summary.cancelled != cancelled
+        if changed:
+            summary.cancelled = cancelled
+            db.flush()
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.warning(f"Could not update sustainability summary for order {order_id}: {e}")
+        return
+
+    if changed:
+        _update_forecast_state(db, summary, sign=-1 if cancelled else 1)
+        _queue_order_listeners(db, summary.user_id)
+
+
+def set_order_summaries_cancelled(db: Session, order_ids: List[int], cancelled: bool = True):
+    """set_order_summary_cancelled for many orders: one UPDATE of the summaries whose flag changes"""
+    savepoint = db.begin_nested()
+    try:
+        changed = db.execute(
+            update(OrderSustainabilitySummary)
+            .where(
+                OrderSustainabilitySummary.order_id.in_(order_ids),
+                OrderSustainabilitySummary.cancelled.isnot(cancelled)
+            )
+            .values(cancelled=cancelled)
+            .returning(
+                OrderSustainabilitySummary.user_id,
+                OrderSustainabilitySummary.order_created_at,
+                OrderSustainabilitySummary.avg_sustainability
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.warning(f"Could not update sustainability summaries for {len(order_ids)} orders: {e}")
+        return
+
+    for summary in changed:
+        _update_forecast_state(db, summary, sign=-1 if cancelled else 1)
+    for summary in changed:
+        _queue_order_listeners(db, summary.user_id)
+
+
+def _update_forecast_state(db: Session, summary: OrderSustainabilitySummary, sign: int):
+    """Fold the order into (or out of) the user's online forecast state in its own savepoint"""
+    savepoint = db.begin_nested()
+    try:
+        record_order_event(db, summary.user_id, summary.order_created_at, summary.avg_sustainability, sign)
+        db.flush()
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.warning(f"Could not update forecast state for user {summary.user_id}: {e}")
+
+
+def get_user_order_summaries(db: Session, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Most recent non-cancelled orders for a user, newest first, in the row shape forecasting expects
+    Served by the (user_id, order_created_at) index
+    """
+    rows = (
+        db.query(OrderSustainabilitySummary)
+        .filter(OrderSustainabilitySummary.user_id == user_id, OrderSustainabilitySummary.cancelled.is_(False))
+        .order_by(OrderSustainabilitySummary.order_created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "id": row.order_id,
+            "created_at": row.order_created_at,
+            "order_value": row.order_value,
+            "avg_sustainability_rating": (
+                row.avg_sustainability if row.avg_sustainability is not None else UNRATED_ORDER_SUSTAINABILITY
+            ),
+            "item_count": row.item_count
+        }
+        for row in rows
+    ]
+
+
+def get_monthly_order_sustainability(db: Session, user_id: str, month: int, year: int) -> List[float]:
+    """Average sustainability of each rated, non-cancelled order a user placed in the given month"""
+    month_start = datetime(year, month, 1)
+    next_month = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+
+    rows = (
+        db.query(OrderSustainabilitySummary.avg_sustainability)
+        .filter(
+            OrderSustainabilitySummary.user_id == user_id,
+            OrderSustainabilitySummary.order_created_at >= month_start,
+            OrderSustainabilitySummary.order_created_at < next_month,
+            OrderSustainabilitySummary.cancelled.is_(False),
+            OrderSustainabilitySummary.avg_sustainability.isnot(None)
+        )
+        .all()
+    )
+    return [float(row.avg_sustainability) for row in rows]
+
+
+def get_monthly_order_sustainability_totals(db: Session, user_id: str, start: datetime,
+                                            end: datetime) -> Dict[Tuple[int, int], Tuple[float, int]]:
+    """
+    Sum and count of rated, non-cancelled order averages per calendar month in [start, end)
+    One grouped query keyed by (year, month), replacing a get_monthly_order_sustainability call per month
+    """
+    month = func.date_trunc("month", OrderSustainabilitySummary.order_created_at).label("month")
+    rows = (
+        db.query(
+            month,
+            func.sum(OrderSustainabilitySummary.avg_sustainability).label("total"),
+            func.count(OrderSustainabilitySummary.avg_sustainability).label("orders")
+        )
+        .filter(
+            OrderSustainabilitySummary.user_id == user_id,
+            OrderSustainabilitySummary.order_created_at >= start,
+            OrderSustainabilitySummary.order_created_at < end,
+            OrderSustainabilitySummary.cancelled.is_(False),
+            OrderSustainabilitySummary.avg_sustainability.isnot(None)
+        )
+        .group_by(month)
+        .all()
+    )
+    return {(row.month.year, row.month.month): (float(row.total), int(row.orders)) for row in rows}
+
+
+def backfill_order_summaries(db: Session, batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Rebuild summaries for every order, walking orders by id and committing each batch
+    Safe to re-run; existing rows are overwritten with freshly aggregated values
+    """
+    start_time = time.monotonic()
+    totals = {"orders": 0, "batches": 0}
+    after_id = 0
+
+    while True:
+        orders = (
+            db.query(Order)
+            .filter(Order.id > after_id)
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not orders:
+            break
+        after_id = orders[-1].id
+
+        for summary in build_order_summaries(db, orders):
+            db.merge(summary)
+        db.commit()
+
+        totals["orders"] += len(orders)
+        totals["batches"] += 1
+        logger.info(f"Order summary backfill progress: {totals}")
+
+    totals["elapsed_seconds"] = round(time.monotonic() - start_time, 2)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill per-order sustainability summaries")
+    parser.add_argument("--batch-size", type=int, default=500, help="Orders aggregated and committed per batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    OrderSustainabilitySummary.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        totals = backfill_order_summaries(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,29 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy import Integer, case, column, func, select, tuple_, update, values
 from decimal import Decimal
-from datetime import datetime, timedelta
+from datetime import datetime
 import asyncio
+import base64
+import json
 
 from app.models.orders import Order
 from app.models.cart import Cart
 from app.models.cart_item import CartItem
 from app.models.product import Product
+from app.models.product_images import ProductImage
 from app.models.user import User
-from app.services.product_service import fetchProductImages
-from app.services.sustainabilityRatings_service import fetchSustainabilityRatings
-from app.services.email_service import email_service
-
-async def send_order_confirmation_email(order, cart_items, user, db: Session):
-    """Helper function to prepare and send order confirmation email"""
-    try:
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        logger.info(f"Preparing email data for order {order.id}")
-        
-        # Calculate estimated delivery date (5-7 business days)
-        delivery_date = datetime.now() + timedelta(days=6)  # 6 days for business days
-        
-        # Prepare order items with details
-        email_items = []
-        total_amount = Decimal('0.00')
-        sustainability_ratings = []
-        
-        for item in cart_items:
-            # Get product details
-            product = db.query(Product).filter(Product.id == item.product_id).first()
-            if not product:
-                continue
-                
-            # Get product images
-            product_images = fetchProductImages(db, product.id)
-            image_url = product_images[0].image_url if product_images else None
-            
-            # Get sustainability rating
-            sustainability_response = fetchSustainabilityRatings({"product_id": product.id}, db)
-            sustainability_rating = sustainability_response.get("rating", 0)
-            sustainability_ratings.append(sustainability_rating)
-            
-            # Calculate item total
-            item_price = Decimal(str(product.price))
-            item_total = item_price * item.quantity
-            total_amount += item_total
-            
-            email_items.append({
-                'name': product.name,
-                'quantity': item.quantity,
-                'price': float(item_price),
-                'sustainability_rating': sustainability_rating,
-                'image_url': image_url
-            })
-        
-        # Calculate average sustainability
-        average_sustainability = sum(sustainability_ratings) / len(sustainability_ratings) if sustainability_ratings else 0
-        
-        # Prepare email data
-        order_data = {
-            'order_id': order.id,
-            'order_date': order.created_at.strftime('%Y-%m-%d %H:%M') if order.created_at else datetime.now().strftime('%Y-%m-%d %H:%M'),
-            'delivery_date': delivery_date.strftime('%Y-%m-%d'),
-            'status': order.state,
-            'items': email_items,
-            'total_amount': float(total_amount),
-            'average_sustainability': float(average_sustainability),
-            'co2_saved': f"{float(average_sustainability) * 0.05:.1f}",  # Estimated based on sustainability
-            'water_saved': f"{len(email_items) * 3 + int(float(average_sustainability) * 0.2)}",  # Estimated
-            'waste_reduced': f"{min(int(float(average_sustainability) * 0.8), 95)}"  # Estimated percentage
-        }
-        
-        # Send email
-        if user.email:
-            logger.info(f"Sending order confirmation email to {user.email}")
-            email_sent = await email_service.send_order_confirmation(
-                customer_email=user.email,
-                customer_name=user.name or "Valued Customer",
-                order_data=order_data
-            )
-            
-            if email_sent:
-                logger.info(f"✅ Order confirmation email sent successfully for order {order.id}")
-            else:
-                logger.warning(f"❌ Failed to send order confirmation email for order {order.id}")
-        else:
-            logger.warning(f"No email address found for user {user.id}")
-            
-    except Exception as e:
-        logger.error(f"Error in send_order_confirmation_email: {e}")
-        # Don't raise the exception as we don't want to fail order creation
+from app.services.sustainabilityRatings_service import (
+    dynamicSustainabilityScoreSubquery,
+    fetchSustainabilityRatingsForProducts
+)
+from app.services.order_summary_service import record_order_summary
+from app.services.order_state_service import transition_order
+from app.services.order_email_outbox import enqueue_order_confirmation, wake_outbox_worker
+from app.services.cart import mark_cart_ordered
+from app.services.stock_reservation import take_cart_holds
+from app.services.order_line_service import requested_quantities, order_total, add_order_lines
+from app.db.executor import run_blocking
 
 def fetchAllOrders(request, db: Session):
     orders = db.query(Order).filter(Order.user_id == request.userID).order_by(Order.created_at.desc()).all()
@@ -102,6 +33,67 @@ def fetchAllOrders(request, db: Session):
         "orders": orders
     }
 
+ORDER_HISTORY_MAX_LIMIT = 100
+
+def _encode_order_cursor(created_at, order_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), order_id]).encode()).decode()
+
+def _decode_order_cursor(cursor):
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def fetchOrderHistory(request, db: Session):
+    """
+    One page of the user's orders, newest first, each with its item count, total and average sustainability
+    Pages are keyed on (created_at, id) and the counts are grouped in the same query; the total is the one
+    paid at checkout, not the items at current prices
+    """
+    limit = max(1, min(request.limit, ORDER_HISTORY_MAX_LIMIT))
+
+    page = select(Order.id, Order.cart_id, Order.state, Order.created_at, Order.total_amount).where(
+        Order.user_id == request.userID
+    )
+    if request.cursor:
+        page = page.where(tuple_(Order.created_at, Order.id) < _decode_order_cursor(request.cursor))
+    page = page.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).subquery()
+
+    # Per line, as on the order detail page: the product's weighted score, unrated products count as 0,
+    # lines without a product are left out
+    product_rating = dynamicSustainabilityScoreSubquery(Product.id)
+    line_rating = case((Product.id.isnot(None), func.coalesce(product_rating, 0)))
+
+    rows = db.execute(
+        select(
+            page.c.id,
+            page.c.cart_id,
+            page.c.state,
+            page.c.created_at,
+            func.count(Product.id).label("item_count"),
+            func.coalesce(page.c.total_amount, 0).label("total_amount"),
+            func.coalesce(func.round(func.avg(line_rating), 2), 0).label("average_sustainability")
+        )
+        .select_from(page)
+        .outerjoin(CartItem, CartItem.cart_id == page.c.cart_id)
+        .outerjoin(Product, Product.id == CartItem.product_id)
+        .group_by(page.c.id, page.c.cart_id, page.c.state, page.c.created_at, page.c.total_amount)
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_order_cursor(rows[-1].created_at, rows[-1].id)
+
+    return {
+        "status": 200,
+        "message": "Success",
+        "orders": [dict(row._mapping) for row in rows],
+        "next_cursor": next_cursor
+    }
+
 def fetchOrderById(request, db: Session):
     order = db.query(Order).filter(Order.id == request.orderID, Order.user_id == request.userID).first()
     if not order:
@@ -111,21 +103,30 @@ def fetchOrderById(request, db: Session):
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
 
-    cartItems = db.query(CartItem).filter(CartItem.cart_id == cart.id).all()
-
-    products, images, quantities, rating = [], [], [], []
-
-    for item in cartItems:
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        if not product:
-            continue
+    # Items with their products and first images in one query; items whose product is gone are skipped
+    first_image = (
+        select(ProductImage.image_url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    rows = (
+        db.execute(
+            select(Product, CartItem.quantity, first_image.label("image_url"))
+            .select_from(CartItem)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.cart_id == cart.id)
+            .order_by(CartItem.id)
+        ).all()
+    )
+    product_ratings = fetchSustainabilityRatingsForProducts({product.id for product, _, _ in rows}, db)
 
-        products.append(product)
-        fetched_images = fetchProductImages(db, product.id)
-        images.append(fetched_images[0].image_url if fetched_images else None)
-        quantities.append(item.quantity)
-        res = fetchSustainabilityRatings({"product_id": product.id}, db)
-        rating.append(res.get("rating", 0))
+    products = [product for product, _, _ in rows]
+    images = [image_url for _, _, image_url in rows]
+    quantities = [quantity for _, quantity, _ in rows]
+    rating = [product_ratings[product.id] for product in products]
 
     avg_rating = round(sum(rating) / len(rating), 2) if rating else 0.0
 
@@ -140,7 +141,53 @@ def fetchOrderById(request, db: Session):
         "average_sustainability": Decimal(avg_rating)
     }
 
-async def createOrder(request, db: Session):
+def _decrement_stock(db: Session, requested, held=None):
+    """
+    Take the requested quantity of each product out of stock with one conditional UPDATE, keeping in_stock in step
+    Units the cart held (see app.services.stock_reservation) are converted: they leave reserved_quantity
+    and count as available to this order, so only the unheld remainder competes with other carts' holds.
+    Product rows are locked in id order first so overlapping checkouts cannot deadlock; the locked
+    (id, price, retailer_id) rows are returned by id so the order is priced as of this transaction.
+    Raises 409 naming the products that lack stock; the caller's rollback then undoes everything
+    """
+    held = held or {}
+    # A hold whose line is gone is still released
+    product_ids = sorted(set(requested) | set(held))
+
+    locked = db.execute(
+        select(Product.id, Product.price, Product.retailer_id)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all()
+
+    demand = values(
+        column("product_id", Integer), column("requested", Integer), column("held", Integer), name="demand"
+    ).data([(product_id, requested.get(product_id, 0), held.get(product_id, 0)) for product_id in product_ids])
+    remaining = Product.quantity - demand.c.requested
+    decremented = db.execute(
+        update(Product)
+        .where(
+            Product.id == demand.c.product_id,
+            Product.quantity - Product.reserved_quantity + demand.c.held >= demand.c.requested
+        )
+        .values(
+            quantity=remaining,
+            in_stock=remaining > 0,
+            reserved_quantity=Product.reserved_quantity - demand.c.held
+        )
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    short = sorted(set(requested) - set(decremented))
+    if short:
+        raise HTTPException(status_code=409, detail=f"Insufficient stock for products: {short}")
+
+    return {product.id: product for product in locked}
+
+def _place_order(request, db: Session):
+    """Validate the cart and write the order with its sustainability rollup (blocking DB work)"""
     import logging
     logger = logging.getLogger(__name__)
     
@@ -166,34 +213,28 @@ async def createOrder(request, db: Session):
     logger.info(f"Found {len(cart_items)} items in cart {request.cartID}")
 
     try:
-        # Simplified version - skip stock validation for now to test email functionality
+        # Stock, order with its priced lines, sustainability rollup and queued confirmation email
+        # commit in one transaction
+        quantities = requested_quantities(cart_items)
+        products = _decrement_stock(db, quantities, take_cart_holds(db, request.cartID))
+
         logger.info(f"Creating order with user_id={user.id}, cart_id={request.cartID}")
-        order = Order(user_id=user.id, cart_id=request.cartID, state="Preparing Order")
+        order = Order(
+            user_id=user.id,
+            cart_id=request.cartID,
+            state="Preparing Order",
+            total_amount=order_total(quantities, products)
+        )
         db.add(order)
+        db.flush()
+        mark_cart_ordered(db, request.cartID)
+        add_order_lines(db, order, quantities, products)
+        record_order_summary(db, order)
+        enqueue_order_confirmation(db, order)
         db.commit()
         db.refresh(order)
-
-        products = db.query(CartItem).filter(CartItem.cart_id == order.cart_id).all()
-
-        for x in products:
-            product = db.query(Product).filter(Product.id == x.product_id).first()
-            product.quantity -= product.quantity
-            db.commit()
-            db.refresh(product)
-        
         
         logger.info(f"Order created successfully with ID: {order.id}")
-        
-        # Send order confirmation email asynchronously
-        try:
-            logger.info("Attempting to send order confirmation email...")
-            await send_order_confirmation_email(order, cart_items, user, db)
-            logger.info("Order confirmation email process completed")
-        except Exception as email_error:
-            # Log email error but don't fail the order creation
-            logger.error(f"Failed to send order confirmation email: {email_error}")
-            import traceback
-            logger.error(f"Email error traceback: {traceback.format_exc()}")
 
     except HTTPException:
         # Re-raise HTTPExceptions as-is (these are intentional errors with proper status codes)
@@ -205,6 +246,15 @@ async def createOrder(request, db: Session):
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating order: {str(e)}")
 
+    return order
+
+async def createOrder(request, db: Session):
+    # The synchronous Session work runs on the blocking pool, not the event loop
+    order = await run_blocking(_place_order, request, db)
+
+    # The confirmation email was queued with the order; the outbox worker renders and sends it
+    wake_outbox_worker()
+
     return {
         "status": 201,
         "message": "Order created successfully",
@@ -216,9 +266,7 @@ def cancellOrder(request, db: Session):
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order.state = "Cancelled"
-    db.commit()
-    db.refresh(order)
+    transition_order(db, order.id, "Cancelled")
 
     return {
         "status": 204,
@@ -1,4 +1,3 @@
-from sqlalchemy import func
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import and_, or_
 from app.models.product import Product
@@ -59,7 +58,7 @@ def fetchProductImages(db: Session, product_id: int, limit: int = 1):
     return query.limit(limit).all()
 
 def fetchAllProducts(request, db: Session):
-    from app.utilities.stock_utils import sync_stock_status
+    from app.services.stock_reconciliation import reconcile_stock_status
     
     products_query = db.query(Product) if not hasattr(Product, 'images') else db.query(Product).options(joinedload(Product.images))
 
@@ -122,8 +121,7 @@ def fetchAllProducts(request, db: Session):
 
     # Sync stock status for all fetched products to ensure consistency
     product_ids = [product.id for product in products]
-    for product_id in product_ids:
-        sync_stock_status(db, product_id)
+    reconcile_stock_status(db, product_ids=product_ids)
     
     # Refresh products after sync
     for product in products:
@@ -253,27 +251,9 @@ def fetchProduct(request, db: Session):
     req = {"product_id": product.id}
     sustainability_data = fetchSustainabilityRatings(req, db)
 
-    # Calculate units sold
-    from app.models.orders import Order
-    from app.models.cart_item import CartItem
-    from app.models.cart import Cart
-    # Join CartItem -> Cart -> Order, filter for delivered orders, sum quantity for this product
-    from sqlalchemy import select, join
-    valid_states = [
-        "Preparing Order", "Ready for Delivery", "In Transit", "Delivered"
-    ]
-    # Build explicit SELECTs to avoid SAWarning about coercing Subquery into select() for IN()
-    from sqlalchemy import select
-    valid_orders_select = select(Order.id).where(Order.state.in_(valid_states))
-    valid_carts_select = select(Cart.id).where(Cart.id.in_(select(Order.cart_id).where(Order.state.in_(valid_states))))
-    units_sold = db.query(func.sum(CartItem.quantity)).filter(
-        CartItem.product_id == product.id,
-        CartItem.cart_id.in_(valid_carts_select)
-    ).scalar() or 0
-
-    # Calculate revenue
-    price = float(product.price) if product and product.price else 0.0
-    revenue = units_sold * price
+    # Units sold and revenue at purchase prices, from the order line snapshots
+    from app.services.order_line_service import get_product_sales
+    units_sold, revenue = get_product_sales(db, product.id)
 
     logger.info(f"Final response for product {product_id}: category_name='{category_name}', retailer_name='{retailer_name}', quantity={product.quantity}, in_stock={product.in_stock}")
 
@@ -3,8 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, extract
 from app.models.product import Product
 from app.models.orders import Order
-from app.models.cart import Cart
-from app.models.cart_item import CartItem
+from app.models.order_line import OrderLine
 from app.models.sustainability_ratings import SustainabilityRating
 from app.schemas.retailer_metrics import RetailerMetrics
 
@@ -27,37 +26,24 @@ def get_retailer_metrics_logic(retailer_id: int, db: Session) -> RetailerMetrics
     )
     avg_rating = round(float(avg_rating_query), 2) if avg_rating_query else 0.0
 
-    # 4. Total Units Sold (excluding cancelled)
-    total_units_sold = (
-        db.query(func.sum(CartItem.quantity))
-        .join(Cart, Cart.id == CartItem.cart_id)
-        .join(Order, Order.cart_id == Cart.id)
-        .join(Product, Product.id == CartItem.product_id)
-        .filter(Product.retailer_id == retailer_id, Order.state != "Cancelled")
-        .scalar()
-    ) or 0
-
-    # 5. Total Revenue (excluding cancelled)
-    total_revenue = (
-        db.query(func.sum(CartItem.quantity * Product.price))
-        .join(Cart, Cart.id == CartItem.cart_id)
-        .join(Order, Order.cart_id == Cart.id)
-        .join(Product, Product.id == CartItem.product_id)
-        .filter(Product.retailer_id == retailer_id, Order.state != "Cancelled")
-        .scalar()
+    # 4 & 5. Total Units Sold and Revenue at purchase prices (excluding cancelled)
+    total_units_sold, total_revenue = (
+        db.query(func.sum(OrderLine.quantity), func.sum(OrderLine.quantity * OrderLine.unit_price))
+        .join(Order, Order.id == OrderLine.order_id)
+        .filter(OrderLine.retailer_id == retailer_id, Order.state != "Cancelled")
+        .one()
     )
+    total_units_sold = total_units_sold or 0
     total_revenue = round(float(total_revenue), 2) if total_revenue else 0.0
 
     # 6. Monthly Revenue (Jan–Dec, ensure 12 months)
     monthly_raw = (
         db.query(
             extract("month", Order.created_at).label("month"),
-            func.sum(CartItem.quantity * Product.price).label("revenue")
+            func.sum(OrderLine.quantity * OrderLine.unit_price).label("revenue")
         )
-        .join(Cart, Cart.id == CartItem.cart_id)
-        .join(Order, Order.cart_id == Cart.id)
-        .join(Product, Product.id == CartItem.product_id)
-        .filter(Product.retailer_id == retailer_id, Order.state != "Cancelled")
+        .join(Order, Order.id == OrderLine.order_id)
+        .filter(OrderLine.retailer_id == retailer_id, Order.state != "Cancelled")
         .group_by("month")
         .all()
     )
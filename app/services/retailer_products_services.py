@@ -16,10 +16,21 @@ def fetchRetailerProducts(retailer_id: int, db: Session):
     enriched_products = []
 
     from app.models.orders import Order
-    from app.models.cart_item import CartItem
-    from app.models.cart import Cart
+    from app.models.order_line import OrderLine
     from sqlalchemy import func
-    valid_states = ["Preparing Order", "Ready for Delivery", "In Transit", "Delivered"]
+    # Units sold and revenue at purchase prices for all of the retailer's products in one grouped query
+    sales = {
+        row.product_id: row
+        for row in db.query(
+            OrderLine.product_id,
+            func.sum(OrderLine.quantity).label("units_sold"),
+            func.sum(OrderLine.quantity * OrderLine.unit_price).label("revenue")
+        )
+        .join(Order, Order.id == OrderLine.order_id)
+        .filter(OrderLine.retailer_id == retailer_id, Order.state != "Cancelled")
+        .group_by(OrderLine.product_id)
+        .all()
+    }
     for product in products:
         # Get all images for the product (only S3 URLs)
         all_images = fetchRetailerProductImages(db, product.id, limit=-1)
@@ -32,13 +43,9 @@ def fetchRetailerProducts(retailer_id: int, db: Session):
         sustainability = fetchSustainabilityRatings(req, db)
         rating = sustainability.get("rating", 0)
 
-        valid_carts = db.query(Cart.id).filter(Cart.id.in_(db.query(Order.cart_id).filter(Order.state.in_(valid_states)))).subquery()
-        units_sold = db.query(func.sum(CartItem.quantity)).filter(
-            CartItem.product_id == product.id,
-            CartItem.cart_id.in_(valid_carts)
-        ).scalar() or 0
-        price = float(product.price) if product and product.price else 0.0
-        revenue = units_sold * price
+        sale = sales.get(product.id)
+        units_sold = int(sale.units_sold) if sale else 0
+        revenue = float(sale.revenue) if sale else 0.0
 
         enriched_products.append({
             "id": product.id,
@@ -0,0 +1,137 @@
+"""
+Stock status reconciliation
+products.in_stock is derived from products.quantity. Instead of loading products and comparing them in
+Python, each pass is one UPDATE ... WHERE in_stock IS DISTINCT FROM (quantity > 0) RETURNING per id
+range, committed per chunk, so memory and lock time stay flat however large the catalog grows. Full
+runs record what they corrected in stock_drift_runs, so drift showing up (something writing quantity
+without in_stock) can be monitored
+
+Reconcile the whole catalog with:
+    python -m app.services.stock_reconciliation --chunk-size 10000
+"""
+import argparse
+import json
+import logging
+import time
+from typing import Dict, Any, Iterable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.models.product import Product
+from app.models.stock_drift import StockDriftRun
+
+logger = logging.getLogger(__name__)
+
+STOCK_RECONCILE_CHUNK_SIZE = 10000
+# A first run over a never-synced catalog can correct many products; the history keeps the first ones
+STOCK_DRIFT_MAX_RECORDED_IDS = 1000
+
+
+def _reconcile(db: Session, *criteria) -> List[Any]:
+    """Correct in_stock for the matching products whose flag disagrees with their quantity; (id, in_stock) rows"""
+    # A NULL quantity counts as out of stock, and a NULL in_stock is always corrected
+    expected = func.coalesce(Product.quantity, 0) > 0
+    return db.execute(
+        update(Product)
+        .where(*criteria, Product.in_stock.is_distinct_from(expected))
+        .values(in_stock=expected)
+        .returning(Product.id, Product.in_stock)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def reconcile_stock_status(db: Session, product_ids: Optional[Iterable[int]] = None,
+                           chunk_size: int = STOCK_RECONCILE_CHUNK_SIZE, record: bool = True) -> Dict[str, Any]:
+    """
+    Set in_stock from quantity for the given products, or the whole catalog in id-range chunks
+    Returns the drifted ids with counts; full runs are recorded in stock_drift_runs unless record is False
+    """
+    start_time = time.monotonic()
+    drifted = []
+    chunks = 0
+
+    # Each statement commits only if it corrected something, which also releases its row locks
+    if product_ids is not None:
+        product_ids = sorted(set(product_ids))
+        if product_ids:
+            drifted = _reconcile(db, Product.id.in_(product_ids))
+            chunks = 1
+            if drifted:
+                db.commit()
+    else:
+        low, high = db.execute(select(func.min(Product.id), func.max(Product.id))).one()
+        if low is not None:
+            for chunk_start in range(low, high + 1, chunk_size):
+                corrected = _reconcile(db, Product.id >= chunk_start, Product.id < chunk_start + chunk_size)
+                if corrected:
+                    db.commit()
+                drifted.extend(corrected)
+                chunks += 1
+
+    drifted_ids = sorted(row.id for row in drifted)
+    totals = {
+        "drifted_count": len(drifted_ids),
+        "marked_in_stock": sum(1 for row in drifted if row.in_stock),
+        "marked_out_of_stock": sum(1 for row in drifted if not row.in_stock),
+        "drifted_ids": drifted_ids,
+        "chunks": chunks,
+        "elapsed_seconds": round(time.monotonic() - start_time, 2)
+    }
+    if drifted_ids:
+        logger.info(f"Synced stock status for {len(drifted_ids)} products: {drifted_ids[:STOCK_DRIFT_MAX_RECORDED_IDS]}")
+
+    if record and product_ids is None:
+        db.add(StockDriftRun(
+            drifted_count=totals["drifted_count"],
+            marked_in_stock=totals["marked_in_stock"],
+            marked_out_of_stock=totals["marked_out_of_stock"],
+            product_ids=drifted_ids[:STOCK_DRIFT_MAX_RECORDED_IDS],
+            chunks=chunks,
+            elapsed_seconds=totals["elapsed_seconds"]
+        ))
+        db.commit()
+
+    return totals
+
+
+def get_stock_drift_history(db: Session, limit: int = 20) -> List[Dict[str, Any]]:
+    """The most recent full reconciliation runs, newest first"""
+    runs = db.query(StockDriftRun).order_by(StockDriftRun.run_at.desc(), StockDriftRun.id.desc()).limit(limit).all()
+    return [
+        {
+            "id": run.id,
+            "run_at": run.run_at.isoformat() if run.run_at else None,
+            "drifted_count": run.drifted_count,
+            "marked_in_stock": run.marked_in_stock,
+            "marked_out_of_stock": run.marked_out_of_stock,
+            "product_ids": run.product_ids or [],
+            "chunks": run.chunks,
+            "elapsed_seconds": run.elapsed_seconds
+        }
+        for run in runs
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Set products.in_stock from quantity and record the drift")
+    parser.add_argument("--chunk-size", type=int, default=STOCK_RECONCILE_CHUNK_SIZE,
+                        help="Product id range updated and committed per statement")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    StockDriftRun.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        totals = reconcile_stock_status(db, chunk_size=args.chunk_size)
+    finally:
+        db.close()
+    totals["drifted_ids"] = totals["drifted_ids"][:STOCK_DRIFT_MAX_RECORDED_IDS]
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
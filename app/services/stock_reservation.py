@@ -0,0 +1,247 @@
+"""
+Stock reservations for cart lines
+Adding to a cart places a short-lived hold (one stock_holds row per cart line) and adds it to the
+product's reserved_quantity counter, so quantity - reserved_quantity is what other shoppers can still
+take and checking it reads one product row instead of scanning carts. Taking a hold is one conditional
+UPDATE on that counter, so concurrent adds of a scarce product cannot over-reserve it; under contention
+the product's expired holds are released first. Checkout converts the cart's holds into the stock
+decrement, and a periodic sweep releases expired holds in bulk
+
+Every change to stock_holds adjusts reserved_quantity in the same transaction. Products are locked in
+id order, after the holds involved, so overlapping hold changes, sweeps and checkouts cannot deadlock
+
+Add the counter and table, then sweep every STOCK_HOLD_SWEEP_SECONDS, with:
+    python -m app.services.stock_reservation
+`--once` sweeps what is due and exits; `--rebuild-counters` recomputes reserved_quantity from the holds
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Any, Iterable, List, Optional
+
+from sqlalchemy import Integer, column, delete, func, or_, select, text, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.product import Product
+from app.models.stock_hold import StockHold
+
+logger = logging.getLogger(__name__)
+
+STOCK_HOLD_SECONDS = int(os.getenv("STOCK_HOLD_SECONDS", "900"))
+STOCK_HOLD_SWEEP_SECONDS = 60
+STOCK_HOLD_SWEEP_BATCH = 1000
+
+
+def _available():
+    return func.coalesce(Product.quantity, 0) - Product.reserved_quantity
+
+
+def _lock_products(db: Session, product_ids: Iterable[int]):
+    """Lock product rows in id order before a multi-row counter update"""
+    product_ids = sorted(product_ids)
+    if len(product_ids) > 1:
+        db.execute(select(Product.id).where(Product.id.in_(product_ids)).order_by(Product.id).with_for_update())
+
+
+def _adjust_reserved(db: Session, deltas: Dict[int, int]) -> List[int]:
+    """Add each delta to reserved_quantity, increases only where that much is available; returns ids not increased"""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+    _lock_products(db, deltas)
+    change = values(
+        column("product_id", Integer), column("delta", Integer), name="change"
+    ).data(sorted(deltas.items()))
+    adjusted = set(db.execute(
+        update(Product)
+        .where(Product.id == change.c.product_id, or_(change.c.delta < 0, _available() >= change.c.delta))
+        .values(reserved_quantity=Product.reserved_quantity + change.c.delta)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all())
+    # Releases for products that no longer exist have nothing to adjust
+    return sorted(product_id for product_id, delta in deltas.items() if delta > 0 and product_id not in adjusted)
+
+
+def get_available_quantity(db: Session, product_id: int) -> int:
+    """Units of the product not held by any cart, read from its row"""
+    available = db.execute(select(_available()).where(Product.id == product_id)).scalar()
+    return max(0, available or 0)
+
+
+def cart_availability(db: Session, cart_id: int, product_ids: Iterable[int]) -> Dict[int, Any]:
+    """(id, name, available) per existing product, where available counts this cart's own holds as its stock"""
+    held = (
+        select(StockHold.quantity)
+        .where(StockHold.cart_id == cart_id, StockHold.product_id == Product.id)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        select(Product.id, Product.name, (_available() + func.coalesce(held, 0)).label("available"))
+        .where(Product.id.in_(list(product_ids)))
+    ).all()
+    return {row.id: row for row in rows}
+
+
+def hold_stock(db: Session, cart_id: int, targets: Dict[int, int]) -> List[int]:
+    """
+    Make the cart's holds equal the target quantity per product (0 or less releases it) and restart their expiry
+    Runs in the caller's transaction and returns the products that could not be held; if any are
+    returned, nothing should be committed
+    """
+    product_ids = sorted(targets)
+    if not product_ids:
+        return []
+    # A release never returns more than the cart holds, or the counter would drift below the real holds
+    targets = {product_id: max(0, quantity) for product_id, quantity in targets.items()}
+    held = dict(db.execute(
+        select(StockHold.product_id, StockHold.quantity)
+        .where(StockHold.cart_id == cart_id, StockHold.product_id.in_(product_ids))
+        .with_for_update()
+    ).all())
+    deltas = {product_id: targets[product_id] - held.get(product_id, 0) for product_id in product_ids}
+
+    short = _adjust_reserved(db, deltas)
+    if short:
+        # Lazy expiry: free what abandoned carts still hold of these products, then try them again
+        if release_expired_holds(db, product_ids=short, other_than_cart_id=cart_id):
+            short = _adjust_reserved(db, {product_id: deltas[product_id] for product_id in short})
+        if short:
+            return short
+
+    released = [product_id for product_id in product_ids if targets[product_id] <= 0 and product_id in held]
+    if released:
+        db.execute(
+            delete(StockHold)
+            .where(StockHold.cart_id == cart_id, StockHold.product_id.in_(released))
+            .execution_options(synchronize_session=False)
+        )
+    kept = [product_id for product_id in product_ids if targets[product_id] > 0]
+    if kept:
+        upsert = pg_insert(StockHold).values([
+            {
+                "cart_id": cart_id,
+                "product_id": product_id,
+                "quantity": targets[product_id],
+                "expires_at": func.now() + timedelta(seconds=STOCK_HOLD_SECONDS)
+            }
+            for product_id in kept
+        ])
+        db.execute(upsert.on_conflict_do_update(
+            index_elements=[StockHold.cart_id, StockHold.product_id],
+            set_={"quantity": upsert.excluded.quantity, "expires_at": upsert.excluded.expires_at}
+        ))
+    return []
+
+
+def take_cart_holds(db: Session, cart_id: int) -> Dict[int, int]:
+    """Delete the cart's holds at checkout; the caller's decrement must release the returned units from the counter"""
+    rows = db.execute(
+        delete(StockHold)
+        .where(StockHold.cart_id == cart_id)
+        .returning(StockHold.product_id, StockHold.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    held = {}
+    for product_id, quantity in rows:
+        held[product_id] = held.get(product_id, 0) + quantity
+    return held
+
+
+def release_expired_holds(db: Session, product_ids: Optional[Iterable[int]] = None,
+                          limit: int = STOCK_HOLD_SWEEP_BATCH, other_than_cart_id: Optional[int] = None) -> int:
+    """
+    Delete up to `limit` expired holds (of the given products, or any) and return their units to stock
+    Holds locked by a checkout or another sweep are skipped; runs in the caller's transaction
+    """
+    expired = select(StockHold.id).where(StockHold.expires_at <= func.now())
+    if product_ids is not None:
+        expired = expired.where(StockHold.product_id.in_(list(product_ids)))
+    if other_than_cart_id is not None:
+        # The caller's own holds are already counted in its delta
+        expired = expired.where(StockHold.cart_id != other_than_cart_id)
+    expired = expired.order_by(StockHold.id).limit(limit).with_for_update(skip_locked=True)
+
+    rows = db.execute(
+        delete(StockHold)
+        .where(StockHold.id.in_(expired))
+        .returning(StockHold.product_id, StockHold.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    released = {}
+    for product_id, quantity in rows:
+        released[product_id] = released.get(product_id, 0) - quantity
+    _adjust_reserved(db, released)
+    return len(rows)
+
+
+def sweep_expired_holds(db: Session, batch_size: int = STOCK_HOLD_SWEEP_BATCH) -> Dict[str, Any]:
+    """Release every expired hold, committing each batch"""
+    start_time = time.monotonic()
+    totals = {"released": 0, "batches": 0}
+    while True:
+        released = release_expired_holds(db, limit=batch_size)
+        db.commit()
+        totals["released"] += released
+        totals["batches"] += 1
+        if released < batch_size:
+            break
+    totals["elapsed_seconds"] = round(time.monotonic() - start_time, 2)
+    if totals["released"]:
+        logger.info(f"Released expired stock holds: {totals}")
+    return totals
+
+
+def rebuild_reserved_counts(db: Session) -> int:
+    """Recompute reserved_quantity from the holds (repair after manual edits); returns products corrected"""
+    held = (
+        select(func.coalesce(func.sum(StockHold.quantity), 0))
+        .where(StockHold.product_id == Product.id)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    corrected = db.execute(
+        update(Product)
+        .where(Product.reserved_quantity != held)
+        .values(reserved_quantity=held)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return corrected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Release expired stock holds")
+    parser.add_argument("--once", action="store_true", help="Sweep what is due and exit instead of looping")
+    parser.add_argument("--rebuild-counters", action="store_true",
+                        help="Recompute reserved_quantity from the holds before sweeping")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE products ADD COLUMN IF NOT EXISTS reserved_quantity INTEGER NOT NULL DEFAULT 0"))
+    StockHold.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        if args.rebuild_counters:
+            print(json.dumps({"counters_corrected": rebuild_reserved_counts(db)}))
+        while True:
+            totals = sweep_expired_holds(db)
+            if args.once:
+                print(json.dumps(totals))
+                break
+            time.sleep(STOCK_HOLD_SWEEP_SECONDS)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from sqlalchemy import Numeric, String, case, cast, func, select
 from sqlalchemy.orm import Session, joinedload
 from app.models.sustainability_ratings import SustainabilityRating
 from app.models.sustainability_type import SustainabilityType
@@ -5,6 +6,16 @@ from app.models.product import Product
 from fastapi import HTTPException
 import logging
 
+# Importance of the main sustainability types when weighting their averages; other types get the default
+IMPORTANCE_LEVELS = {
+    'energy_efficiency': 1.2,
+    'carbon_footprint': 1.3,
+    'recyclability': 1.1,
+    'durability': 1.0,
+    'material_sustainability': 1.15
+}
+DEFAULT_IMPORTANCE_LEVEL = 3
+
 def fetchSustainabilityRatings(request, db: Session):
     productID = request.get("product_id", -1)
 
@@ -67,6 +78,52 @@ def fetchSustainabilityRatings(request, db: Session):
         "statistics": formatted_statistics
     }
 
+def fetchSustainabilityRatingsForProducts(product_ids, db: Session):
+    """Overall rating per product id, as fetchSustainabilityRatings returns it, loaded with one query"""
+    ratings = {product_id: 0.0 for product_id in product_ids}
+    if not ratings:
+        return ratings
+
+    statistics_by_product = {}
+    statistics = db.query(SustainabilityRating).options(
+        joinedload(SustainabilityRating.type_info)
+    ).filter(SustainabilityRating.product_id.in_(list(ratings))).all()
+    for stat in statistics:
+        statistics_by_product.setdefault(stat.product_id, []).append(stat)
+
+    for product_id, product_statistics in statistics_by_product.items():
+        ratings[product_id] = round(calculateDynamicSustainabilityScore(product_statistics, db), 1)
+    return ratings
+
+def dynamicSustainabilityScoreSubquery(product_id):
+    """
+    calculateDynamicSustainabilityScore of the product `product_id` points at, as a correlated scalar subquery
+    rounded like fetchSustainabilityRatingsForProducts; NULL for a product without ratings
+    """
+    type_name = func.coalesce(
+        func.replace(func.lower(SustainabilityType.type_name), ' ', '_'),
+        cast(SustainabilityRating.type, String)
+    )
+    weight = case(
+        *((type_name == name, importance) for name, importance in IMPORTANCE_LEVELS.items()),
+        else_=DEFAULT_IMPORTANCE_LEVEL
+    )
+    type_averages = (
+        select(func.avg(SustainabilityRating.value).label("average"), weight.label("weight"))
+        .select_from(SustainabilityRating)
+        .outerjoin(SustainabilityType, SustainabilityType.id == SustainabilityRating.type)
+        .where(SustainabilityRating.product_id == product_id)
+        .group_by(type_name)
+        .correlate_except(SustainabilityRating, SustainabilityType)
+        .subquery()
+    )
+    score = func.sum(type_averages.c.average * type_averages.c.weight) / func.sum(type_averages.c.weight)
+    return (
+        select(func.round(cast(func.greatest(0, func.least(100, score)), Numeric), 1))
+        .having(func.count() > 0)
+        .scalar_subquery()
+    )
+
 def calculateDynamicSustainabilityScore(statistics, db: Session):
     """
     Calculate sustainability score using only the 5 main frontend metrics
@@ -82,13 +139,7 @@ def calculateDynamicSustainabilityScore(statistics, db: Session):
     ]
     
     # Define importance levels for weighting
-    importance_levels = {
-        'energy_efficiency': 1.2,
-        'carbon_footprint': 1.3,
-        'recyclability': 1.1,
-        'durability': 1.0,
-        'material_sustainability': 1.15
-    }
+    importance_levels = IMPORTANCE_LEVELS
     
     main_sustainability_types = frontend_types
     
@@ -162,12 +213,12 @@ def calculateDynamicWeights(available_averages, importance_levels, main_sustaina
     available_types = list(available_averages.keys())
     
     # Calculate total importance for available types only
-    total_importance = sum(importance_levels.get(t, 3) for t in available_types)
+    total_importance = sum(importance_levels.get(t, DEFAULT_IMPORTANCE_LEVEL) for t in available_types)
     
     # Calculate proportional weights for ONLY available types
     weights = {}
     for type_name in available_types:
-        importance = importance_levels.get(type_name, 3)
+        importance = importance_levels.get(type_name, DEFAULT_IMPORTANCE_LEVEL)
         weights[type_name] = importance / total_importance
     
     # Ensure carbon footprint gets at least 35% of total weight if it exists in available types
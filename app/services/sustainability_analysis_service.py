@@ -0,0 +1,286 @@
+"""
+Offline pre-generation of product sustainability analyses (Q2)
+The Q2 answer depends only on the product, so it is generated in batch and stored
+per product with a content hash; only products whose prompt inputs changed are regenerated
+
+Run with:
+    python -m app.services.sustainability_analysis_service --concurrency 4 --rpm 120
+    python -m app.services.sustainability_analysis_service --stub   # local stub model, no API calls
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, joinedload
+
+from app.models.product import Product
+from app.models.categories import Category
+from app.models.retailer_information import RetailerInformation
+from app.models.sustainability_ratings import SustainabilityRating
+from app.models.product_sustainability_analysis import ProductSustainabilityAnalysis
+from app.services.sustainabilityRatings_service import calculateDynamicSustainabilityScore
+from app.services.openai_service import templated_explanation
+
+logger = logging.getLogger(__name__)
+
+# Product fields that feed the Q2 prompt; a change in any of them invalidates the stored analysis
+ANALYSIS_HASH_FIELDS = (
+    "name", "brand", "description", "price", "category_name", "retailer_name", "sustainability_rating"
+)
+
+BATCH_USER_ID = "batch-pregeneration"
+
+
+def analysis_content_hash(product_data: Dict[str, Any]) -> str:
+    """Stable hash of the product fields used to build the Q2 prompt"""
+    payload = {field: product_data.get(field) for field in ANALYSIS_HASH_FIELDS}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_stored_analysis(db: Session, product_data: Dict[str, Any]) -> Optional[str]:
+    """Return the stored analysis for a product if it was generated from the current product content"""
+    try:
+        stored = db.query(ProductSustainabilityAnalysis).filter(
+            ProductSustainabilityAnalysis.product_id == product_data.get("id")
+        ).first()
+    except Exception as e:
+        # Table not created yet (job never run) - fall back to on-demand generation
+        db.rollback()
+        logger.warning(f"Stored analysis lookup failed for product {product_data.get('id')}: {e}")
+        return None
+    if stored and stored.content_hash == analysis_content_hash(product_data):
+        return stored.analysis
+    return None
+
+
+class StubAnalysisModel:
+    """
+    Deterministic local stand-in for the OpenAI service
+    Used for tests and dry runs of the batch job without network access
+    """
+
+    model = "local-stub"
+
+    def __init__(self):
+        self.calls = 0
+        self.last_model_used: Optional[str] = None
+
+    async def sustainability_analysis(self, user_id: str, product_data: Dict[str, Any],
+                                      allow_template: bool = True) -> str:
+        self.calls += 1
+        self.last_model_used = self.model
+        return templated_explanation("sustainability_analysis", product_data)
+
+
+class RateLimiter:
+    """
+    Spaces out request starts to stay under a requests-per-minute budget
+    and backs off for everyone after a failed generation
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, max_backoff: float = 30.0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.max_backoff = max_backoff
+        self.backoff = 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            start = max(self._next_slot, now)
+            self._next_slot = start + self.interval + self.backoff
+        wait = start - now
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_success(self):
+        self.backoff = self.backoff / 2 if self.backoff > 0.1 else 0.0
+
+    def record_failure(self):
+        self.backoff = min(max(self.backoff * 2, 1.0), self.max_backoff)
+
+
+def load_catalog_page(db: Session, after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Load one page of products as Q2 product_data, matching what the /q2 route builds
+    Ratings for the whole page are fetched in one query
+    """
+    rows = (
+        db.query(Product, Category.name, RetailerInformation.name)
+        .outerjoin(Category, Product.category_id == Category.id)
+        .outerjoin(RetailerInformation, Product.retailer_id == RetailerInformation.id)
+        .filter(Product.id > after_id)
+        .order_by(Product.id)
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return []
+
+    product_ids = [product.id for product, _, _ in rows]
+    ratings = (
+        db.query(SustainabilityRating)
+        .options(joinedload(SustainabilityRating.type_info))
+        .filter(SustainabilityRating.product_id.in_(product_ids))
+        .all()
+    )
+    ratings_by_product = defaultdict(list)
+    for rating in ratings:
+        ratings_by_product[rating.product_id].append(rating)
+
+    products = []
+    for product, category_name, retailer_name in rows:
+        statistics = ratings_by_product.get(product.id)
+        rating = round(calculateDynamicSustainabilityScore(statistics, db), 1) if statistics else 0.0
+
+        if not product.category_id:
+            category_name = "Uncategorized"
+        elif category_name is None:
+            category_name = "Unknown Category"
+        if not product.retailer_id:
+            retailer_name = "No retailer specified"
+        elif retailer_name is None:
+            retailer_name = "Unknown Retailer"
+
+        products.append({
+            "id": product.id,
+            "name": product.name,
+            "description": product.description,
+            "price": float(product.price or 0),
+            "brand": product.brand,
+            "sustainability_rating": rating,
+            "category_name": category_name,
+            "retailer_name": retailer_name
+        })
+    return products
+
+
+async def generate_analyses(products: List[Dict[str, Any]], stored_hashes: Dict[int, str], model,
+                            concurrency: int = 4, rate_limiter: Optional[RateLimiter] = None,
+                            force: bool = False) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Generate Q2 analyses for products whose content hash changed, with bounded concurrency
+    Returns (rows to store, counts)
+    """
+    rate_limiter = rate_limiter or RateLimiter()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    counts = {"fresh": 0, "generated": 0, "failed": 0}
+
+    pending = []
+    for product_data in products:
+        content_hash = analysis_content_hash(product_data)
+        if not force and stored_hashes.get(product_data["id"]) == content_hash:
+            counts["fresh"] += 1
+        else:
+            pending.append((product_data, content_hash))
+
+    async def generate(product_data: Dict[str, Any], content_hash: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            await rate_limiter.acquire()
+            try:
+                # Never store degraded templated answers as pre-generated analyses
+                analysis = await model.sustainability_analysis(BATCH_USER_ID, product_data, allow_template=False)
+            except Exception as e:
+                logger.warning(f"Analysis generation failed for product {product_data['id']}: {e}")
+                rate_limiter.record_failure()
+                counts["failed"] += 1
+                return None
+            rate_limiter.record_success()
+            counts["generated"] += 1
+            return {
+                "product_id": product_data["id"],
+                "content_hash": content_hash,
+                "analysis": analysis,
+                "model_used": getattr(model, "last_model_used", None) or getattr(model, "model", None)
+            }
+
+    results = await asyncio.gather(*(generate(p, h) for p, h in pending))
+    return [row for row in results if row is not None], counts
+
+
+def store_analyses(db: Session, rows: List[Dict[str, Any]]):
+    """Upsert generated analyses and commit"""
+    for row in rows:
+        db.merge(ProductSustainabilityAnalysis(**row))
+    db.commit()
+
+
+async def run_pregeneration(db: Session, model, concurrency: int = 4, requests_per_minute: Optional[int] = None,
+                            page_size: int = 200, force: bool = False) -> Dict[str, Any]:
+    """
+    Walk the catalog page by page, regenerate stale analyses and store them
+    Each page is committed on its own so an interrupted run keeps its progress
+    """
+    start_time = time.monotonic()
+    rate_limiter = RateLimiter(requests_per_minute)
+    totals = {"products": 0, "fresh": 0, "generated": 0, "failed": 0}
+    after_id = 0
+
+    while True:
+        products = load_catalog_page(db, after_id, page_size)
+        if not products:
+            break
+        after_id = products[-1]["id"]
+
+        page_ids = [p["id"] for p in products]
+        stored_hashes = dict(
+            db.query(ProductSustainabilityAnalysis.product_id, ProductSustainabilityAnalysis.content_hash)
+            .filter(ProductSustainabilityAnalysis.product_id.in_(page_ids))
+            .all()
+        )
+
+        rows, counts = await generate_analyses(
+            products, stored_hashes, model, concurrency=concurrency, rate_limiter=rate_limiter, force=force
+        )
+        if rows:
+            store_analyses(db, rows)
+
+        totals["products"] += len(products)
+        for key, value in counts.items():
+            totals[key] += value
+        logger.info(f"Pre-generation progress: {totals}")
+
+    totals["elapsed_seconds"] = round(time.monotonic() - start_time, 2)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate product sustainability analyses")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum concurrent model calls")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests-per-minute budget")
+    parser.add_argument("--page-size", type=int, default=200, help="Products loaded and committed per page")
+    parser.add_argument("--force", action="store_true", help="Regenerate even when the content hash is unchanged")
+    parser.add_argument("--stub", action="store_true", help="Use the local stub model instead of OpenAI")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from app.db.database import SessionLocal, engine
+    ProductSustainabilityAnalysis.__table__.create(bind=engine, checkfirst=True)
+
+    if args.stub:
+        model = StubAnalysisModel()
+    else:
+        from app.services.openai_service import get_openai_service
+        model = get_openai_service(os.getenv("OPENAI_API_KEY", ""))
+
+    db = SessionLocal()
+    try:
+        totals = asyncio.run(run_pregeneration(
+            db, model, concurrency=args.concurrency, requests_per_minute=args.rpm,
+            page_size=args.page_size, force=args.force
+        ))
+    finally:
+        db.close()
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    main()
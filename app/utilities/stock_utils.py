@@ -11,43 +11,26 @@ def sync_stock_status(db: Session, product_id: int = None):
     """
     Synchronize the in_stock boolean field with the actual quantity field.
     If product_id is provided, sync only that product, otherwise sync all products.
+    Runs as set-based UPDATEs (see app.services.stock_reconciliation); returns the number of products corrected.
     """
+    from app.services.stock_reconciliation import reconcile_stock_status
+
     if product_id:
-        products = db.query(Product).filter(Product.id == product_id).all()
-    else:
-        products = db.query(Product).all()
-    
-    updated_count = 0
-    
-    for product in products:
-        # Determine correct stock status based on quantity
-        should_be_in_stock = product.quantity is not None and product.quantity > 0
-        
-        # Update if there's a mismatch
-        if product.in_stock != should_be_in_stock:
-            old_status = product.in_stock
-            product.in_stock = should_be_in_stock
-            updated_count += 1
-            
-            logger.info(f"Updated product {product.id} ({product.name}): "
-                       f"quantity={product.quantity}, in_stock: {old_status} -> {should_be_in_stock}")
-    
-    if updated_count > 0:
-        db.commit()
-        logger.info(f"Synced stock status for {updated_count} products")
-    
-    return updated_count
+        return reconcile_stock_status(db, product_ids=[product_id])["drifted_count"]
+    return reconcile_stock_status(db)["drifted_count"]
 
 def is_product_available(product: Product, requested_quantity: int = 1) -> tuple[bool, str]:
     """
     Check if a product is available for the requested quantity.
+    Units held by carts (reserved_quantity) are not available to anyone else.
     Returns (is_available, reason_if_not_available)
     """
     if product.quantity is None or product.quantity <= 0:
         return False, f"Product '{product.name}' is out of stock"
     
-    if product.quantity < requested_quantity:
-        return False, f"Not enough stock for '{product.name}'. Available: {product.quantity}, Requested: {requested_quantity}"
+    available = product.quantity - (product.reserved_quantity or 0)
+    if available < requested_quantity:
+        return False, f"Not enough stock for '{product.name}'. Available: {max(0, available)}, Requested: {requested_quantity}"
     
     if not product.in_stock:
         # This might be a data inconsistency - log it
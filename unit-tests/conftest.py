@@ -0,0 +1,45 @@
+import asyncio
+import gc
+import time
+
+import pytest
+
+# Longest the event loop may go without running other tasks before a handler counts as blocking it
+LOOP_STALL_THRESHOLD = 0.1
+
+
+@pytest.fixture
+def loop_stall():
+    """Run a coroutine factory under a heartbeat task; returns (result, longest event loop stall in seconds)"""
+
+    def run(make_coroutine, interval=0.005):
+        async def measure():
+            stalls = []
+            finished = asyncio.Event()
+
+            async def heartbeat():
+                last = time.perf_counter()
+                while not finished.is_set():
+                    await asyncio.sleep(interval)
+                    now = time.perf_counter()
+                    stalls.append(now - last - interval)
+                    last = now
+
+            beat = asyncio.create_task(heartbeat())
+            await asyncio.sleep(0)
+            try:
+                result = await make_coroutine()
+            finally:
+                finished.set()
+                await beat
+            return result, max(stalls, default=0.0)
+
+        # A collection pass over the suite's accumulated mocks would show up as a stall unrelated to the handler
+        gc.collect()
+        gc.disable()
+        try:
+            return asyncio.run(measure())
+        finally:
+            gc.enable()
+
+    return run
@@ -460,4 +460,119 @@ class TestAdminMockServices:
         # Invalid verification (no notes)
         result = mock_verify_product(None, 123, "admin_001", "")
         assert result["status"] == 400
-        assert "required" in result["message"]
\ No newline at end of file
+        assert "required" in result["message"]
+
+
+class TestAdminRevenueSnapshots:
+    """Admin revenue reads the order totals stored at checkout"""
+
+    def test_revenue_overview_from_stored_totals(self):
+        """Test totals come from two aggregate queries and an empty last month does not divide by zero"""
+        from decimal import Decimal
+        from app.services.admin_overview_services import get_revenue_overview
+
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.one.side_effect = [
+            (Decimal("120.00"), Decimal("30.00")),
+            (Decimal("50.00"), Decimal("0"))
+        ]
+
+        result = get_revenue_overview(4, mock_db)
+
+        assert mock_db.query.call_count == 2
+        assert result["total_revenue"] == 120.0
+        assert result["lost_revenue"] == 30.0
+        assert result["monthly_comparison"] == 1.0
+
+    def test_total_revenue_from_stored_totals(self):
+        """Test total revenue is one SUM over non-cancelled orders"""
+        from decimal import Decimal
+        from app.services.admin_overview_services import get_total_revenue
+
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.scalar.return_value = Decimal("845.10")
+
+        result = get_total_revenue(mock_db)
+
+        mock_db.query.assert_called_once()
+        assert result["total_revenue"] == 845.1
+
+class TestStockReconciliation:
+    """Test set-based stock status reconciliation"""
+
+    def _db(self, bounds, chunks):
+        mock_db = Mock()
+        mock_db.execute.return_value.one.return_value = bounds
+        mock_db.execute.return_value.all.side_effect = chunks
+        return mock_db
+
+    @patch('app.services.stock_reconciliation.StockDriftRun')
+    def test_full_run_updates_in_id_chunks(self, mock_run_model):
+        """Test the catalog is reconciled with one UPDATE per id range, never loading products"""
+        from app.services.stock_reconciliation import reconcile_stock_status
+        mock_db = self._db((1, 250), [[Mock(id=2, in_stock=False)], [], [Mock(id=250, in_stock=True)]])
+
+        totals = reconcile_stock_status(mock_db, chunk_size=100)
+
+        assert totals["drifted_ids"] == [2, 250]
+        assert totals["marked_in_stock"] == 1
+        assert totals["marked_out_of_stock"] == 1
+        assert totals["chunks"] == 3
+        assert mock_db.execute.call_count == 4  # Id bounds, then three range UPDATEs
+        mock_db.query.assert_not_called()
+        updates = [call[0][0] for call in mock_db.execute.call_args_list[1:]]
+        assert all(stmt.is_update for stmt in updates)
+        assert [stmt._where_criteria[0].right.value for stmt in updates] == [1, 101, 201]
+
+    @patch('app.services.stock_reconciliation.StockDriftRun')
+    def test_full_run_records_drift_history(self, mock_run_model):
+        """Test each full run writes one history row with its counts and ids"""
+        from app.services.stock_reconciliation import reconcile_stock_status
+        mock_db = self._db((5, 5), [[Mock(id=5, in_stock=False)]])
+
+        reconcile_stock_status(mock_db)
+
+        kwargs = mock_run_model.call_args[1]
+        assert kwargs["drifted_count"] == 1
+        assert kwargs["marked_out_of_stock"] == 1
+        assert kwargs["product_ids"] == [5]
+        mock_db.add.assert_called_once_with(mock_run_model.return_value)
+
+    @patch('app.services.stock_reconciliation.StockDriftRun')
+    def test_empty_catalog(self, mock_run_model):
+        """Test an empty products table runs no UPDATE but is still recorded"""
+        from app.services.stock_reconciliation import reconcile_stock_status
+        mock_db = self._db((None, None), [])
+
+        totals = reconcile_stock_status(mock_db)
+
+        assert totals["drifted_count"] == 0
+        assert totals["chunks"] == 0
+        mock_db.execute.assert_called_once()
+        mock_db.add.assert_called_once()
+
+    @patch('app.services.stock_reconciliation.StockDriftRun')
+    def test_single_product_sync_is_one_statement(self, mock_run_model):
+        """Test syncing one product is one UPDATE, not recorded as a run, committed only when it changed"""
+        from app.utilities.stock_utils import sync_stock_status
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = []
+
+        updated = sync_stock_status(mock_db, 7)
+
+        assert updated == 0
+        mock_db.execute.assert_called_once()
+        mock_db.commit.assert_not_called()
+        mock_db.add.assert_not_called()
+
+    def test_admin_sync_returns_drift(self):
+        """Test the admin endpoint reports the drifted ids alongside the old updated_count"""
+        from app.routes.admin_stock import sync_all_stock_status
+        totals = {"drifted_count": 2, "marked_in_stock": 1, "marked_out_of_stock": 1, "drifted_ids": [3, 9],
+                  "chunks": 1, "elapsed_seconds": 0.01}
+
+        with patch('app.routes.admin_stock.reconcile_stock_status', return_value=totals):
+            response = sync_all_stock_status(db=Mock())
+
+        assert response["updated_count"] == 2
+        assert response["drifted_ids"] == [3, 9]
\ No newline at end of file
@@ -334,4 +334,847 @@ class TestCarbonForecastingMockServices:
         assert result["message"] == "Forecast accuracy updated successfully"
         assert result["forecast_id"] == forecast_id
         assert result["accuracy"] == 92.0  # 100 - (2/25 * 100)
-        assert result["feedback"] == "close"
\ No newline at end of file
+        assert result["feedback"] == "close"
+
+
+class TestOrderSustainabilitySummaryReads:
+    """Unit tests for carbon features reading from the per-order rollup"""
+
+    def test_gather_user_data_reads_order_summaries(self):
+        """Test forecasting takes its order history from the rollup table"""
+        import asyncio
+        from app.services.carbon_forecasting import SimpleCarbonForecastingEngine
+
+        summaries = [{
+            "id": 1,
+            "created_at": datetime(2026, 3, 5),
+            "order_value": 85.0,
+            "avg_sustainability_rating": 60.0,
+            "item_count": 3
+        }]
+        mock_db = Mock()
+        mock_db.execute.return_value.fetchall.return_value = []
+
+        with patch('app.services.carbon_forecasting.get_user_order_summaries', return_value=summaries) as mock_summaries:
+            user_data = asyncio.run(SimpleCarbonForecastingEngine(mock_db)._gather_user_data("user-1"))
+
+        mock_summaries.assert_called_once_with(mock_db, "user-1", limit=50)
+        assert user_data["orders"] == summaries
+        # Only the goals query hits the database directly
+        assert mock_db.execute.call_count == 1
+
+    def test_unrated_orders_default_sustainability(self):
+        """Test orders without ratings report the forecasting default"""
+        from app.services.order_summary_service import get_user_order_summaries, UNRATED_ORDER_SUSTAINABILITY
+
+        row = Mock(order_id=2, order_created_at=datetime(2026, 3, 9), order_value=5.0,
+                   avg_sustainability=None, item_count=1)
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.order_by.return_value.limit.return_value.all.return_value = [row]
+
+        orders = get_user_order_summaries(mock_db, "user-1")
+
+        assert orders[0]["id"] == 2
+        assert orders[0]["avg_sustainability_rating"] == UNRATED_ORDER_SUSTAINABILITY
+
+    def test_monthly_footprint_averages_order_summaries(self):
+        """Test the monthly footprint averages per-order rollup scores"""
+        from app.services.carbon_goals_service import get_monthly_carbon_footprint
+
+        with patch('app.services.carbon_goals_service.get_monthly_order_sustainability', return_value=[60.0, 75.0]):
+            assert get_monthly_carbon_footprint("user-1", 3, 2026, Mock()) == 67.5
+
+        with patch('app.services.carbon_goals_service.get_monthly_order_sustainability', return_value=[]):
+            assert get_monthly_carbon_footprint("user-1", 3, 2026, Mock()) is None
+
+class TestStoredForecastReuse:
+    """Unit tests for persisting and reusing forecasts"""
+
+    def _forecast(self, trend="stable"):
+        from app.services.carbon_forecasting import ForecastResult
+        import numpy as np
+        return ForecastResult(
+            predicted_emissions=40.0,
+            predicted_reduction=10.0,
+            confidence_score=0.7,
+            trend_direction=trend,
+            seasonal_factor=1.0,
+            behavioral_score=0.8,
+            prediction_factors={"goal_achievements": {"2026-03": {"achieved": np.bool_(True), "actual": np.float64(61.5)}}},
+            algorithm_metadata={"algorithm": "simple_behavior_analysis"}
+        )
+
+    def _stored_row(self):
+        return Mock(
+            predicted_sustainability_score=40.0, improvement_potential=10.0, confidence_score=0.7,
+            trend_direction="declining", seasonal_factor=1.0, behavioral_score=0.8,
+            prediction_factors={}, algorithm_metadata={}, created_at=datetime(2026, 3, 10, 12, 0)
+        )
+
+    def test_insights_served_from_stored_forecast(self):
+        """Test a fresh stored forecast is served without re-running the engine"""
+        import asyncio
+        from app.services.carbon_forecasting import get_user_carbon_insights
+
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.return_value = Mock(
+            avg_orders_per_week=1.5, eco_consciousness_score=62.0, sustainability_trend_30d=0.0,
+            goals_achievement_rate=0.5, last_calculated=datetime(2026, 3, 10, 12, 0)
+        )
+
+        with patch('app.services.carbon_forecasting.load_stored_forecast', return_value=self._stored_row()), \
+             patch('app.services.carbon_forecasting.SimpleCarbonForecastingEngine') as mock_engine:
+            insights = asyncio.run(get_user_carbon_insights("user-1", mock_db))
+
+        mock_engine.assert_not_called()
+        assert insights["latest_forecast"]["predicted_sustainability_score"] == 100.0
+        assert insights["latest_forecast"]["created_at"] == "2026-03-10T12:00:00"
+        assert insights["shopping_patterns"]["avg_orders_per_week"] == 1.5
+        assert "Consider choosing more sustainable products to improve your sustainability trend" in insights["recommendations"]
+
+    def test_insights_recomputed_and_stored_when_stale(self):
+        """Test a missing or stale forecast is recomputed and stored with the shopping patterns"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.carbon_forecasting import get_user_carbon_insights
+
+        user_data = {"orders": [{"id": 1, "created_at": datetime(2026, 3, 5), "order_value": 85.0,
+                                 "avg_sustainability_rating": 60.0, "item_count": 3}], "goals": {}}
+        forecast = self._forecast()
+
+        with patch('app.services.carbon_forecasting.load_stored_forecast', return_value=None), \
+             patch('app.services.carbon_forecasting.SimpleCarbonForecastingEngine') as mock_engine, \
+             patch('app.services.carbon_forecasting.store_forecast') as mock_store:
+            mock_engine.return_value._gather_user_data = AsyncMock(return_value=user_data)
+            mock_engine.return_value.generate_forecast = AsyncMock(return_value=forecast)
+            insights = asyncio.run(get_user_carbon_insights("user-1", Mock()))
+
+        mock_store.assert_called_once()
+        args, kwargs = mock_store.call_args
+        assert args[1] is forecast
+        assert kwargs["shopping_patterns"]["avg_order_value"] == 85.0
+        assert insights["shopping_patterns"]["eco_consciousness_score"] == 60.0
+
+    def test_store_forecast_writes_json_safe_factors(self):
+        """Test stored prediction factors contain only plain JSON types"""
+        import json
+        from app.services.carbon_forecasting import store_forecast
+
+        mock_db = Mock()
+        with patch('app.services.carbon_forecasting.CarbonForecast', side_effect=lambda **kwargs: Mock(**kwargs)):
+            row = store_forecast("user-1", self._forecast(), 30, mock_db)
+
+        mock_db.commit.assert_called_once()
+        assert row.forecast_type == "monthly"
+        assert json.dumps(row.prediction_factors)
+        assert row.prediction_factors["goal_achievements"]["2026-03"]["achieved"] is True
+
+    def test_store_forecast_skips_no_order_forecasts(self):
+        """Test forecasts without an order-based trend are not stored"""
+        from app.services.carbon_forecasting import store_forecast
+
+        mock_db = Mock()
+        assert store_forecast("user-1", self._forecast(trend="unknown"), 30, mock_db) is None
+        mock_db.add.assert_not_called()
+
+    def test_quick_forecast_reuses_stored_row(self):
+        """Test generate_carbon_forecast serves a fresh stored forecast when reuse is requested"""
+        import asyncio
+        from app.services.carbon_forecasting import generate_carbon_forecast
+
+        with patch('app.services.carbon_forecasting.load_stored_forecast', return_value=self._stored_row()), \
+             patch('app.services.carbon_forecasting.SimpleCarbonForecastingEngine') as mock_engine:
+            result = asyncio.run(generate_carbon_forecast("user-1", 30, Mock(), reuse_stored=True))
+
+        mock_engine.assert_not_called()
+        assert result["forecast"]["trend_direction"] == "declining"
+        assert result["forecast"]["predicted_sustainability_score"] == 40.0
+
+    def test_quick_forecast_matches_the_horizon_the_engine_runs(self):
+        """Test reuse and storage use the engine's 30-day horizon whatever horizon is requested"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.carbon_forecasting import generate_carbon_forecast
+
+        forecast = self._forecast()
+        with patch('app.services.carbon_forecasting.load_stored_forecast', return_value=None) as mock_load, \
+             patch('app.services.carbon_forecasting.SimpleCarbonForecastingEngine') as mock_engine, \
+             patch('app.services.carbon_forecasting.store_forecast') as mock_store:
+            mock_engine.return_value.generate_forecast = AsyncMock(return_value=forecast)
+            asyncio.run(generate_carbon_forecast("user-1", 7, Mock(), reuse_stored=True))
+
+        assert mock_load.call_args.args[2] == 30
+        assert mock_store.call_args.args[2] == 30
+
+    def test_load_stored_forecast_filters_on_horizon(self):
+        """Test a stored forecast is only reused for the horizon it was computed over"""
+        from sqlalchemy import true
+        from app.services.carbon_forecasting import load_stored_forecast
+
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.exists.return_value = true()
+        load_stored_forecast("user-1", mock_db, 30)
+
+        criteria = [str(c) for c in mock_db.query.return_value.filter.call_args.args]
+        assert "carbon_forecasts.forecast_horizon_days = :forecast_horizon_days_1" in criteria
+
+class TestBatchForecasting:
+    """Unit tests for the nightly vectorized batch forecasting job"""
+
+    def _user_orders(self):
+        from datetime import timedelta
+        import random
+        rng = random.Random(7)
+        users = {}
+        for index, order_count in enumerate([1, 2, 3, 5, 12, 60]):
+            dates = sorted((datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 500)) for _ in range(order_count)),
+                           reverse=True)
+            users[f"user-{index}"] = [
+                {"id": i, "created_at": d, "order_value": 10.0, "item_count": 1,
+                 "avg_sustainability_rating": rng.choice([2.5, 3.7, 8.0, 45.0, 72.5, 95.0])}
+                for i, d in enumerate(dates)
+            ]
+        users["user-unrated"] = [
+            {"id": i, "created_at": datetime(2025, 3, i + 1), "order_value": 10.0, "item_count": 1,
+             "avg_sustainability_rating": 0}
+            for i in range(4)
+        ]
+        return users
+
+    def test_batch_matches_request_time_engine(self):
+        """Test vectorized forecasts match the per-user engine for every history size"""
+        import asyncio
+        import numpy as np
+        from app.services.carbon_forecasting import SimpleCarbonForecastingEngine
+        from app.services.batch_forecasting import forecast_shard
+
+        users = self._user_orders()
+        user_ids, months, ratings = [], [], []
+        for user_id, orders in users.items():
+            for order in orders:
+                user_ids.append(user_id)
+                months.append(np.datetime64(order["created_at"], "M").astype(np.int64))
+                ratings.append(order["avg_sustainability_rating"])
+
+        rows = {row["user_id"]: row for row in forecast_shard(
+            np.array(user_ids, dtype=object), np.array(months), np.array(ratings, dtype=float)
+        )}
+
+        engine = SimpleCarbonForecastingEngine(Mock())
+        for user_id, orders in users.items():
+            window = orders[:50]
+            if len(window) < 3:
+                expected = asyncio.run(engine._simple_prediction_from_orders(window, len(window)))
+            else:
+                expected = asyncio.run(engine._calculate_forecast({"orders": window, "goals": {}}, 30))
+            row = rows[user_id]
+
+            assert row["predicted_sustainability_score"] == pytest.approx(expected.predicted_emissions)
+            assert row["improvement_potential"] == pytest.approx(expected.predicted_reduction)
+            assert row["confidence_score"] == pytest.approx(expected.confidence_score)
+            assert row["behavioral_score"] == pytest.approx(expected.behavioral_score)
+            assert row["trend_direction"] == expected.trend_direction
+            assert row["algorithm_metadata"]["algorithm"] == expected.algorithm_metadata["algorithm"]
+
+    def test_shards_never_split_a_user(self):
+        """Test streamed shards hold whole users even when a user spans fetch partitions"""
+        from app.services.batch_forecasting import stream_order_shards
+
+        rows = [(f"user-{u}", datetime(2025, 1 + k % 12, 1), 50.0) for u in range(5) for k in range(3)]
+        mock_db = Mock()
+        mock_db.execute.return_value.partitions.return_value = iter([rows[:4], rows[4:10], rows[10:]])
+
+        shards = list(stream_order_shards(mock_db, users_per_shard=2))
+        shard_users = [set(user_ids) for user_ids, _, _ in shards]
+
+        assert sum(len(user_ids) for user_ids, _, _ in shards) == len(rows)
+        assert all(len(users) <= 2 for users in shard_users)
+        assert len(set().union(*shard_users)) == 5
+        assert sum(len(users) for users in shard_users) == 5
+
+    def test_batch_streams_on_its_own_session(self):
+        """Test shard writes commit on the caller's session while summaries stream on a separate one"""
+        from app.services.batch_forecasting import run_batch_forecasting
+
+        rows = [(f"user-{u}", datetime(2025, 1 + k % 12, 1), 50.0) for u in range(4) for k in range(3)]
+        mock_db = Mock()
+        stream_db = Mock()
+        stream_db.execute.return_value.partitions.return_value = iter([rows])
+
+        with patch('app.services.batch_forecasting.Session') as mock_session:
+            mock_session.return_value.__enter__ = Mock(return_value=stream_db)
+            mock_session.return_value.__exit__ = Mock(return_value=False)
+            totals = run_batch_forecasting(mock_db, workers=1, users_per_shard=2)
+
+        mock_session.assert_called_once_with(bind=mock_db.get_bind.return_value)
+        mock_db.execute.assert_called()
+        assert mock_db.commit.call_count == 2
+        stream_db.commit.assert_not_called()
+        mock_session.return_value.__exit__.assert_called_once()
+        assert totals["users"] == 4 and totals["orders"] == 12
+
+    def test_batch_forecast_without_patterns_is_recomputed_for_insights(self):
+        """Test insights recompute when a stored forecast has no patterns saved with it"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.carbon_forecasting import get_user_carbon_insights
+
+        stored = Mock(created_at=datetime(2026, 3, 10, 2, 0))
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.return_value = None
+
+        with patch('app.services.carbon_forecasting.load_stored_forecast', return_value=stored), \
+             patch('app.services.carbon_forecasting.SimpleCarbonForecastingEngine') as mock_engine:
+            mock_engine.return_value._gather_user_data = AsyncMock(return_value={"orders": [], "goals": {}})
+            insights = asyncio.run(get_user_carbon_insights("user-1", mock_db))
+
+        mock_engine.return_value._gather_user_data.assert_awaited_once()
+        assert insights["recommendations"] == ["Start shopping to see personalized insights"]
+
+class TestOnlineForecastState:
+    """Unit tests for the O(1) per-user forecast state"""
+
+    def _state(self):
+        from types import SimpleNamespace
+        return SimpleNamespace(
+            user_id="user-1", order_count=None, rated_order_count=None, reference_at=None,
+            fast_weight=None, fast_score_sum=None, fast_score_sq_sum=None,
+            slow_weight=None, slow_score_sum=None, slow_score_sq_sum=None,
+            interval_weight=None, interval_sum=None, interval_sq_sum=None, last_order_at=None
+        )
+
+    def test_cancel_removes_order_contribution_exactly(self):
+        """Test cancelling an order leaves the same means as never placing it"""
+        from app.services.forecast_state_service import apply_order_event, state_statistics
+
+        orders = [(datetime(2026, 1, 5), 60.0), (datetime(2026, 1, 20), 3.0), (datetime(2026, 2, 10), 90.0)]
+        with_cancel, without = self._state(), self._state()
+        for created_at, rating in orders:
+            apply_order_event(with_cancel, created_at, rating)
+        apply_order_event(with_cancel, orders[1][0], orders[1][1], sign=-1)
+        for created_at, rating in (orders[0], orders[2]):
+            apply_order_event(without, created_at, rating)
+
+        cancelled_stats, expected_stats = state_statistics(with_cancel), state_statistics(without)
+        assert cancelled_stats["order_count"] == expected_stats["order_count"] == 2
+        assert cancelled_stats["fast_mean"] == pytest.approx(expected_stats["fast_mean"])
+        assert cancelled_stats["slow_mean"] == pytest.approx(expected_stats["slow_mean"])
+        assert cancelled_stats["slow_variance"] == pytest.approx(expected_stats["slow_variance"])
+
+    def test_interval_statistics(self):
+        """Test order gaps are tracked as decayed interval statistics"""
+        from app.services.forecast_state_service import apply_order_event, state_statistics
+
+        state = self._state()
+        for day in (1, 8, 15, 22):
+            apply_order_event(state, datetime(2026, 3, day), 70.0)
+
+        stats = state_statistics(state)
+        assert stats["interval_mean_days"] == pytest.approx(7.0)
+        assert stats["interval_variance_days"] == pytest.approx(0.0, abs=1e-9)
+        assert stats["last_order_at"] == datetime(2026, 3, 22)
+
+    def test_forecast_from_state_any_horizon(self):
+        """Test forecasts come from the state alone and extend the trend with the horizon"""
+        from app.services.forecast_state_service import apply_order_event
+        from app.services.carbon_forecasting import forecast_from_state
+
+        state = self._state()
+        for month, rating in ((1, 40.0), (2, 45.0), (3, 50.0), (4, 80.0), (5, 90.0), (6, 95.0)):
+            apply_order_event(state, datetime(2026, month, 1), rating)
+
+        short = forecast_from_state(state, horizon_days=30)
+        longer = forecast_from_state(state, horizon_days=90)
+
+        assert short.trend_direction == "improving"
+        assert longer.predicted_emissions > short.predicted_emissions
+        assert short.algorithm_metadata["algorithm"] == "online_decayed_state"
+        assert longer.prediction_factors["expected_orders_in_horizon"] == pytest.approx(90 / 30.2, rel=0.05)
+
+    def test_forecast_from_missing_state(self):
+        """Test users without a state get the no-orders forecast"""
+        from app.services.carbon_forecasting import forecast_from_state
+
+        forecast = forecast_from_state(None)
+        assert forecast.algorithm_metadata["algorithm"] == "no_orders"
+
+    def test_cancellation_updates_state_once(self):
+        """Test the state is only adjusted when the cancelled flag actually changes"""
+        from app.services.order_summary_service import set_order_summary_cancelled
+
+        summary = Mock(cancelled=False, user_id="user-1", order_created_at=datetime(2026, 3, 1), avg_sustainability=70.0)
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.with_for_update.return_value.first.return_value = summary
+
+        with patch('app.services.order_summary_service.record_order_event') as mock_event:
+            set_order_summary_cancelled(mock_db, 1, True)
+            set_order_summary_cancelled(mock_db, 1, True)
+
+        mock_event.assert_called_once_with(mock_db, "user-1", datetime(2026, 3, 1), 70.0, -1)
+        assert summary.cancelled is True
+
+    def test_order_listeners_fire_only_after_commit(self):
+        """Test queued listener calls wait for the commit and are dropped by a rollback, but not a savepoint's"""
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.orm import Session
+        from app.services.order_summary_service import _queue_order_listeners
+
+        listener = Mock(__name__="listener")
+        db = Session(create_engine("sqlite://"))
+        with patch('app.services.order_summary_service._order_listeners', [listener]):
+            db.execute(text("SELECT 1"))
+            _queue_order_listeners(db, "user-1")
+            _queue_order_listeners(db, "user-1")
+            db.begin_nested().rollback()
+            listener.assert_not_called()
+            db.commit()
+            listener.assert_called_once_with("user-1")
+
+            db.execute(text("SELECT 1"))
+            _queue_order_listeners(db, "user-2")
+            db.rollback()
+            db.commit()
+        db.close()
+
+        listener.assert_called_once_with("user-1")
+
+class TestForecastBacktesting:
+    """Unit tests for the forecast backtesting harness"""
+
+    def _history(self):
+        import numpy as np
+        # user-a: three months of history then a measured month; user-b: history only; user-c: measured only
+        rows = [
+            ("user-a", datetime(2026, 4, 3), 80.0),
+            ("user-a", datetime(2026, 3, 9), 60.0),
+            ("user-a", datetime(2026, 2, 9), 50.0),
+            ("user-a", datetime(2026, 1, 9), 40.0),
+            ("user-b", datetime(2026, 2, 1), 70.0),
+            ("user-c", datetime(2026, 4, 20), 90.0),
+        ]
+        user_ids = np.array([r[0] for r in rows], dtype=object)
+        months = np.array([np.datetime64(r[1], "M").astype(np.int64) for r in rows])
+        ratings = np.array([r[2] for r in rows])
+        return user_ids, months, ratings
+
+    def test_accuracy_fields(self):
+        """Test accuracy, error magnitude and direction of a forecast"""
+        from app.services.carbon_forecasting import forecast_accuracy_fields
+
+        over = forecast_accuracy_fields(70.0, 60.0)
+        assert over["accuracy_percentage"] == pytest.approx(90.0)
+        assert over["error_magnitude"] == pytest.approx(10.0)
+        assert over["error_direction"] == "over_predicted"
+        assert forecast_accuracy_fields(40.0, 60.0)["error_direction"] == "under_predicted"
+        assert forecast_accuracy_fields(60.0, 60.0)["error_direction"] == "exact"
+        assert forecast_accuracy_fields(0.0, 100.0)["accuracy_percentage"] == 0.0
+
+    def test_cutoff_uses_only_prior_orders(self):
+        """Test forecasts only see orders before the cutoff and are measured against the cutoff month"""
+        import asyncio
+        import numpy as np
+        from app.services.forecast_backtesting import backtest_cutoff
+        from app.services.carbon_forecasting import SimpleCarbonForecastingEngine
+
+        user_ids, months, ratings = self._history()
+        cutoff = np.datetime64("2026-04", "M").astype(np.int64)
+
+        rows, actual = backtest_cutoff(user_ids, months, ratings, cutoff)
+
+        # user-b has no April orders, user-c has no history before April
+        assert [row["user_id"] for row in rows] == ["user-a"]
+        assert actual.tolist() == [80.0]
+
+        prior_orders = [
+            {"id": i, "created_at": datetime(2026, month, 9), "order_value": 1.0, "item_count": 1,
+             "avg_sustainability_rating": rating}
+            for i, (month, rating) in enumerate([(3, 60.0), (2, 50.0), (1, 40.0)])
+        ]
+        expected = asyncio.run(SimpleCarbonForecastingEngine(Mock())._calculate_forecast({"orders": prior_orders, "goals": {}}, 30))
+        assert rows[0]["predicted_sustainability_score"] == pytest.approx(expected.predicted_emissions)
+
+    def test_dry_run_reports_metrics_without_writing(self):
+        """Test a dry run aggregates MAE/MSE and writes nothing"""
+        import numpy as np
+        from app.services.forecast_backtesting import run_backtest
+
+        mock_db = Mock()
+        with patch('app.services.forecast_backtesting.load_order_history', return_value=self._history()):
+            metrics = run_backtest(mock_db, months=2, end_month=np.datetime64("2026-04", "M").astype(np.int64), dry_run=True)
+
+        # March is measured from January-February, April from January-March
+        assert [month["month"] for month in metrics["per_month"]] == ["2026-03", "2026-04"]
+        assert metrics["forecasts"] == 2
+        errors = [month["mae"] for month in metrics["per_month"]]
+        assert metrics["mae"] == pytest.approx(sum(errors) / 2, abs=1e-3)
+        assert metrics["mse"] == pytest.approx(sum(e ** 2 for e in errors) / 2, abs=1e-2)
+        mock_db.execute.assert_not_called()
+        mock_db.commit.assert_not_called()
+
+    def test_update_forecast_accuracy_records_row(self):
+        """Test a single accuracy update is stored and its percentage returned"""
+        import asyncio
+        from app.services.carbon_forecasting import update_forecast_accuracy
+
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.return_value = Mock(predicted_sustainability_score=72.0)
+
+        with patch('app.services.carbon_forecasting.CarbonForecastAccuracy',
+                   side_effect=lambda **kwargs: Mock(**kwargs)) as mock_accuracy:
+            accuracy = asyncio.run(update_forecast_accuracy(5, 80.0, mock_db))
+
+        assert accuracy == pytest.approx(92.0)
+        assert mock_accuracy.call_args.kwargs["error_direction"] == "under_predicted"
+        mock_db.commit.assert_called_once()
+
+
+class TestYearlyCarbonData:
+    """Unit tests for the single-query yearly carbon dashboard"""
+
+    def setup_method(self):
+        from app.services import carbon_goals_service
+        carbon_goals_service._carbon_data_cache.clear()
+
+    def _patches(self, totals, goals):
+        return (
+            patch('app.services.carbon_goals_service.get_monthly_order_sustainability_totals', return_value=totals),
+            patch('app.services.carbon_goals_service.get_monthly_carbon_goals', return_value=goals)
+        )
+
+    def test_yearly_data_built_from_one_totals_and_one_goals_query(self):
+        """Test monthly footprints, goals and headline figures come from one grouped read each"""
+        from app.services.carbon_goals_service import get_user_carbon_data
+        year = datetime.now().year
+        goals = {month: 60.0 for month in range(1, 13)}
+        totals_patch, goals_patch = self._patches({(year, 1): (130.0, 2), (year, 2): (0.0, 1)}, goals)
+
+        with totals_patch as totals, goals_patch as get_goals, \
+                patch('app.services.carbon_goals_service.CARBON_DATA_CACHE_SECONDS', 0):
+            data = get_user_carbon_data("user-1", Mock())["data"]
+
+        assert totals.call_count == 1
+        assert get_goals.call_count == 1
+        assert data["monthlyData"][0] == {"month": "Jan", "footprint": 65.0, "goal": 60.0}
+        assert data["monthlyData"][1]["footprint"] == 0.0
+        assert data["monthlyData"][2]["footprint"] == 0
+        assert data["totalFootprint"] == 65.0  # Zero-score months stay out of the yearly average
+        assert data["yearlyGoal"] == 90.0
+
+    def test_cached_data_dropped_when_orders_change(self):
+        """Test the per-user cache serves repeat reads until an order event invalidates it"""
+        from app.services.carbon_goals_service import get_user_carbon_data
+        from app.services.order_summary_service import _notify_order_listeners
+        totals_patch, goals_patch = self._patches({}, {month: 50.0 for month in range(1, 13)})
+
+        with totals_patch as totals, goals_patch, \
+                patch('app.services.carbon_goals_service.CARBON_DATA_CACHE_SECONDS', 300):
+            first = get_user_carbon_data("user-1", Mock())
+            first["data"]["monthlyData"].clear()  # Callers cannot corrupt the cached copy
+            second = get_user_carbon_data("user-1", Mock())
+            assert totals.call_count == 1
+            assert len(second["data"]["monthlyData"]) == 12
+
+            _notify_order_listeners("user-1")
+            get_user_carbon_data("user-1", Mock())
+            assert totals.call_count == 2
+
+    def test_set_carbon_goal_invalidates_cache(self):
+        """Test setting a goal drops the user's cached yearly data"""
+        from app.services import carbon_goals_service
+        carbon_goals_service._carbon_data_cache[("user-1", 2026, 3)] = (0.0, {})
+        carbon_goals_service._carbon_data_cache[("user-2", 2026, 3)] = (0.0, {})
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.return_value = True
+
+        carbon_goals_service.set_carbon_goal("user-1", 3, 70.0, mock_db)
+
+        assert list(carbon_goals_service._carbon_data_cache) == [("user-2", 2026, 3)]
+
+
+class TestBulkCarbonGoals:
+    """Unit tests for setting and reading several months of goals at once"""
+
+    def test_bulk_set_writes_all_months_in_one_statement(self):
+        """Test a yearly plan is one upsert statement, one commit, and returns the full goal map"""
+        from app.services.carbon_goals_service import set_carbon_goals
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.return_value = True
+        full_map = {month: 70.0 for month in range(1, 13)}
+
+        with patch('app.services.carbon_goals_service.get_monthly_carbon_goals', return_value=full_map):
+            result = set_carbon_goals("user-1", {3: 70.0, 1: 65.5}, mock_db)
+
+        assert mock_db.execute.call_count == 1
+        params = mock_db.execute.call_args[0][1]
+        assert params["months"] == [1, 3]
+        assert params["goal_values"] == [65.5, 70.0]
+        mock_db.commit.assert_called_once()
+        assert result["goals"] == full_map
+        assert result["updated_months"] == [1, 3]
+
+    def test_bulk_set_rejects_whole_request_before_writing(self):
+        """Test every invalid entry is reported and nothing is written"""
+        from app.services.carbon_goals_service import set_carbon_goals
+        mock_db = Mock()
+
+        with pytest.raises(HTTPException) as exc_info:
+            set_carbon_goals("user-1", {0: 50.0, 4: 120.0, 5: 60.0}, mock_db)
+
+        assert exc_info.value.status_code == 400
+        assert "month 0" in exc_info.value.detail
+        assert "month 4" in exc_info.value.detail
+        mock_db.execute.assert_not_called()
+
+    def test_bulk_set_rolls_back_when_procedure_fails(self):
+        """Test a failed upsert rolls back the whole batch"""
+        from app.services.carbon_goals_service import set_carbon_goals
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.return_value = False
+
+        with pytest.raises(HTTPException) as exc_info:
+            set_carbon_goals("user-1", {1: 50.0, 2: 55.0}, mock_db)
+
+        assert exc_info.value.status_code == 400
+        mock_db.rollback.assert_called_once()
+        mock_db.commit.assert_not_called()
+
+    def test_bulk_get_reads_requested_months(self):
+        """Test reading a subset of months is one statement over those months"""
+        from app.services.carbon_goals_service import get_carbon_goals
+        mock_db = Mock()
+        mock_db.execute.return_value.fetchall.return_value = [
+            Mock(month=2, goal_value=60), Mock(month=6, goal_value=75.5)
+        ]
+
+        result = get_carbon_goals("user-1", mock_db, [6, 2, 6])
+
+        assert mock_db.execute.call_args[0][1]["months"] == [2, 6]
+        assert result["goals"] == {2: 60.0, 6: 75.5}
+
+
+class TestForecastCache:
+    """Unit tests for the in-process cache behind the polled forecast routes"""
+
+    def setup_method(self):
+        from app.services import forecast_cache
+        forecast_cache.clear()
+
+    def _counting_compute(self, calls):
+        async def compute(session):
+            calls.append(session)
+            return {"score": len(calls)}
+        return compute
+
+    def test_fresh_entry_served_without_recomputing(self):
+        """Test repeat polls within the fresh window reuse the first result"""
+        import asyncio
+        from app.services.forecast_cache import get_cached
+        calls = []
+        compute = self._counting_compute(calls)
+
+        async def poll_twice():
+            first = await get_cached("user_score", "user-1", 30, compute, Mock())
+            second = await get_cached("user_score", "user-1", 30, compute, Mock())
+            other_horizon = await get_cached("user_score", "user-1", 60, compute, Mock())
+            return first, second, other_horizon
+
+        first, second, other_horizon = asyncio.run(poll_twice())
+
+        assert first == second == {"score": 1}
+        assert other_horizon == {"score": 2}
+        assert len(calls) == 2
+
+    def test_stale_entry_served_while_refreshing_in_background(self):
+        """Test an expired entry is returned immediately and replaced by a background refresh"""
+        import asyncio
+        from app.services import forecast_cache
+        calls = []
+        compute = self._counting_compute(calls)
+        background_session = Mock()
+
+        async def poll():
+            await forecast_cache.get_cached("quick_forecast", "user-1", 30, compute, Mock())
+            forecast_cache._entries[("quick_forecast", "user-1", 30)].computed_at -= (
+                forecast_cache.FORECAST_CACHE_FRESH_SECONDS + 1
+            )
+            stale = await forecast_cache.get_cached("quick_forecast", "user-1", 30, compute, Mock())
+            await asyncio.gather(*forecast_cache._refresh_tasks)
+            refreshed = await forecast_cache.get_cached("quick_forecast", "user-1", 30, compute, Mock())
+            return stale, refreshed
+
+        with patch('app.db.database.SessionLocal', return_value=background_session):
+            stale, refreshed = asyncio.run(poll())
+
+        assert stale == {"score": 1}
+        assert refreshed == {"score": 2}
+        assert calls[-1] is background_session
+        background_session.close.assert_called_once()
+
+    def test_order_event_invalidates_user_entries(self):
+        """Test an order event drops the user's entries and discards refreshes started before it"""
+        import asyncio
+        from app.services import forecast_cache
+        from app.services.order_summary_service import _notify_order_listeners
+        calls = []
+        compute = self._counting_compute(calls)
+
+        async def poll():
+            await forecast_cache.get_cached("user_score", "user-1", 30, compute, Mock())
+            await forecast_cache.get_cached("user_score", "user-2", 30, compute, Mock())
+            generation = forecast_cache._generations.get("user-1", 0)
+            _notify_order_listeners("user-1")
+            forecast_cache._store(("user_score", "user-1", 30), {"score": "outdated"}, generation)
+            return await forecast_cache.get_cached("user_score", "user-1", 30, compute, Mock())
+
+        assert asyncio.run(poll()) == {"score": 3}
+        assert ("user_score", "user-2", 30) in forecast_cache._entries
+
+    def test_user_score_route_uses_cache(self):
+        """Test the user-score route computes insights once across polls"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.routes.carbon_forecasting import get_user_carbon_score
+        insights = {
+            "latest_forecast": {"confidence": 0.8},
+            "shopping_patterns": {"eco_consciousness_score": 80.0, "sustainability_trend_30d": 6.0,
+                                  "avg_orders_per_week": 2.0, "goals_achievement_rate": 0.5}
+        }
+
+        async def poll_twice():
+            first = await get_user_carbon_score("user-1", Mock())
+            second = await get_user_carbon_score("user-1", Mock())
+            return first, second
+
+        with patch('app.routes.carbon_forecasting.get_user_carbon_insights',
+                   new_callable=AsyncMock, return_value=insights) as mock_insights:
+            first, second = asyncio.run(poll_twice())
+
+        assert mock_insights.await_count == 1
+        assert first == second
+        assert first["score"] == 82.0
+        assert first["level"] == "Eco Warrior"
+
+
+class TestEventLoopOffload:
+    """Blocking database work in forecasting must not stall the event loop"""
+
+    @staticmethod
+    def _slow(result=None, seconds=0.2):
+        import time
+
+        def call(*args, **kwargs):
+            time.sleep(seconds)
+            return result
+        return call
+
+    def test_detector_flags_blocking_call(self, loop_stall):
+        """Test the heartbeat detects a synchronous call made on the loop"""
+        slow = self._slow()
+
+        async def blocking():
+            slow()
+
+        _, stall = loop_stall(blocking)
+        assert stall >= 0.15
+
+    def test_generate_forecast_keeps_loop_responsive(self, loop_stall):
+        """Test stored-forecast lookup, order history reads and storing run off the loop"""
+        from conftest import LOOP_STALL_THRESHOLD
+        from app.services.carbon_forecasting import generate_carbon_forecast
+        mock_db = Mock()
+        mock_db.execute.side_effect = self._slow(Mock(fetchall=Mock(return_value=[])))
+
+        with patch('app.services.carbon_forecasting.load_stored_forecast', side_effect=self._slow()), \
+             patch('app.services.carbon_forecasting.get_user_order_summaries', side_effect=self._slow([])), \
+             patch('app.services.carbon_forecasting.store_forecast', side_effect=self._slow()) as mock_store:
+            result, stall = loop_stall(lambda: generate_carbon_forecast("user-1", 30, mock_db, reuse_stored=True))
+
+        assert result["status"] == "success"
+        mock_store.assert_called_once()
+        assert stall < LOOP_STALL_THRESHOLD
+
+    def test_insights_keep_loop_responsive(self, loop_stall):
+        """Test the insights path reads and writes off the loop"""
+        from conftest import LOOP_STALL_THRESHOLD
+        from app.services.carbon_forecasting import get_user_carbon_insights
+        mock_db = Mock()
+        mock_db.execute.side_effect = self._slow(Mock(fetchall=Mock(return_value=[])))
+
+        with patch('app.services.carbon_forecasting.load_stored_forecast', side_effect=self._slow()), \
+             patch('app.services.carbon_forecasting.get_user_order_summaries', side_effect=self._slow([])):
+            insights, stall = loop_stall(lambda: get_user_carbon_insights("user-1", mock_db))
+
+        assert insights["recommendations"] == ["Start shopping to see personalized insights"]
+        assert stall < LOOP_STALL_THRESHOLD
+
+
+class TestCohortDistribution:
+    """Unit tests for cohort percentile and vs-average metrics"""
+
+    def setup_method(self):
+        from app.services import carbon_cohort_service
+        carbon_cohort_service._loaded.update(distribution=None, loaded_at=0.0)
+
+    def test_position_uses_mid_rank_percentile(self):
+        """Test percentile counts half the ties and deviation is measured from the mean"""
+        import numpy as np
+        from app.services.carbon_cohort_service import ScoreDistribution
+
+        distribution = ScoreDistribution(np.array([20, 40, 60, 60, 80], dtype="<f4"), 52.0)
+
+        assert distribution.position(60.0) == {"percentile_rank": 60.0, "sustainability_score_vs_average": 8.0}
+        assert distribution.position(10.0)["percentile_rank"] == 0.0
+        assert distribution.position(90.0)["percentile_rank"] == 100.0
+
+    def test_stored_distribution_decoded_once(self):
+        """Test the compact stored array is decoded and reused across lookups"""
+        import numpy as np
+        from app.services.carbon_cohort_service import load_score_distribution
+        scores = np.array([30, 50, 70], dtype="<f4")
+        row = Mock(user_count=3, mean_score=50.0, sorted_scores=scores.tobytes(), built_at=datetime(2026, 3, 1))
+        mock_db = Mock()
+        mock_db.query.return_value.order_by.return_value.first.return_value = row
+
+        first = load_score_distribution(mock_db)
+        second = load_score_distribution(mock_db)
+
+        assert first is second
+        assert mock_db.query.call_count == 1
+        assert list(first.sorted_scores) == [30.0, 50.0, 70.0]
+
+    def test_user_metrics_need_score_and_distribution(self):
+        """Test users without rated orders get no cohort metrics"""
+        import numpy as np
+        from app.services.carbon_cohort_service import get_user_cohort_metrics, ScoreDistribution
+        distribution = ScoreDistribution(np.array([30, 50, 70], dtype="<f4"), 50.0)
+
+        with patch('app.services.carbon_cohort_service.get_user_sustainability_score', return_value=None):
+            assert get_user_cohort_metrics("user-1", Mock()) is None
+
+        with patch('app.services.carbon_cohort_service.get_user_sustainability_score', return_value=70.0), \
+             patch('app.services.carbon_cohort_service.load_score_distribution', return_value=distribution):
+            metrics = get_user_cohort_metrics("user-1", Mock())
+
+        assert metrics == {
+            "total_lifetime_sustainability_score": 70.0,
+            "percentile_rank": 83.3,
+            "sustainability_score_vs_average": 20.0
+        }
+
+    def test_insights_expose_cohort_metrics(self):
+        """Test get_user_carbon_insights returns the cohort metrics as impact_metrics"""
+        import asyncio
+        from app.services.carbon_forecasting import get_user_carbon_insights
+        from app.schemas.carbon_forecasting import GetUserInsightsResponse
+        metrics = {"total_lifetime_sustainability_score": 70.0, "percentile_rank": 83.3,
+                   "sustainability_score_vs_average": 20.0}
+        mock_db = Mock()
+        mock_db.execute.return_value.fetchall.return_value = []
+
+        with patch('app.services.carbon_forecasting.get_user_cohort_metrics', return_value=metrics), \
+             patch('app.services.carbon_forecasting.load_stored_forecast', return_value=None), \
+             patch('app.services.carbon_forecasting.get_user_order_summaries', return_value=[]):
+            insights = asyncio.run(get_user_carbon_insights("user-1", mock_db))
+
+        assert insights["impact_metrics"] == metrics
+        assert GetUserInsightsResponse(**insights).impact_metrics.percentile_rank == 83.3
\ No newline at end of file
@@ -73,155 +73,203 @@ class TestCartServices:
         mock_db.commit.assert_called_once()
         mock_db.refresh.assert_called_once()
     
-    @patch('app.services.cart.CartItem')
-    @patch('app.utilities.stock_utils.is_product_available')
-    @patch('app.utilities.stock_utils.sync_stock_status')
-    @patch('app.services.cart.get_cart')
-    def test_add_item_success(self, mock_get_cart, mock_sync_stock, mock_is_available, mock_cart_item_model):
-        """Test successfully adding an item to cart"""
-        # Setup mocks
+    def _cart_db(self, cart_id=1, existing=None, upserted=None):
+        """Mock session whose active-cart lookup finds cart_id, with `existing` units of the product in it"""
         mock_db = Mock()
-        mock_product = Mock()
-        mock_product.id = 1
-        mock_product.name = "Test Product"
-        mock_db.query.return_value.filter.return_value.first.return_value = mock_product
-        
-        mock_cart = Mock()
-        mock_cart.id = 1
-        mock_get_cart.return_value = mock_cart
-        
-        mock_is_available.return_value = (True, "")
-        
-        # No existing cart item
-        mock_db.query.return_value.filter_by.return_value.first.return_value = None
-        
-        # Mock cart item creation
-        mock_new_item = Mock()
-        mock_cart_item_model.return_value = mock_new_item
-        
-        item_create = CartItemCreate(product_id=1, quantity=2)
-        
-        add_item(mock_db, "test-user-123", item_create)
-        
-        mock_sync_stock.assert_called_once_with(mock_db, 1)
-        mock_is_available.assert_called()
-        mock_db.add.assert_called()
-        mock_db.commit.assert_called()
-    
-    @patch('app.utilities.stock_utils.is_product_available')
-    @patch('app.utilities.stock_utils.sync_stock_status')
-    def test_add_item_product_not_found(self, mock_sync_stock, mock_is_available):
+        mock_db.execute.return_value.scalar.side_effect = [cart_id, existing]
+        mock_db.execute.return_value.first.return_value = upserted
+        return mock_db
+
+    def _availability(self, available, name="Test Product"):
+        product = Mock(available=available)
+        product.name = name
+        return {1: product}
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    def test_add_item_success(self, mock_hold):
+        """Test adding an item holds the cart's new quantity, upserts the line and commits once"""
+        row = Mock()
+        row._mapping = {"id": 7, "cart_id": 1, "product_id": 1, "quantity": 5}
+        mock_db = self._cart_db(existing=3, upserted=row)
+
+        result = add_item(mock_db, "test-user-123", CartItemCreate(product_id=1, quantity=2))
+
+        assert result == {"id": 7, "cart_id": 1, "product_id": 1, "quantity": 5}
+        mock_hold.assert_called_once_with(mock_db, 1, {1: 5})
+        assert mock_db.execute.call_count == 3  # Active cart, locked line, line upsert
+        mock_db.commit.assert_called_once()
+        mock_db.rollback.assert_not_called()
+        mock_db.query.assert_not_called()  # No product, order or existing-line queries
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    def test_add_item_upserts_on_cart_and_product(self, mock_hold):
+        """Test the line is upserted to its new quantity on the (cart_id, product_id) index"""
+        row = Mock()
+        row._mapping = {}
+        mock_db = self._cart_db(upserted=row)
+
+        add_item(mock_db, "test-user-123", CartItemCreate(product_id=1, quantity=2))
+
+        lookup, line, upsert = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert line._for_update_arg is not None
+        on_conflict = upsert._post_values_clause
+        assert [column.name for column in on_conflict.inferred_target_elements] == ["cart_id", "product_id"]
+        assert [column for column, _ in on_conflict.update_values_to_set] == ["quantity"]
+
+    @patch('app.services.cart.cart_availability', return_value={})
+    @patch('app.services.cart.hold_stock', return_value=[999])
+    def test_add_item_product_not_found(self, mock_hold, mock_availability):
         """Test adding item when product doesn't exist"""
         from fastapi import HTTPException
-        
-        mock_db = Mock()
-        mock_db.query.return_value.filter.return_value.first.return_value = None
-        
+
+        mock_db = self._cart_db()
+
         item_create = CartItemCreate(product_id=999, quantity=2)
-        
+
         with pytest.raises(HTTPException) as exc_info:
             add_item(mock_db, "test-user-123", item_create)
-        
+
         assert exc_info.value.status_code == 404
         assert "Product not found" in str(exc_info.value.detail)
-    
-    @patch('app.utilities.stock_utils.is_product_available')
-    @patch('app.utilities.stock_utils.sync_stock_status')
-    @patch('app.services.cart.get_cart')
-    def test_add_item_insufficient_stock(self, mock_get_cart, mock_sync_stock, mock_is_available):
+        mock_db.rollback.assert_called_once()
+        mock_db.commit.assert_not_called()
+
+    @patch('app.services.cart.cart_availability')
+    @patch('app.services.cart.hold_stock', return_value=[1])
+    def test_add_item_insufficient_stock(self, mock_hold, mock_availability):
         """Test adding item when there's insufficient stock"""
         from fastapi import HTTPException
-        
-        mock_db = Mock()
-        mock_product = Mock()
-        mock_product.id = 1
-        mock_product.name = "Test Product"
-        mock_db.query.return_value.filter.return_value.first.return_value = mock_product
-        
-        mock_cart = Mock()
-        mock_cart.id = 1
-        mock_get_cart.return_value = mock_cart
-        
-        mock_is_available.return_value = (False, "Insufficient stock")
-        
+
+        mock_db = self._cart_db()
+        mock_availability.return_value = self._availability(5)
+
         item_create = CartItemCreate(product_id=1, quantity=10)
-        
+
         with pytest.raises(HTTPException) as exc_info:
             add_item(mock_db, "test-user-123", item_create)
-        
+
         assert exc_info.value.status_code == 400
-        assert "Insufficient stock" in str(exc_info.value.detail)
-    
-    def test_get_cart_existing(self):
+        assert exc_info.value.detail == "Not enough stock for 'Test Product'. Available: 5, Requested: 10"
+        mock_db.commit.assert_not_called()
+
+    @patch('app.services.cart.cart_availability')
+    @patch('app.services.cart.hold_stock', return_value=[1])
+    def test_add_item_exceeds_stock_with_existing_line(self, mock_hold, mock_availability):
+        """Test the error names the quantity already in the cart"""
+        from fastapi import HTTPException
+
+        mock_db = self._cart_db(existing=4)
+        mock_availability.return_value = self._availability(5)
+
+        with pytest.raises(HTTPException) as exc_info:
+            add_item(mock_db, "test-user-123", CartItemCreate(product_id=1, quantity=2))
+
+        assert exc_info.value.status_code == 400
+        assert exc_info.value.detail.startswith("Cannot add 2 more of 'Test Product'. You already have 4 in cart.")
+
+    @patch('app.services.cart.cart_availability')
+    @patch('app.services.cart.hold_stock', return_value=[1])
+    def test_add_item_held_by_other_carts(self, mock_hold, mock_availability):
+        """Test a product whose stock is all held by other carts reads as out of stock"""
+        from fastapi import HTTPException
+
+        mock_db = self._cart_db()
+        mock_availability.return_value = self._availability(0)
+
+        with pytest.raises(HTTPException) as exc_info:
+            add_item(mock_db, "test-user-123", CartItemCreate(product_id=1, quantity=1))
+
+        assert exc_info.value.detail == "Product 'Test Product' is out of stock"
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    @patch('app.services.cart.pg_insert')
+    def test_add_item_creates_active_cart_in_same_transaction(self, mock_insert, mock_hold):
+        """Test a user without an active cart gets one inserted before the upsert, with a single commit"""
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.side_effect = [None, 3, None]  # No active cart, inserted id, no line
+        mock_db.execute.return_value.first.return_value._mapping = {}
+
+        add_item(mock_db, "test-user-123", CartItemCreate(product_id=1, quantity=1))
+
+        assert mock_insert.call_count == 2  # The cart, then the cart line
+        mock_hold.assert_called_once_with(mock_db, 3, {1: 1})
+        mock_db.commit.assert_called_once()
+
+    @patch('app.services.cart.selectinload')
+    def test_get_cart_existing(self, mock_selectinload):
         """Test getting an existing cart"""
         mock_db = Mock()
         mock_cart = Mock()
         mock_cart.user_id = "test-user-123"
-        mock_db.query.return_value.filter.return_value.order_by.return_value.first.return_value = mock_cart
-        
-        # No existing order for this cart
-        mock_db.query.return_value.filter.return_value.first.return_value = None
-        
+        mock_db.query.return_value.options.return_value.filter.return_value.first.return_value = mock_cart
+
         result = get_cart(mock_db, "test-user-123")
-        
+
         assert result == mock_cart
-    
-    @patch('app.services.cart.Cart')
-    def test_get_cart_create_new_when_none_exists(self, mock_cart_model):
+        mock_db.execute.assert_not_called()
+        mock_db.commit.assert_not_called()
+
+    @patch('app.services.cart.selectinload')
+    def test_get_cart_create_new_when_none_exists(self, mock_selectinload):
         """Test creating new cart when none exists"""
         mock_db = Mock()
-        mock_db.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
-        
-        # Mock cart creation
         mock_new_cart = Mock()
-        mock_new_cart.user_id = "test-user-123"
-        mock_cart_model.return_value = mock_new_cart
-        
+        mock_db.query.return_value.options.return_value.filter.return_value.first.side_effect = [None, mock_new_cart]
+        mock_db.execute.return_value.scalar.side_effect = [None, 3]
+
         result = get_cart(mock_db, "test-user-123")
-        
-        mock_db.add.assert_called()
-        mock_db.commit.assert_called()
-    
-    def test_remove_item_success(self):
-        """Test successfully removing an item from cart"""
+
+        assert result == mock_new_cart
+        mock_db.commit.assert_called_once()
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    def test_remove_item_success(self, mock_hold):
+        """Test removing a line deletes it and releases its hold in one transaction"""
         mock_db = Mock()
-        mock_cart = Mock()
-        mock_cart.id = 1
-        mock_db.query.return_value.filter.return_value.order_by.return_value.first.return_value = mock_cart
-        
-        mock_item = Mock()
-        mock_db.query.return_value.filter_by.return_value.first.return_value = mock_item
-        
+        mock_db.execute.return_value.scalar.return_value = 1
+        mock_db.execute.return_value.rowcount = 1
+
         result = remove_item(mock_db, "test-user-123", 1)
-        
+
         assert result is True
-        mock_db.delete.assert_called_once_with(mock_item)
+        assert mock_db.execute.call_count == 2  # Active cart, then one DELETE
+        mock_hold.assert_called_once_with(mock_db, 1, {1: 0})
         mock_db.commit.assert_called_once()
-    
-    def test_remove_item_cart_not_found(self):
-        """Test removing item when cart doesn't exist"""
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    def test_remove_item_cart_not_found(self, mock_hold):
+        """Test removing item when the user has no active cart"""
         mock_db = Mock()
-        mock_db.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
-        
+        mock_db.execute.return_value.scalar.return_value = None
+
         result = remove_item(mock_db, "test-user-123", 1)
-        
+
         assert result is False
-    
-    def test_remove_item_item_not_found(self):
-        """Test removing item when item doesn't exist in cart"""
+        mock_hold.assert_not_called()
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    def test_remove_item_item_not_found(self, mock_hold):
+        """Test removing item when the active cart has no such item"""
         mock_db = Mock()
-        mock_cart = Mock()
-        mock_cart.id = 1
-        mock_db.query.return_value.filter.return_value.order_by.return_value.first.return_value = mock_cart
-        
-        # Item not found in cart
-        mock_db.query.return_value.filter_by.return_value.first.return_value = None
-        
+        mock_db.execute.return_value.scalar.return_value = 1
+        mock_db.execute.return_value.rowcount = 0
+
         result = remove_item(mock_db, "test-user-123", 999)
-        
+
         assert result is False
         mock_db.delete.assert_not_called()
 
+    def test_mark_cart_ordered(self):
+        """Test checkout retires the cart without committing"""
+        from app.services.cart import mark_cart_ordered
+        mock_db = Mock()
+
+        mark_cart_ordered(mock_db, 5)
+
+        stmt = mock_db.execute.call_args[0][0]
+        assert [column.key for column in stmt._values] == ["status"]
+        mock_db.commit.assert_not_called()
+
 
 class TestCartBusinessLogic:
     """Test cart business logic"""
@@ -263,3 +311,148 @@ class TestCartBusinessLogic:
         # Empty cart should have zero total
         total = sum(item.quantity for item in cart_items)
         assert total == 0
+
+
+class TestCartBatchUpdate:
+    """Test the batch cart update and its summary"""
+
+    def _operations(self, *specs):
+        from app.schemas.cart import CartOperation
+        return [CartOperation(op=op, product_id=product_id, quantity=quantity) for op, product_id, quantity in specs]
+
+    def test_operations_fold_in_order(self):
+        """Test adds accumulate, set overrides and remove zeroes a line, applied in request order"""
+        from app.services.cart import _cart_targets
+        operations = self._operations(("add", 1, 2), ("add", 1, 1), ("set", 2, 5), ("remove", 3, 0),
+                                      ("remove", 4, 0), ("add", 4, 2))
+
+        targets = _cart_targets({1: 1, 3: 2, 4: 7}, operations)
+
+        assert targets == {1: 4, 2: 5, 3: 0, 4: 2}
+
+    def test_quantity_cannot_be_negative(self):
+        """Test operations reject negative quantities"""
+        from pydantic import ValidationError
+        from app.schemas.cart import CartOperation
+
+        with pytest.raises(ValidationError):
+            CartOperation(op="set", product_id=1, quantity=-1)
+
+    def test_added_quantity_must_be_positive(self):
+        """Test adding a zero or negative quantity is rejected before it reaches the stock holds"""
+        from pydantic import ValidationError
+
+        for quantity in (0, -3):
+            with pytest.raises(ValidationError):
+                CartItemCreate(product_id=1, quantity=quantity)
+
+    @patch('app.services.cart.hold_stock', return_value=[])
+    @patch('app.services.cart.get_cart_summary')
+    def test_batch_is_one_delete_and_one_upsert(self, mock_summary, mock_hold):
+        """Test a batch reads the touched lines once, holds the targets, writes with one DELETE and one upsert"""
+        from app.services.cart import update_cart
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.return_value = 1
+        mock_db.execute.return_value.all.return_value = [(1, 2), (2, 1)]
+        mock_summary.return_value = {"id": 1}
+
+        result = update_cart(mock_db, "test-user-123", self._operations(("add", 1, 2), ("remove", 2, 0),
+                                                                         ("set", 3, 4), ("set", 4, 0)))
+
+        assert result == {"id": 1}
+        mock_hold.assert_called_once_with(mock_db, 1, {1: 4, 2: 0, 3: 4, 4: 0})
+        lookup, lines, removal, upsert = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert lines._for_update_arg is not None
+        assert removal.is_delete
+        rows = [tuple(value for column, value in row.items() if column.key != "cart_id") for row in upsert._multi_values[0]]
+        assert rows == [(1, 4), (3, 4)]  # Product 1 now 2 + 2, product 3 set
+        mock_db.commit.assert_called_once()
+        mock_summary.assert_called_once_with(mock_db, 1)
+
+    @patch('app.services.cart.cart_availability')
+    @patch('app.services.cart.hold_stock', return_value=[2])
+    @patch('app.services.cart.get_cart_summary')
+    def test_batch_rolls_back_when_a_line_lacks_stock(self, mock_summary, mock_hold, mock_availability):
+        """Test nothing is applied when any line can't be held, and the error names it"""
+        from fastapi import HTTPException
+        from app.services.cart import update_cart
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.return_value = 1
+        mock_db.execute.return_value.all.return_value = []
+        product = Mock(available=1)
+        product.name = "Oat Milk"
+        mock_availability.return_value = {2: product}
+
+        with pytest.raises(HTTPException) as exc_info:
+            update_cart(mock_db, "test-user-123", self._operations(("add", 1, 1), ("add", 2, 3)))
+
+        assert exc_info.value.status_code == 400
+        assert exc_info.value.detail == "Not enough stock for 'Oat Milk'. Available: 1, Requested: 3"
+        mock_db.rollback.assert_called_once()
+        mock_db.commit.assert_not_called()
+        mock_summary.assert_not_called()
+
+    @patch('app.services.cart.cart_availability', return_value={})
+    @patch('app.services.cart.hold_stock', return_value=[999])
+    @patch('app.services.cart.get_cart_summary')
+    def test_batch_unknown_product_is_not_found(self, mock_summary, mock_hold, mock_availability):
+        """Test a batch naming a product that doesn't exist fails with 404"""
+        from fastapi import HTTPException
+        from app.services.cart import update_cart
+        mock_db = Mock()
+        mock_db.execute.return_value.scalar.return_value = 1
+        mock_db.execute.return_value.all.return_value = []
+
+        with pytest.raises(HTTPException) as exc_info:
+            update_cart(mock_db, "test-user-123", self._operations(("set", 999, 1)))
+
+        assert exc_info.value.status_code == 404
+        assert "999" in exc_info.value.detail
+
+    def test_summary_totals_from_one_query(self):
+        """Test line totals, item count and average sustainability come from the single summary query"""
+        from app.services.cart import get_cart_summary
+
+        def line(product_id, price, quantity, rating):
+            return Mock(cart_id=1, user_id="test-user-123", product_id=product_id, price=Decimal(price),
+                        quantity=quantity, line_total=Decimal(price) * quantity, sustainability_rating=Decimal(rating),
+                        image_url=None)
+
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [line(1, "10.50", 2, "70.0"), line(2, "5.00", 1, "0")]
+
+        summary = get_cart_summary(mock_db, 1)
+
+        mock_db.execute.assert_called_once()
+        assert summary["item_count"] == 3
+        assert summary["total_amount"] == 26.0
+        assert summary["average_sustainability"] == 35.0
+        assert [item["line_total"] for item in summary["items"]] == [21.0, 5.0]
+
+    def test_summary_rates_lines_like_the_ecometer(self):
+        """Test lines are rated with the weighted product score, unrated products counting as 30"""
+        from sqlalchemy import literal
+        from app.models.product import Product as ProductModel
+        from app.services.cart import get_cart_summary, UNRATED_CART_SUSTAINABILITY
+
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [Mock(cart_id=1, user_id="test-user-123", product_id=None)]
+        with patch('app.services.cart.dynamicSustainabilityScoreSubquery', return_value=literal(None)) as mock_score:
+            get_cart_summary(mock_db, 1)
+
+        mock_score.assert_called_once()
+        assert mock_score.call_args.args[0] is ProductModel.id
+        rating = mock_db.execute.call_args.args[0].selected_columns.sustainability_rating.element
+        assert rating.name == "coalesce"
+        assert rating.clauses.clauses[1].value == UNRATED_CART_SUSTAINABILITY == 30
+
+    def test_summary_of_empty_cart(self):
+        """Test an empty cart still reports its id with zero totals"""
+        from app.services.cart import get_cart_summary
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [Mock(cart_id=1, user_id="test-user-123", product_id=None)]
+
+        summary = get_cart_summary(mock_db, 1)
+
+        assert summary == {"id": 1, "user_id": "test-user-123", "items": [], "item_count": 0,
+                           "total_amount": 0.0, "average_sustainability": 0.0}
\ No newline at end of file
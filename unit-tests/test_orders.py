@@ -4,6 +4,7 @@ import pytest
 from unittest.mock import Mock, patch
 from decimal import Decimal
 from datetime import datetime
+from types import SimpleNamespace
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -134,9 +135,8 @@ class TestOrderServices:
         assert result["message"] == "Success"
         assert result["orders"] == []
     
-    @patch('app.services.orders_service.fetchSustainabilityRatings')
-    @patch('app.services.orders_service.fetchProductImages')
-    def test_fetch_order_by_id_success(self, mock_fetch_images, mock_fetch_ratings):
+    @patch('app.services.orders_service.fetchSustainabilityRatingsForProducts')
+    def test_fetch_order_by_id_success(self, mock_fetch_ratings):
         """Test fetching a specific order by ID"""
         mock_db = Mock()
         
@@ -168,8 +168,7 @@ class TestOrderServices:
         mock_db.query.return_value.filter.return_value.first.return_value = None
         
         # Mock external service calls
-        mock_fetch_images.return_value = []
-        mock_fetch_ratings.return_value = []
+        mock_fetch_ratings.return_value = {}
         
         # The service should raise HTTPException for order not found
         with pytest.raises(Exception) as exc_info:
@@ -383,3 +382,703 @@ class TestOrderBusinessLogic:
         # Orders from last week
         week_orders = [o for o in orders if o.created_at >= last_week]
         assert len(week_orders) == 3
+
+class TestOrderSustainabilitySummary:
+    """Test the per-order sustainability rollup hooks"""
+
+    @patch('app.services.orders_service.take_cart_holds', return_value={})
+    @patch('app.services.orders_service.add_order_lines')
+    @patch('app.services.orders_service.Order')
+    @patch('app.services.orders_service.enqueue_order_confirmation')
+    @patch('app.services.orders_service.record_order_summary')
+    def test_create_order_records_summary_before_commit(self, mock_record, mock_enqueue, mock_order_model,
+                                                        mock_add_lines, mock_take_holds):
+        """Test createOrder writes the summary in the same transaction as the order"""
+        import asyncio
+        from app.services.orders_service import createOrder
+
+        mock_db = Mock()
+        mock_user = Mock(id="user-123")
+        mock_product = Mock(quantity=5)
+        mock_db.query.return_value.filter.return_value.first.side_effect = [mock_user, None, mock_product]
+        mock_db.query.return_value.filter.return_value.all.return_value = [Mock(product_id=1, quantity=2)]
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [1]
+        mock_db.execute.return_value.all.return_value = [Mock(id=1, price=Decimal("10.00"), retailer_id=3)]
+
+        calls = []
+        mock_db.flush.side_effect = lambda: calls.append("flush")
+        mock_record.side_effect = lambda db, order: calls.append("summary")
+        mock_add_lines.side_effect = lambda db, order, quantities, products: calls.append("lines")
+        mock_enqueue.side_effect = lambda db, order: calls.append("outbox")
+        mock_db.commit.side_effect = lambda: calls.append("commit")
+
+        mock_request = Mock()
+        mock_request.userID = "user-123"
+        mock_request.cartID = 1
+
+        result = asyncio.run(createOrder(mock_request, mock_db))
+
+        assert result["status"] == 201
+        mock_record.assert_called_once()
+        assert calls == ["flush", "lines", "summary", "outbox", "commit"]
+        assert mock_order_model.call_args.kwargs["total_amount"] == Decimal("20.00")
+
+    @patch('app.services.orders_service.transition_order')
+    def test_cancel_order_goes_through_state_machine(self, mock_transition):
+        """Test a customer cancellation is a validated transition, which also flags the summary"""
+        from app.services.orders_service import cancellOrder
+
+        mock_db = Mock()
+        mock_order = Mock(id=7, state="Preparing Order")
+        mock_db.query.return_value.filter.return_value.first.return_value = mock_order
+
+        mock_request = Mock()
+        mock_request.orderID = 7
+        mock_request.userID = "user-123"
+
+        result = cancellOrder(mock_request, mock_db)
+
+        assert result["order_id"] == 7
+        mock_transition.assert_called_once_with(mock_db, 7, "Cancelled")
+
+    @patch('app.services.admin_overview_services.transition_order')
+    def test_admin_state_change_goes_through_state_machine(self, mock_transition):
+        """Test admin state changes are validated transitions instead of direct writes"""
+        from app.services.admin_overview_services import change_order_state
+
+        mock_db = Mock()
+
+        result = change_order_state(Mock(order_id=9, state="Delivered"), mock_db)
+
+        assert result["status"] == 200
+        mock_transition.assert_called_once_with(mock_db, 9, "Delivered")
+        mock_db.query.assert_not_called()
+
+    def test_record_summary_failure_does_not_fail_order(self):
+        """Test a failed summary write only rolls back its savepoint"""
+        from app.services.order_summary_service import record_order_summary
+
+        mock_db = Mock()
+        mock_savepoint = Mock()
+        mock_db.begin_nested.return_value = mock_savepoint
+        mock_db.query.side_effect = Exception("relation does not exist")
+
+        result = record_order_summary(mock_db, Mock(id=1, cart_id=1))
+
+        assert result is None
+        mock_savepoint.rollback.assert_called_once()
+        mock_db.rollback.assert_not_called()
+
+
+class TestOrderEventLoopOffload:
+    """createOrder must not run the synchronous Session on the event loop"""
+
+    @patch('app.services.orders_service.take_cart_holds', return_value={})
+    @patch('app.services.orders_service.add_order_lines')
+    @patch('app.services.orders_service.Order')
+    @patch('app.services.orders_service.enqueue_order_confirmation')
+    @patch('app.services.orders_service.record_order_summary')
+    def test_create_order_keeps_loop_responsive(self, mock_record, mock_enqueue, mock_order_model, mock_add_lines,
+                                                mock_take_holds, loop_stall):
+        """Test slow order queries and commits do not stall other requests"""
+        import time
+        from conftest import LOOP_STALL_THRESHOLD
+        from app.services.orders_service import createOrder
+
+        mock_db = Mock()
+        mock_user = Mock(id="user-123")
+        mock_product = Mock(quantity=5)
+        mock_db.query.return_value.filter.return_value.first.side_effect = [mock_user, None, mock_product]
+        mock_db.query.return_value.filter.return_value.all.return_value = [Mock(product_id=1, quantity=2)]
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [1]
+        mock_db.execute.return_value.all.return_value = [Mock(id=1, price=Decimal("10.00"), retailer_id=3)]
+        mock_db.commit.side_effect = lambda: time.sleep(0.1)
+
+        mock_request = Mock()
+        mock_request.userID = "user-123"
+        mock_request.cartID = 1
+
+        result, stall = loop_stall(lambda: createOrder(mock_request, mock_db))
+
+        assert result["status"] == 201
+        mock_enqueue.assert_called_once()
+        assert stall < LOOP_STALL_THRESHOLD
+
+
+class TestCheckoutStockDecrement:
+    """createOrder takes stock with one conditional update in the order's transaction"""
+
+    def _checkout_db(self, cart_items, decremented_ids):
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.side_effect = [Mock(id="user-123"), None]
+        mock_db.query.return_value.filter.return_value.all.return_value = cart_items
+        mock_db.execute.return_value.scalars.return_value.all.return_value = decremented_ids
+        mock_db.execute.return_value.all.return_value = [
+            Mock(id=product_id, price=Decimal("10.00"), retailer_id=3) for product_id in {item.product_id for item in cart_items}
+        ]
+        return mock_db
+
+    def _request(self):
+        mock_request = Mock()
+        mock_request.userID = "user-123"
+        mock_request.cartID = 1
+        return mock_request
+
+    @patch('app.services.orders_service.take_cart_holds', return_value={})
+    @patch('app.services.orders_service.add_order_lines')
+    @patch('app.services.orders_service.Order')
+    @patch('app.services.orders_service.enqueue_order_confirmation')
+    @patch('app.services.orders_service.record_order_summary')
+    def test_stock_taken_in_single_transaction(self, mock_record, mock_enqueue, mock_order_model, mock_add_lines,
+                                               mock_take_holds):
+        """Test cart size does not change the number of statements or commits"""
+        import asyncio
+        from app.services.orders_service import createOrder
+        cart_items = [Mock(product_id=product_id, quantity=1) for product_id in (9, 4, 7, 4)]
+        mock_db = self._checkout_db(cart_items, [4, 7, 9])
+
+        result = asyncio.run(createOrder(self._request(), mock_db))
+
+        assert result["status"] == 201
+        assert mock_db.execute.call_count == 3  # Row locks, one conditional UPDATE, cart marked ordered
+        mock_db.commit.assert_called_once()
+
+    def test_lock_order_and_quantities_merged_per_product(self):
+        """Test products are locked in id order, repeated lines are summed and the locked rows are returned"""
+        from app.services.orders_service import _decrement_stock
+        from app.services.order_line_service import requested_quantities
+        mock_db = Mock()
+        locked = [Mock(id=3, price=Decimal("4.00"), retailer_id=1), Mock(id=8, price=Decimal("9.50"), retailer_id=2)]
+        mock_db.execute.return_value.all.return_value = locked
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [3, 8]
+
+        quantities = requested_quantities([Mock(product_id=8, quantity=1), Mock(product_id=3, quantity=2),
+                                           Mock(product_id=8, quantity=4)])
+        products = _decrement_stock(mock_db, quantities)
+
+        assert quantities == {8: 5, 3: 2}
+        assert products == {3: locked[0], 8: locked[1]}
+        lock_stmt, update_stmt = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert lock_stmt._for_update_arg is not None
+        assert [str(clause) for clause in lock_stmt._order_by_clauses] == ["products.id"]
+        conditions = [str(clause) for clause in update_stmt._where_criteria]
+        assert conditions == [
+            "products.id = demand.product_id",
+            "(products.quantity - products.reserved_quantity) + demand.held >= demand.requested"
+        ]
+        assert update_stmt._where_criteria[0].right.table._data == ([(3, 2, 0), (8, 5, 0)],)
+        assert {str(column) for column in update_stmt._values} == {
+            "products.quantity", "products.in_stock", "products.reserved_quantity"
+        }
+
+    def test_cart_holds_converted_into_decrement(self):
+        """Test held units count as available to the order and leave the reserved counter, even without a line"""
+        from app.services.orders_service import _decrement_stock
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [Mock(id=3), Mock(id=6)]
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [3]  # Product 6 was deleted
+
+        _decrement_stock(mock_db, {3: 2}, {3: 2, 6: 1})
+
+        update_stmt = mock_db.execute.call_args_list[-1][0][0]
+        assert update_stmt._where_criteria[0].right.table._data == ([(3, 2, 2), (6, 0, 1)],)
+
+    @patch('app.services.orders_service.take_cart_holds', return_value={1: 2})
+    @patch('app.services.orders_service._decrement_stock')
+    @patch('app.services.orders_service.add_order_lines')
+    @patch('app.services.orders_service.Order')
+    @patch('app.services.orders_service.enqueue_order_confirmation')
+    @patch('app.services.orders_service.record_order_summary')
+    def test_checkout_takes_the_carts_holds(self, mock_record, mock_enqueue, mock_order_model, mock_add_lines,
+                                           mock_decrement, mock_take_holds):
+        """Test checkout passes the cart's holds to the stock decrement"""
+        import asyncio
+        from app.services.orders_service import createOrder
+        mock_db = self._checkout_db([Mock(product_id=1, quantity=2)], [1])
+        mock_decrement.return_value = {1: Mock(price=Decimal("10.00"))}
+
+        asyncio.run(createOrder(self._request(), mock_db))
+
+        mock_take_holds.assert_called_once_with(mock_db, 1)
+        mock_decrement.assert_called_once_with(mock_db, {1: 2}, {1: 2})
+
+    @patch('app.services.orders_service.take_cart_holds', return_value={})
+    @patch('app.services.orders_service.add_order_lines')
+    @patch('app.services.orders_service.Order')
+    @patch('app.services.orders_service.enqueue_order_confirmation')
+    @patch('app.services.orders_service.record_order_summary')
+    def test_insufficient_stock_rejects_whole_order(self, mock_record, mock_enqueue, mock_order_model,
+                                                    mock_add_lines, mock_take_holds):
+        """Test a short product fails checkout with 409 and nothing is committed"""
+        import asyncio
+        from fastapi import HTTPException
+        from app.services.orders_service import createOrder
+        cart_items = [Mock(product_id=1, quantity=2), Mock(product_id=2, quantity=5)]
+        mock_db = self._checkout_db(cart_items, [1])
+
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(createOrder(self._request(), mock_db))
+
+        assert exc_info.value.status_code == 409
+        assert "[2]" in exc_info.value.detail
+        mock_db.add.assert_not_called()
+        mock_db.commit.assert_not_called()
+        mock_db.rollback.assert_called_once()
+        mock_enqueue.assert_not_called()
+
+
+class TestOrderEmailOutbox:
+    """Order emails are queued with the order and sent by the outbox worker"""
+
+    @patch('app.services.orders_service.take_cart_holds', return_value={})
+    @patch('app.services.orders_service.add_order_lines')
+    @patch('app.services.orders_service.Order')
+    @patch('app.services.orders_service.record_order_summary')
+    @patch('app.services.order_email_outbox.OrderEmailOutbox')
+    @patch('app.services.order_email_outbox.email_service')
+    def test_create_order_returns_without_sending(self, mock_email_service, mock_outbox_model, mock_record,
+                                                   mock_order_model, mock_add_lines, mock_take_holds):
+        """Test checkout only adds the outbox row and never calls the email service"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.orders_service import createOrder
+
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.side_effect = [Mock(id="user-123"), None]
+        mock_db.query.return_value.filter.return_value.all.return_value = [Mock(product_id=1, quantity=2)]
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [1]
+        mock_db.execute.return_value.all.return_value = [Mock(id=1, price=Decimal("10.00"), retailer_id=3)]
+        mock_email_service.send_order_confirmation = AsyncMock()
+
+        result = asyncio.run(createOrder(Mock(userID="user-123", cartID=1), mock_db))
+
+        assert result["status"] == 201
+        mock_outbox_model.assert_called_once_with(order_id=mock_order_model.return_value.id, kind="order_confirmation")
+        mock_db.add.assert_any_call(mock_outbox_model.return_value)
+        mock_email_service.send_order_confirmation.assert_not_called()
+
+    @patch('app.services.order_email_outbox.record_attempt', return_value="sent")
+    @patch('app.services.order_email_outbox.load_order_confirmation')
+    @patch('app.services.order_email_outbox.claim_due_emails', return_value=[(5, 42, 1, "order_confirmation")])
+    def test_worker_delivers_to_file_sink(self, mock_claim, mock_load, mock_record, tmp_path):
+        """Test a claimed email is rendered, written by the file sink and marked sent"""
+        import asyncio
+        import json
+        from app.services.email_service import email_service, FileEmailSink
+        from app.services.order_email_outbox import process_due_emails
+
+        mock_load.return_value = {
+            "customer_email": "shopper@example.com",
+            "customer_name": "Shopper",
+            "order_data": {"order_id": 42, "items": [], "total_amount": 0.0, "average_sustainability": 0.0}
+        }
+        mock_db = Mock()
+
+        with patch.object(email_service, "ses_client", FileEmailSink(str(tmp_path))):
+            totals = asyncio.run(process_due_emails(mock_db))
+
+        assert totals == {"claimed": 1, "sent": 1, "retrying": 0, "failed": 0}
+        [message_file] = list(tmp_path.glob("*.json"))
+        message = json.loads(message_file.read_text())
+        assert message["Destination"] == {"ToAddresses": ["shopper@example.com"]}
+        assert "#42" in message["Message"]["Subject"]["Data"]
+        mock_record.assert_called_once_with(mock_db, 5, 1, None, True)
+
+    @patch('app.services.order_email_outbox.fetchSustainabilityRatingsForProducts', return_value={3: 80.0, 8: 40.0})
+    def test_confirmation_renders_the_checkout_snapshot(self, mock_ratings):
+        """Test the email shows the prices and total paid at checkout, loaded with one lines query"""
+        from app.services.order_email_outbox import load_order_confirmation
+
+        order = Mock(id=42, user_id="user-1", state="Preparing Order", created_at=datetime(2025, 3, 9, 10, 0),
+                     total_amount=Decimal("17.50"))
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.side_effect = [order, Mock(email="a@b.c", name="Ann")]
+        mock_db.execute.return_value.all.return_value = [
+            SimpleNamespace(product_id=3, quantity=2, unit_price=Decimal("4.00"), name="Tote", image_url="t.png"),
+            SimpleNamespace(product_id=8, quantity=1, unit_price=Decimal("9.50"), name="Cup", image_url=None),
+        ]
+
+        data = load_order_confirmation(mock_db, 42)["order_data"]
+
+        mock_db.execute.assert_called_once()
+        mock_ratings.assert_called_once_with({3, 8}, mock_db)
+        assert [(item["name"], item["price"], item["sustainability_rating"]) for item in data["items"]] == [
+            ("Tote", 4.0, 80.0), ("Cup", 9.5, 40.0)
+        ]
+        assert data["total_amount"] == 17.5
+        assert data["average_sustainability"] == 60.0
+
+    @patch('app.services.order_email_outbox.load_order_confirmation', side_effect=Exception("connection reset"))
+    @patch('app.services.order_email_outbox.claim_due_emails', return_value=[(5, 42, 2, "order_confirmation"), (6, 43, 6, "order_confirmation")])
+    def test_failures_retry_with_backoff_until_attempts_run_out(self, mock_claim, mock_load):
+        """Test a failed send is rescheduled with a growing delay and finally left as failed"""
+        import asyncio
+        from app.services.order_email_outbox import process_due_emails, retry_delay, OUTBOX_MAX_ATTEMPTS
+
+        mock_db = Mock()
+        totals = asyncio.run(process_due_emails(mock_db))
+
+        assert totals == {"claimed": 2, "sent": 0, "retrying": 1, "failed": 1}
+        assert OUTBOX_MAX_ATTEMPTS == 6
+        retry_stmt, failed_stmt = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert {str(column) for column in retry_stmt._values} == {"order_email_outbox.next_attempt_at",
+                                                                   "order_email_outbox.last_error"}
+        assert {str(column) for column in failed_stmt._values} == {"order_email_outbox.status",
+                                                                    "order_email_outbox.last_error"}
+        assert mock_db.rollback.call_count == 2
+        assert [retry_delay(attempts) for attempts in (1, 2, 3, 8)] == [30, 60, 120, 3600]
+
+    @patch('app.services.order_email_outbox.record_attempt', return_value="failed")
+    @patch('app.services.order_email_outbox.load_order_confirmation', return_value=None)
+    @patch('app.services.order_email_outbox.claim_due_emails', return_value=[(5, 42, 1, "order_confirmation")])
+    def test_missing_recipient_is_not_retried(self, mock_claim, mock_load, mock_record):
+        """Test an order without a customer email fails at once instead of retrying"""
+        import asyncio
+        from app.services.order_email_outbox import process_due_emails
+
+        mock_db = Mock()
+        totals = asyncio.run(process_due_emails(mock_db))
+
+        assert totals["failed"] == 1
+        assert mock_record.call_args[0][4] is False
+
+    @patch('app.services.order_email_outbox.record_attempt', return_value="sent")
+    @patch('app.services.order_email_outbox.load_order_confirmation')
+    @patch('app.services.order_email_outbox.load_order_status_update')
+    @patch('app.services.order_email_outbox.claim_due_emails', return_value=[(5, 42, 1, "order_status_update")])
+    def test_status_update_rows_send_status_email(self, mock_claim, mock_load_status, mock_load_confirmation,
+                                                  mock_record):
+        """Test an order_status_update row is rendered with the status email, not the confirmation"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.order_email_outbox import process_due_emails, email_service
+
+        mock_load_status.return_value = {"customer_email": "shopper@example.com", "customer_name": "Shopper",
+                                         "order_id": "42", "status": "In Transit"}
+        with patch.object(email_service, "send_order_status_update", AsyncMock(return_value=True)) as mock_send:
+            totals = asyncio.run(process_due_emails(Mock()))
+
+        assert totals["sent"] == 1
+        mock_send.assert_awaited_once_with(**mock_load_status.return_value)
+        mock_load_confirmation.assert_not_called()
+
+
+class TestOrderStateMachine:
+    """Order state changes are validated, compare-and-set transitions applied in bulk"""
+
+    def _db(self, *results):
+        mock_db = Mock()
+        mock_db.execute.side_effect = [Mock(**{"all.return_value": rows}) for rows in results]
+        return mock_db
+
+    @patch('app.services.order_state_service.wake_outbox_worker')
+    @patch('app.services.order_state_service.OrderStateEvent')
+    def test_bulk_transition_reports_every_order(self, mock_event_model, mock_wake):
+        """Test one UPDATE per source state moves the allowed orders and every other order gets its reason"""
+        from app.services.order_state_service import transition_orders
+        mock_event_model.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+        mock_db = self._db(
+            [(1, "Preparing Order"), (2, "Preparing Order"), (3, "Delivered"), (4, "Ready for Delivery")],
+            [SimpleNamespace(id=1, user_id="user-1")],  # Order 2 was cancelled after it was read
+            [(2, "Cancelled"), (3, "Delivered"), (4, "Ready for Delivery")]
+        )
+        handler = Mock()
+
+        with patch('app.services.order_state_service._state_handlers', [handler]):
+            result = transition_orders(mock_db, [1, 2, 3, 4, 5, 1], "Ready for Delivery")
+
+        assert result["transitioned"] == 1
+        assert [(o["order_id"], o["outcome"]) for o in result["outcomes"]] == [
+            (1, "transitioned"), (2, "invalid_transition"), (3, "invalid_transition"), (4, "unchanged"), (5, "not_found")
+        ]
+        update_stmt = mock_db.execute.call_args_list[1][0][0]
+        assert update_stmt.is_update
+        assert [str(clause) for clause in update_stmt._where_criteria] == ["orders.id = ANY (:param_1)",
+                                                                          "orders.state = :state_1"]
+        assert update_stmt._where_criteria[0].right.element.value == [1, 2]
+        assert update_stmt._where_criteria[1].right.value == "Preparing Order"
+        [event] = handler.call_args[0][1]
+        assert (event.order_id, event.from_state, event.to_state) == (1, "Preparing Order", "Ready for Delivery")
+        mock_db.add_all.assert_called_once_with([event])
+        mock_db.commit.assert_called_once()
+        mock_wake.assert_called_once()
+
+    @patch('app.services.order_state_service.wake_outbox_worker')
+    @patch('app.services.order_state_service.OrderStateEvent')
+    def test_from_state_skips_the_read_and_reports_conflicts(self, mock_event_model, mock_wake):
+        """Test a from_state transition is a single UPDATE, and orders no longer in it are conflicts"""
+        from app.services.order_state_service import transition_orders
+        mock_event_model.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+        mock_db = self._db([SimpleNamespace(id=7, user_id="user-1")], [(8, "Ready for Delivery")])
+
+        with patch('app.services.order_state_service._state_handlers', []):
+            result = transition_orders(mock_db, [7, 8], "Cancelled", from_state="Preparing Order")
+
+        assert [o["outcome"] for o in result["outcomes"]] == ["transitioned", "conflict"]
+        assert mock_db.execute.call_args_list[0][0][0].is_update
+
+    def test_disallowed_from_state_writes_nothing(self):
+        """Test a transition the machine does not allow never reaches an UPDATE"""
+        from app.services.order_state_service import transition_orders
+        mock_db = self._db([(7, "Delivered")])
+
+        result = transition_orders(mock_db, [7], "Preparing Order", from_state="Delivered")
+
+        assert result["outcomes"] == [{"order_id": 7, "outcome": "invalid_transition", "state": "Delivered"}]
+        assert not mock_db.execute.call_args[0][0].is_update
+        mock_db.add_all.assert_not_called()
+
+    def test_shipped_orders_can_be_cancelled_as_returns(self):
+        """Test orders in transit or delivered can still be cancelled, which is how returns are recorded"""
+        from app.services.order_state_service import can_transition
+
+        assert can_transition("In Transit", "Cancelled") is True
+        assert can_transition("Delivered", "Cancelled") is True
+        assert can_transition("Delivered", "In Transit") is False
+        assert can_transition("Cancelled", "Delivered") is False
+
+    def test_unknown_state_rejected(self):
+        """Test a state outside the machine is a 400"""
+        from fastapi import HTTPException
+        from app.services.order_state_service import transition_orders
+
+        with pytest.raises(HTTPException) as exc_info:
+            transition_orders(Mock(), [1], "Lost")
+
+        assert exc_info.value.status_code == 400
+
+    @patch('app.services.order_state_service.OrderStateEvent')
+    def test_handler_failure_rolls_back_transitions(self, mock_event_model):
+        """Test the transitions are undone when a consumer fails inside the transaction"""
+        from app.services.order_state_service import transition_orders
+        mock_db = self._db([(1, "In Transit")], [SimpleNamespace(id=1, user_id="user-1")])
+        handler = Mock(side_effect=Exception("outbox unavailable"))
+
+        with patch('app.services.order_state_service._state_handlers', [handler]):
+            with pytest.raises(Exception):
+                transition_orders(mock_db, [1], "Delivered")
+
+        mock_db.rollback.assert_called_once()
+        mock_db.commit.assert_not_called()
+
+    @patch('app.services.order_state_service.transition_orders')
+    def test_single_transition_errors(self, mock_transition):
+        """Test one-order changes map not_found to 404 and a refused transition to 409"""
+        from fastapi import HTTPException
+        from app.services.order_state_service import transition_order
+
+        mock_transition.return_value = {"outcomes": [{"order_id": 1, "outcome": "not_found", "state": None}]}
+        with pytest.raises(HTTPException) as exc_info:
+            transition_order(Mock(), 1, "Delivered")
+        assert exc_info.value.status_code == 404
+
+        mock_transition.return_value = {"outcomes": [{"order_id": 1, "outcome": "invalid_transition", "state": "Delivered"}]}
+        with pytest.raises(HTTPException) as exc_info:
+            transition_order(Mock(), 1, "Preparing Order")
+        assert exc_info.value.status_code == 409
+
+    @patch('app.services.order_state_service.enqueue_order_status_updates')
+    @patch('app.services.order_state_service.set_order_summaries_cancelled')
+    def test_default_handlers(self, mock_set_cancelled, mock_enqueue):
+        """Test cancellations and reinstatements reach the summaries and every transition queues an email"""
+        from app.services.order_state_service import _mirror_cancellations, _queue_status_emails
+        mock_db = Mock()
+        events = [
+            SimpleNamespace(order_id=1, from_state="Preparing Order", to_state="Cancelled"),
+            SimpleNamespace(order_id=2, from_state="Cancelled", to_state="Preparing Order"),
+            SimpleNamespace(order_id=3, from_state="In Transit", to_state="Delivered"),
+        ]
+
+        _mirror_cancellations(mock_db, events)
+        _queue_status_emails(mock_db, events)
+
+        assert mock_set_cancelled.call_args_list == [((mock_db, [1], True),), ((mock_db, [2], False),)]
+        mock_enqueue.assert_called_once_with(mock_db, [1, 2, 3])
+
+    def test_bulk_summary_cancellation(self):
+        """Test summaries are flagged with one UPDATE and only changed ones adjust the forecast state"""
+        from app.services.order_summary_service import set_order_summaries_cancelled
+        changed = [SimpleNamespace(user_id="user-1", order_created_at=datetime(2026, 3, 1), avg_sustainability=70.0)]
+        mock_db = self._db(changed)
+
+        with patch('app.services.order_summary_service.record_order_event') as mock_event:
+            set_order_summaries_cancelled(mock_db, [1, 2], True)
+
+        assert mock_db.execute.call_args_list[0][0][0].is_update
+        mock_event.assert_called_once_with(mock_db, "user-1", datetime(2026, 3, 1), 70.0, -1)
+
+
+class TestOrderDetailQueries:
+    """fetchOrderById assembles the order detail from one joined item query and one rating lookup"""
+
+    @patch('app.services.orders_service.fetchSustainabilityRatingsForProducts')
+    def test_order_detail_from_joined_rows(self, mock_fetch_ratings):
+        """Test items keep cart order, repeat products stay separate lines and ratings come from one call"""
+        from app.services.orders_service import fetchOrderById
+
+        mock_db = Mock()
+        mock_order = Mock(id=1, cart_id=3)
+        mock_db.query.return_value.filter.return_value.first.side_effect = [mock_order, Mock(id=3)]
+        product_a, product_b = Mock(id=10), Mock(id=20)
+        mock_db.execute.return_value.all.return_value = [
+            (product_b, 2, "b.png"), (product_a, 1, None), (product_b, 3, "b.png")
+        ]
+        mock_fetch_ratings.return_value = {10: 40.0, 20: 70.5}
+
+        result = fetchOrderById(Mock(orderID=1, userID="user-123"), mock_db)
+
+        mock_db.execute.assert_called_once()
+        mock_fetch_ratings.assert_called_once_with({10, 20}, mock_db)
+        assert result["order"] is mock_order
+        assert result["products"] == [product_b, product_a, product_b]
+        assert result["images"] == ["b.png", None, "b.png"]
+        assert result["quantities"] == [2, 1, 3]
+        assert result["rating"] == [70.5, 40.0, 70.5]
+        assert result["average_sustainability"] == Decimal(round((70.5 + 40.0 + 70.5) / 3, 2))
+
+    @patch('app.services.sustainabilityRatings_service.joinedload')
+    def test_bulk_ratings_match_single_product_scores(self, mock_joinedload):
+        """Test the bulk lookup scores each product like fetchSustainabilityRatings and defaults to 0.0"""
+        from app.services.sustainabilityRatings_service import fetchSustainabilityRatingsForProducts
+
+        def stat(product_id, type_name, value):
+            return Mock(product_id=product_id, value=Decimal(value), type_info=Mock(type_name=type_name))
+
+        mock_db = Mock()
+        mock_db.query.return_value.options.return_value.filter.return_value.all.return_value = [
+            stat(1, "carbon_footprint", "80"), stat(1, "durability", "40"), stat(2, "recyclability", "55.5")
+        ]
+
+        ratings = fetchSustainabilityRatingsForProducts({1, 2, 3}, mock_db)
+
+        mock_db.query.assert_called_once()
+        expected_first = round((80 * 1.3 + 40 * 1.0) / 2.3, 1)
+        assert ratings == {1: expected_first, 2: 55.5, 3: 0.0}
+
+
+class TestOrderHistory:
+    """fetchOrderHistory pages a user's orders with their totals from one grouped query"""
+
+    def _row(self, order_id, created_at):
+        values = {"id": order_id, "cart_id": order_id, "state": "Delivered", "created_at": created_at,
+                  "item_count": 2, "total_amount": Decimal("30.00"), "average_sustainability": Decimal("55.50")}
+        return Mock(_mapping=values, **values)
+
+    def test_page_with_next_cursor(self):
+        """Test one query fills a page and the extra row only produces the cursor"""
+        from app.services.orders_service import fetchOrderHistory, _decode_order_cursor
+
+        created = [datetime(2025, 3, day) for day in (9, 8, 8)]
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [self._row(order_id, created_at)
+                                                         for order_id, created_at in zip((12, 11, 10), created)]
+
+        result = fetchOrderHistory(Mock(userID="user-123", limit=2, cursor=None), mock_db)
+
+        mock_db.execute.assert_called_once()
+        assert [order["id"] for order in result["orders"]] == [12, 11]
+        assert result["orders"][0]["total_amount"] == Decimal("30.00")
+        assert _decode_order_cursor(result["next_cursor"]) == (datetime(2025, 3, 8), 11)
+
+    def test_last_page_has_no_cursor(self):
+        """Test a page shorter than the limit ends the history"""
+        from app.services.orders_service import fetchOrderHistory, _encode_order_cursor
+
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [self._row(3, datetime(2025, 1, 2))]
+
+        result = fetchOrderHistory(
+            Mock(userID="user-123", limit=500, cursor=_encode_order_cursor(datetime(2025, 1, 5), 4)), mock_db
+        )
+
+        assert len(result["orders"]) == 1
+        assert result["next_cursor"] is None
+
+    def test_invalid_cursor_rejected(self):
+        """Test a cursor that does not decode is a 400, not a server error"""
+        from fastapi import HTTPException
+        from app.services.orders_service import fetchOrderHistory
+
+        with pytest.raises(HTTPException) as exc_info:
+            fetchOrderHistory(Mock(userID="user-123", limit=20, cursor="not-a-cursor"), Mock())
+
+        assert exc_info.value.status_code == 400
+
+    def test_total_is_the_checkout_snapshot(self):
+        """Test the total is read from orders.total_amount, so a later price change does not alter it"""
+        from app.models.orders import Order as OrderModel
+        from app.services.orders_service import fetchOrderHistory
+
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = []
+        fetchOrderHistory(Mock(userID="user-123", limit=20, cursor=None), mock_db)
+
+        total = mock_db.execute.call_args.args[0].selected_columns.total_amount.element
+        snapshot = total.clauses.clauses[0]
+        assert OrderModel.__table__.c.total_amount in snapshot.proxy_set
+
+    def test_line_rating_uses_weighted_product_score(self):
+        """Test each line is rated with the type-weighted score the order detail page shows, not a raw average"""
+        from sqlalchemy import literal
+        from app.models.product import Product as ProductModel
+        from app.services.orders_service import fetchOrderHistory
+
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = []
+        with patch('app.services.orders_service.dynamicSustainabilityScoreSubquery',
+                   return_value=literal(42.0)) as mock_score:
+            fetchOrderHistory(Mock(userID="user-123", limit=20, cursor=None), mock_db)
+
+        mock_score.assert_called_once()
+        assert mock_score.call_args.args[0] is ProductModel.id
+
+
+class TestOrderLineSnapshots:
+    """Checkout snapshots each product's quantity and price paid"""
+
+    @patch('app.services.order_line_service.OrderLine')
+    def test_lines_and_total_use_locked_prices(self, mock_order_line):
+        """Test one line per product at the locked price, and the order total from the same prices"""
+        from app.services.order_line_service import add_order_lines, order_total
+
+        mock_db = Mock()
+        products = {3: Mock(price=Decimal("4.00"), retailer_id=1), 8: Mock(price=None, retailer_id=2)}
+        quantities = {8: 5, 3: 2}
+
+        add_order_lines(mock_db, Mock(id=77), quantities, products)
+
+        assert order_total(quantities, products) == Decimal("8.00")
+        assert [call.kwargs for call in mock_order_line.call_args_list] == [
+            {"order_id": 77, "product_id": 3, "retailer_id": 1, "quantity": 2, "unit_price": Decimal("4.00")},
+            {"order_id": 77, "product_id": 8, "retailer_id": 2, "quantity": 5, "unit_price": Decimal("0")}
+        ]
+        mock_db.add_all.assert_called_once()
+
+    def test_retailer_product_revenue_from_snapshots(self):
+        """Test units sold and revenue come from one grouped snapshot query, not current prices"""
+        from app.services.retailer_products_services import fetchRetailerProducts
+
+        product = Mock(id=5, price=Decimal("99.00"))
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.return_value = [product]
+        sales_query = mock_db.query.return_value.join.return_value.filter.return_value.group_by.return_value
+        sales_query.all.return_value = [Mock(product_id=5, units_sold=3, revenue=Decimal("30.00"))]
+
+        with patch('app.services.retailer_products_services.fetchRetailerProductImages', return_value=[]), \
+             patch('app.services.retailer_products_services.fetchSustainabilityRatings', return_value={"rating": 0}):
+            [enriched] = fetchRetailerProducts(1, mock_db)
+
+        assert enriched["units_sold"] == 3
+        assert enriched["revenue"] == 30.0
+
+    def test_product_sales_exclude_only_cancelled_orders(self):
+        """Test product sales count every order that is not cancelled, like the other revenue aggregates"""
+        from app.services.order_line_service import get_product_sales
+
+        mock_db = Mock()
+        sales_query = mock_db.query.return_value.join.return_value
+        sales_query.filter.return_value.one.return_value = (4, Decimal("38.00"))
+
+        assert get_product_sales(mock_db, 5) == (4, 38.0)
+        criteria = [str(criterion) for criterion in sales_query.filter.call_args.args]
+        assert "orders.state != :state_1" in criteria
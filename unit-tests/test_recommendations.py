@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import uuid
 from datetime import datetime, date
 from fastapi import HTTPException
@@ -438,4 +438,510 @@ class TestRecommendationMockServices:
         # Invalid feedback type
         result = mock_record_feedback(None, user_id, 123, "invalid_type")
         assert result["status"] == 400
-        assert "Invalid feedback type" in result["message"]
\ No newline at end of file
+        assert "Invalid feedback type" in result["message"]
+
+class TestOpenAIRequestCoalescing:
+    """Unit tests for single-flight coalescing in the OpenAI service"""
+
+    def _mock_completion(self, content):
+        response = MagicMock()
+        response.choices = [MagicMock()]
+        response.choices[0].message.content = content
+        return response
+
+    def test_concurrent_identical_prompts_share_one_call(self):
+        """Test that concurrent identical prompts trigger a single upstream call"""
+        import asyncio
+        from app.services.openai_service import OpenAISustainabilityService, SingleFlight, ResponseCache
+
+        service = OpenAISustainabilityService("test-key")
+        completion = self._mock_completion("Shared answer")
+
+        async def slow_create(**kwargs):
+            await asyncio.sleep(0.05)
+            return completion
+
+        messages = [{"role": "user", "content": "Explain product 1"}]
+
+        async def run_callers():
+            return await asyncio.gather(*[service._make_openai_request(messages) for _ in range(5)])
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()) as flight, \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch.object(service.client.chat.completions, 'create', side_effect=slow_create) as mock_create:
+            results = asyncio.run(run_callers())
+            metrics = flight.get_metrics()
+
+        assert results == ["Shared answer"] * 5
+        assert mock_create.call_count == 1
+        assert metrics["upstream_calls"] == 1
+        assert metrics["coalesced_calls"] == 4
+        assert metrics["dedup_ratio"] == 0.8
+        assert metrics["in_flight"] == 0
+
+    def test_different_prompts_are_not_coalesced(self):
+        """Test that distinct prompts each get their own upstream call"""
+        import asyncio
+        from app.services.openai_service import OpenAISustainabilityService, SingleFlight, ResponseCache
+
+        service = OpenAISustainabilityService("test-key")
+        completion = self._mock_completion("Answer")
+
+        async def run_callers():
+            return await asyncio.gather(
+                service._make_openai_request([{"role": "user", "content": "Product 1"}]),
+                service._make_openai_request([{"role": "user", "content": "Product 2"}]),
+            )
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()) as flight, \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch.object(service.client.chat.completions, 'create', new=AsyncMock(return_value=completion)) as mock_create:
+            asyncio.run(run_callers())
+
+        assert mock_create.call_count == 2
+        assert flight.get_metrics()["coalesced_calls"] == 0
+
+
+class TestCombinedExplanation:
+    """Unit tests for the single-call structured /explain mode"""
+
+    def _mock_completion(self, content):
+        response = MagicMock()
+        response.choices = [MagicMock()]
+        response.choices[0].message.content = content
+        return response
+
+    def _product(self):
+        return {"id": 1, "name": "Bamboo Toothbrush", "price": 4.99, "sustainability_rating": 82.0}
+
+    def test_single_call_splits_structured_response(self):
+        """Test that one structured completion is split into the 4 explanation fields"""
+        import asyncio
+        import json
+        from app.services.openai_service import OpenAISustainabilityService, SingleFlight, ResponseCache
+
+        service = OpenAISustainabilityService("test-key")
+        service.smart_logger = Mock()
+        answers = {
+            "why_recommended": "Matches your history.",
+            "sustainability_analysis": "Sustainability score: 82.0/100.",
+            "alternatives_comparison": "Compared with three options.",
+            "ecometer_impact": "Positive impact, product 82.0/100."
+        }
+        create = AsyncMock(return_value=self._mock_completion(json.dumps(answers)))
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            results = asyncio.run(service.get_comprehensive_explanation("user-1", self._product(), {}))
+
+        assert results == answers
+        assert create.call_count == 1
+        assert create.call_args.kwargs["response_format"]["type"] == "json_schema"
+
+    def test_parse_failure_falls_back_to_separate_calls(self):
+        """Test that an unparseable combined response falls back to the 4-call path"""
+        import asyncio
+        from app.services.openai_service import OpenAISustainabilityService, SingleFlight, ResponseCache
+
+        service = OpenAISustainabilityService("test-key")
+        service.smart_logger = Mock()
+        create = AsyncMock(side_effect=[self._mock_completion("not json")] +
+                           [self._mock_completion("Separate answer")] * 4)
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            results = asyncio.run(service.get_comprehensive_explanation("user-1", self._product(), {}))
+
+        assert create.call_count == 5
+        assert set(results.values()) == {"Separate answer"}
+
+    def test_request_failure_is_templated_without_separate_calls(self):
+        """Test that no combined response (here an open breaker) templates the sections instead of 4 more calls"""
+        import asyncio
+        from app.services.openai_service import (
+            OpenAISustainabilityService, SingleFlight, ResponseCache, CircuitBreaker, EXPLANATION_KEYS,
+            templated_explanation
+        )
+
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure()
+        service = OpenAISustainabilityService("test-key")
+        service.smart_logger = Mock()
+        create = AsyncMock()
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch('app.services.openai_service._circuit_breaker', breaker), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            results = asyncio.run(service.get_comprehensive_explanation("user-1", self._product(), {}))
+
+        assert create.call_count == 0
+        assert results == {key: templated_explanation(key, self._product(), {}) for key in EXPLANATION_KEYS}
+        assert service.degraded is True
+
+    def test_parse_rejects_missing_fields(self):
+        """Test that combined responses missing an answer are rejected"""
+        from app.services.openai_service import OpenAISustainabilityService
+
+        service = OpenAISustainabilityService("test-key")
+        assert service._parse_combined_explanation('{"why_recommended": "Only one"}') is None
+        assert service._parse_combined_explanation('["not", "an", "object"]') is None
+        assert service._parse_combined_explanation(None) is None
+
+
+
+class TestExplanationStreaming:
+    """Unit tests for streamed OpenAI explanations"""
+
+    def _stream(self, *deltas):
+        async def chunks():
+            for delta in deltas:
+                chunk = MagicMock()
+                chunk.choices = [MagicMock()]
+                chunk.choices[0].delta.content = delta
+                yield chunk
+        return chunks()
+
+    def _collect(self, iterator):
+        import asyncio
+
+        async def run():
+            return [item async for item in iterator]
+        return asyncio.run(run())
+
+    def test_stream_forwards_deltas_then_replays_cache(self):
+        """Test that token deltas are forwarded and a cache hit replays as one complete chunk"""
+        from app.services.openai_service import OpenAISustainabilityService, SingleFlight, ResponseCache
+
+        service = OpenAISustainabilityService("test-key")
+        service.smart_logger = Mock()
+        product = {"id": 1, "name": "Bamboo Toothbrush", "price": 4.99, "sustainability_rating": 82.0}
+        create = AsyncMock(return_value=self._stream("High ", "sustainability", None))
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            first = self._collect(service.stream_section("user-1", "sustainability_analysis", product))
+            second = self._collect(service.stream_section("user-1", "sustainability_analysis", product))
+
+        assert first == [("High ", False, "gpt-5-nano"), ("sustainability", False, "gpt-5-nano")]
+        assert second == [("High sustainability", True, "gpt-5-nano")]
+        assert create.call_count == 1
+        assert create.call_args.kwargs["stream"] is True
+
+    def test_identical_concurrent_streams_share_one_upstream_stream(self):
+        """Test that a stream leads the in-flight call and identical requests get its final text"""
+        import asyncio
+        from app.services.openai_service import OpenAISustainabilityService, SingleFlight, ResponseCache
+
+        product = {"id": 1, "name": "Bamboo Toothbrush", "price": 4.99, "sustainability_rating": 82.0}
+        services = [OpenAISustainabilityService("test-key") for _ in range(3)]
+        for service in services:
+            service.smart_logger = Mock()
+
+        async def slow_stream():
+            for delta in ("High ", "sustainability"):
+                await asyncio.sleep(0.01)
+                chunk = MagicMock()
+                chunk.choices = [MagicMock()]
+                chunk.choices[0].delta.content = delta
+                yield chunk
+
+        create = AsyncMock(side_effect=lambda **kwargs: slow_stream())
+
+        async def collect(service):
+            return [item async for item in service.stream_section("user-1", "sustainability_analysis", product)]
+
+        async def run_callers():
+            return await asyncio.gather(*[collect(service) for service in services])
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()) as flight, \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch('openai.resources.chat.completions.AsyncCompletions.create', new=create):
+            leader, *followers = asyncio.run(run_callers())
+
+        assert create.call_count == 1
+        assert leader == [("High ", False, "gpt-5-nano"), ("sustainability", False, "gpt-5-nano")]
+        assert followers == [[("High sustainability", True, "gpt-5-nano")]] * 2
+        assert flight.get_metrics()["coalesced_calls"] == 2
+        assert all(service.last_model_used is None for service in services)
+
+    def test_failed_stream_counts_once_against_the_breaker(self):
+        """Test that a stream failing before its first token, then its fallback, is one breaker failure"""
+        from app.services.openai_service import (
+            OpenAISustainabilityService, SingleFlight, ResponseCache, CircuitBreaker
+        )
+
+        service = OpenAISustainabilityService("test-key", budget_seconds=0.5)
+        service.smart_logger = Mock()
+        product = {"id": 1, "name": "Bamboo Toothbrush", "price": 4.99, "sustainability_rating": 82.0}
+        create = AsyncMock(side_effect=Exception("connection reset"))
+        breaker = CircuitBreaker(failure_threshold=2)
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch('app.services.openai_service._circuit_breaker', breaker), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            self._collect(service.stream_section("user-1", "sustainability_analysis", product))
+
+        assert create.call_count == 2  # The stream, then one non-streaming attempt
+        assert breaker.get_state()["consecutive_failures"] == 1
+        assert breaker.get_state()["state"] == "closed"
+
+    def test_comprehensive_stream_covers_all_sections(self):
+        """Test that each /explain section is streamed independently"""
+        from app.services.openai_service import (
+            OpenAISustainabilityService, SingleFlight, ResponseCache, EXPLANATION_KEYS
+        )
+
+        service = OpenAISustainabilityService("test-key")
+        service.smart_logger = Mock()
+        product = {"id": 2, "name": "Hemp Tote", "price": 12.0, "sustainability_rating": 55.0}
+        create = AsyncMock(side_effect=lambda **kwargs: self._stream("Part one. ", "Part two."))
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            items = self._collect(service.stream_comprehensive_explanation("user-1", product, {}))
+
+        sections = {}
+        for item in items:
+            sections.setdefault(item["section"], []).append(item["text"])
+
+        assert set(sections) == set(EXPLANATION_KEYS)
+        assert all("".join(parts) == "Part one. Part two." for parts in sections.values())
+        assert create.call_count == 4
+
+
+class TestSustainabilityAnalysisPregeneration:
+    """Unit tests for the offline Q2 analysis batch job"""
+
+    def _products(self):
+        return [
+            {"id": 1, "name": "Bamboo Toothbrush", "description": "Compostable handle", "price": 4.99,
+             "brand": "EcoBrush", "sustainability_rating": 82.0, "category_name": "Beauty", "retailer_name": "Green"},
+            {"id": 2, "name": "Plastic Bottle", "description": "Single use", "price": 1.5,
+             "brand": "Generic", "sustainability_rating": 21.0, "category_name": "Food", "retailer_name": "Green"},
+        ]
+
+    def test_only_changed_products_are_regenerated(self):
+        """Test that products with an unchanged content hash are skipped"""
+        import asyncio
+        from app.services.sustainability_analysis_service import (
+            analysis_content_hash, generate_analyses, StubAnalysisModel
+        )
+
+        products = self._products()
+        stored_hashes = {1: analysis_content_hash(products[0]), 2: "outdated-hash"}
+        model = StubAnalysisModel()
+
+        rows, counts = asyncio.run(generate_analyses(products, stored_hashes, model, concurrency=2))
+
+        assert counts == {"fresh": 1, "generated": 1, "failed": 0}
+        assert model.calls == 1
+        assert rows[0]["product_id"] == 2
+        assert rows[0]["content_hash"] == analysis_content_hash(products[1])
+        assert "Sustainability score: 21.0/100" in rows[0]["analysis"]
+        assert rows[0]["model_used"] == "local-stub"
+
+    def test_content_hash_tracks_description_and_rating(self):
+        """Test that description or rating changes invalidate the stored analysis"""
+        from app.services.sustainability_analysis_service import analysis_content_hash
+
+        product = self._products()[0]
+        original = analysis_content_hash(product)
+
+        assert analysis_content_hash(dict(product)) == original
+        assert analysis_content_hash({**product, "description": "New description"}) != original
+        assert analysis_content_hash({**product, "sustainability_rating": 75.0}) != original
+
+    def test_stored_analysis_served_only_when_hash_matches(self):
+        """Test that a stale stored analysis is not served"""
+        from app.services.sustainability_analysis_service import analysis_content_hash, get_stored_analysis
+
+        product = self._products()[0]
+        stored = Mock(content_hash=analysis_content_hash(product), analysis="Stored text")
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.first.return_value = stored
+
+        assert get_stored_analysis(mock_db, product) == "Stored text"
+        assert get_stored_analysis(mock_db, {**product, "description": "Changed"}) is None
+
+    def test_failed_generations_are_counted_and_back_off(self):
+        """Test that failures are reported and trigger rate limiter backoff"""
+        import asyncio
+        from app.services.sustainability_analysis_service import generate_analyses, RateLimiter
+
+        model = Mock()
+        model.sustainability_analysis = AsyncMock(side_effect=Exception("rate limited"))
+        limiter = RateLimiter()
+
+        rows, counts = asyncio.run(generate_analyses(self._products()[:1], {}, model, rate_limiter=limiter))
+
+        assert rows == []
+        assert counts["failed"] == 1
+        assert limiter.backoff == 1.0
+
+
+class TestOpenAIDegradedMode:
+    """Unit tests for latency budgets, the circuit breaker and templated fallbacks"""
+
+    def _product(self):
+        return {"id": 3, "name": "Solar Charger", "price": 30.0, "sustainability_rating": 65.0}
+
+    def test_budget_stops_retries(self):
+        """Test that retries stop once the latency budget would be exceeded"""
+        import asyncio
+        import time
+        from app.services.openai_service import (
+            OpenAISustainabilityService, SingleFlight, ResponseCache, CircuitBreaker
+        )
+
+        service = OpenAISustainabilityService("test-key", budget_seconds=0.5)
+        create = AsyncMock(side_effect=Exception("connection reset"))
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch('app.services.openai_service._circuit_breaker', CircuitBreaker()), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            started = time.monotonic()
+            result = asyncio.run(service._make_openai_request([{"role": "user", "content": "Hi"}]))
+            elapsed = time.monotonic() - started
+
+        assert result is None
+        assert create.call_count == 1
+        assert elapsed < 0.5
+        assert "timeout" in create.call_args.kwargs
+
+    def test_open_breaker_returns_templated_answer(self):
+        """Test that an open breaker skips OpenAI and answers from the algorithmic reasoning"""
+        import asyncio
+        from app.services.openai_service import (
+            OpenAISustainabilityService, SingleFlight, ResponseCache, CircuitBreaker, TEMPLATE_MODEL
+        )
+
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_failure()
+        service = OpenAISustainabilityService("test-key")
+        service.smart_logger = Mock()
+        create = AsyncMock()
+        reasoning = {"final_recommendation_score": 7.5, "sustainability_score": 6.5,
+                     "reasoning_factors": ["High sustainability rating"]}
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', ResponseCache()), \
+                patch('app.services.openai_service._circuit_breaker', breaker), \
+                patch.object(service.client.chat.completions, 'create', new=create):
+            answer = asyncio.run(service.why_recommended("user-1", self._product(), reasoning))
+
+        assert create.call_count == 0
+        assert breaker.get_state()["state"] == "open"
+        assert "7.5/10" in answer and "High sustainability rating" in answer
+        assert service.degraded is True
+        assert service.last_model_used == TEMPLATE_MODEL
+
+    def test_health_check_is_never_served_from_cache(self):
+        """Test that /ai-health calls OpenAI every time, so an outage shows up right after a success"""
+        import asyncio
+        from app.routes.recommendations import ai_health_check
+        from app.services.openai_service import SingleFlight, ResponseCache, CircuitBreaker
+
+        reply = MagicMock()
+        reply.choices = [MagicMock()]
+        reply.choices[0].message.content = "AI connectivity confirmed."
+        create = AsyncMock(side_effect=[reply, Exception("401 invalid api key")])
+        cache = ResponseCache()
+
+        with patch('app.services.openai_service._inflight_requests', SingleFlight()), \
+                patch('app.services.openai_service._response_cache', cache), \
+                patch('app.services.openai_service._circuit_breaker', CircuitBreaker()), \
+                patch.dict('app.services.openai_service.LATENCY_BUDGETS', {"ai_health": 0.5}), \
+                patch('openai.resources.chat.completions.AsyncCompletions.create', new=create):
+            healthy = asyncio.run(ai_health_check())
+            failing = asyncio.run(ai_health_check())
+
+        assert healthy["status"] == 200 and healthy["snippet"] == "AI connectivity confirmed."
+        assert failing["status"] == 500 and failing["message"] == "AI connectivity failed"
+        assert create.call_count == 2
+        assert cache._entries == {}
+
+    def test_breaker_half_open_probe_closes_on_success(self):
+        """Test that a successful probe after the reset timeout closes the breaker"""
+        from app.services.openai_service import CircuitBreaker
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        assert breaker.allow_request() is True
+        assert breaker.state == "half_open"
+        assert breaker.allow_request() is False  # Only one probe at a time
+
+        breaker.record_success()
+        assert breaker.get_state()["state"] == "closed"
+        assert breaker.allow_request() is True
+
+    def test_templated_explanations_are_deterministic(self):
+        """Test that every section has a stable templated answer"""
+        from app.services.openai_service import templated_explanation, EXPLANATION_KEYS
+
+        product = self._product()
+        for section in EXPLANATION_KEYS:
+            assert templated_explanation(section, product, {}) == templated_explanation(section, product, {})
+        assert templated_explanation("sustainability_analysis", product) == \
+            "Sustainability score: 65.0/100. Solar Charger has a moderate sustainability level."
+        assert templated_explanation("alternatives_comparison", product).startswith(
+            "Solar Charger scores 65.0/100 for sustainability, a moderate level. "
+        )
+        assert templated_explanation("ecometer_impact", product).startswith(
+            "Positive impact: this product scores 65.0/100 for sustainability. "
+        )
+
+
+class TestRecommendationEventLoopOffload:
+    """Recommendation handlers must not run the synchronous Session on the event loop"""
+
+    def test_recommend_endpoint_keeps_loop_responsive(self, loop_stall):
+        """Test engine queries for /recommend run on the blocking pool"""
+        import time
+        from conftest import LOOP_STALL_THRESHOLD
+        from app.routes.recommendations import get_recommendations
+
+        def slow_recommendations(user_id, limit):
+            time.sleep(0.2)
+            return [Mock(to_dict=Mock(return_value={"product_id": i})) for i in range(6)]
+
+        mock_engine = Mock()
+        mock_engine.get_fast_recommendations.side_effect = slow_recommendations
+
+        with patch('app.routes.recommendations.get_recommendation_engine', return_value=mock_engine):
+            result, stall = loop_stall(lambda: get_recommendations("user-1", db=Mock()))
+
+        assert result["metadata"]["count"] == 6
+        assert stall < LOOP_STALL_THRESHOLD
+
+    def test_product_lookup_keeps_loop_responsive(self, loop_stall):
+        """Test the product fetch and stored analysis lookup for Q2 run on the blocking pool"""
+        import time
+        from conftest import LOOP_STALL_THRESHOLD
+        from app.routes.recommendations import sustainability_analysis
+
+        def slow_fetch(request, db):
+            time.sleep(0.2)
+            product = Mock(description="", price=10.0, brand="Brand")
+            product.name = "Bamboo Brush"
+            return {"status": 200, "data": product, "sustainability": {"rating": 80.0}}
+
+        def slow_analysis(db, product_data):
+            time.sleep(0.2)
+            return "Stored analysis"
+
+        with patch('app.routes.recommendations.fetchProduct', side_effect=slow_fetch), \
+             patch('app.routes.recommendations.get_stored_analysis', side_effect=slow_analysis):
+            result, stall = loop_stall(lambda: sustainability_analysis("user-1", 5, db=Mock()))
+
+        assert result["answer"] == "Stored analysis"
+        assert stall < LOOP_STALL_THRESHOLD
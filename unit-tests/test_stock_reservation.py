@@ -0,0 +1,219 @@
+import os
+import threading
+import uuid
+import pytest
+from unittest.mock import Mock, patch
+from types import SimpleNamespace
+
+from app.services.stock_reservation import (
+    hold_stock, take_cart_holds, release_expired_holds, _adjust_reserved
+)
+
+
+def _change_rows(stmt):
+    """(product_id, delta) rows of a reserved_quantity UPDATE"""
+    return stmt._where_criteria[0].right.table._data[0]
+
+
+class TestStockHolds:
+    """Test holds and the reserved_quantity counter"""
+
+    def test_hold_reserves_only_the_difference(self):
+        """Test raising a held line reserves the extra units with one conditional UPDATE"""
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [(4, 2)]  # The cart already holds 2 of product 4
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [4]
+
+        short = hold_stock(mock_db, 1, {4: 5})
+
+        assert short == []
+        lookup, reserve, upsert = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert lookup._for_update_arg is not None
+        assert _change_rows(reserve) == [(4, 3)]
+        assert upsert._post_values_clause is not None  # Hold upserted with a fresh expiry
+        mock_db.commit.assert_not_called()
+
+    def test_negative_target_releases_only_what_is_held(self):
+        """Test a target below zero releases the cart's hold and no more"""
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [(4, 2)]
+        mock_db.execute.return_value.scalars.return_value.all.return_value = []
+
+        short = hold_stock(mock_db, 1, {4: -5})
+
+        assert short == []
+        lookup, release, delete_hold = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert _change_rows(release) == [(4, -2)]
+        assert delete_hold.is_delete
+
+    @patch('app.services.stock_reservation.release_expired_holds')
+    def test_short_product_retried_after_lazy_expiry(self, mock_release):
+        """Test a product that can't be held has its expired holds released, then is tried once more"""
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = []
+        mock_db.execute.return_value.scalars.return_value.all.side_effect = [[], [7]]
+        mock_release.return_value = 2
+
+        short = hold_stock(mock_db, 1, {7: 1})
+
+        assert short == []
+        mock_release.assert_called_once_with(mock_db, product_ids=[7], other_than_cart_id=1)
+
+    @patch('app.services.stock_reservation.release_expired_holds')
+    def test_short_product_is_reported_without_writing_holds(self, mock_release):
+        """Test nothing is written when the product still can't be held"""
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = []
+        mock_db.execute.return_value.scalars.return_value.all.return_value = []
+        mock_release.return_value = 0
+
+        short = hold_stock(mock_db, 1, {7: 1})
+
+        assert short == [7]
+        assert mock_db.execute.call_count == 2  # Hold lookup and the failed reservation only
+
+    def test_release_never_short(self):
+        """Test releasing a hold succeeds even if its product is gone"""
+        mock_db = Mock()
+        mock_db.execute.return_value.scalars.return_value.all.return_value = []
+
+        assert _adjust_reserved(mock_db, {3: -2}) == []
+
+    def test_multi_product_changes_lock_in_id_order(self):
+        """Test products are locked in id order before a multi-row counter update"""
+        mock_db = Mock()
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [2, 9]
+
+        _adjust_reserved(mock_db, {9: 1, 2: -1})
+
+        lock, reserve = [call[0][0] for call in mock_db.execute.call_args_list]
+        assert [str(clause) for clause in lock._order_by_clauses] == ["products.id"]
+        assert _change_rows(reserve) == [(2, -1), (9, 1)]
+
+    def test_take_cart_holds_sums_per_product(self):
+        """Test checkout receives the held quantity per product from one DELETE ... RETURNING"""
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [(3, 2), (5, 1)]
+
+        assert take_cart_holds(mock_db, 1) == {3: 2, 5: 1}
+        assert mock_db.execute.call_args[0][0].is_delete
+
+    def test_expired_holds_return_units_to_stock(self):
+        """Test released holds give their units back to each product's counter"""
+        mock_db = Mock()
+        mock_db.execute.return_value.all.return_value = [(3, 2), (3, 1), (5, 4)]
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [3, 5]
+
+        released = release_expired_holds(mock_db)
+
+        assert released == 3
+        reserve = mock_db.execute.call_args_list[-1][0][0]
+        assert _change_rows(reserve) == [(3, -3), (5, -4)]
+
+
+STRESS_DATABASE_URL = os.getenv("STOCK_STRESS_DATABASE_URL")
+
+
+@pytest.mark.skipif(not STRESS_DATABASE_URL, reason="set STOCK_STRESS_DATABASE_URL to a Postgres database to run")
+class TestStockReservationStress:
+    """Concurrent carts contending for one product against a real Postgres (tables live in a throwaway schema)"""
+
+    STOCK = 40
+    SHOPPERS = 24
+
+    @pytest.fixture
+    def session_factory(self):
+        import app.main  # noqa: F401 (loads every model)
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.orm import sessionmaker
+        from app.db.database import Base
+
+        schema = f"stock_stress_{uuid.uuid4().hex[:8]}"
+        admin = create_engine(STRESS_DATABASE_URL, isolation_level="AUTOCOMMIT")
+        with admin.connect() as connection:
+            connection.execute(text(f"CREATE SCHEMA {schema}"))
+        engine = create_engine(STRESS_DATABASE_URL, pool_size=self.SHOPPERS, max_overflow=4,
+                               connect_args={"options": f"-csearch_path={schema}"})
+        Base.metadata.create_all(engine, tables=[t for name, t in Base.metadata.tables.items() if name != "donations"])
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"INSERT INTO products (id, name, price, quantity, in_stock) VALUES (1, 'Flash sale', 5, {self.STOCK}, true)"
+            ))
+            for shopper in range(self.SHOPPERS):
+                connection.execute(text(f"INSERT INTO users (id, email) VALUES ('shopper-{shopper}', 's{shopper}@test')"))
+        try:
+            yield sessionmaker(bind=engine)
+        finally:
+            engine.dispose()
+            with admin.connect() as connection:
+                connection.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            admin.dispose()
+
+    def _in_parallel(self, work):
+        start = threading.Barrier(self.SHOPPERS)
+        results = [None] * self.SHOPPERS
+
+        def run(shopper):
+            start.wait()
+            results[shopper] = work(shopper)
+
+        threads = [threading.Thread(target=run, args=(shopper,)) for shopper in range(self.SHOPPERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_contended_adds_and_checkouts_never_oversell(self, session_factory):
+        """Test holds never exceed stock, held carts always check out, and the counter matches the holds"""
+        from fastapi import HTTPException
+        from sqlalchemy import text
+        from app.schemas.cart import CartItemCreate
+        from app.services import cart as cart_service
+        from app.services.orders_service import _place_order
+
+        def add_repeatedly(shopper):
+            db = session_factory()
+            held = 0
+            try:
+                for _ in range(3):
+                    try:
+                        line = cart_service.add_item(db, f"shopper-{shopper}", CartItemCreate(product_id=1, quantity=1))
+                        held = line["quantity"]
+                    except HTTPException as e:
+                        assert e.status_code == 400
+                return held
+            finally:
+                db.close()
+
+        held = self._in_parallel(add_repeatedly)
+
+        db = session_factory()
+        quantity, reserved = db.execute(text("SELECT quantity, reserved_quantity FROM products WHERE id = 1")).one()
+        holds = db.execute(text("SELECT coalesce(sum(quantity), 0) FROM stock_holds")).scalar()
+        lines = db.execute(text("SELECT coalesce(sum(quantity), 0) FROM cart_items")).scalar()
+        db.close()
+        assert sum(held) == self.STOCK  # Demand (72 units) exceeds stock, so all of it ends up held
+        assert reserved == holds == lines == self.STOCK
+        assert quantity == self.STOCK
+
+        def checkout(shopper):
+            if not held[shopper]:
+                return None
+            db = session_factory()
+            try:
+                cart_id = cart_service.get_cart(db, f"shopper-{shopper}").id
+                return _place_order(SimpleNamespace(userID=f"shopper-{shopper}", cartID=cart_id), db).id
+            finally:
+                db.close()
+
+        orders = self._in_parallel(checkout)
+
+        db = session_factory()
+        quantity, reserved = db.execute(text("SELECT quantity, reserved_quantity FROM products WHERE id = 1")).one()
+        sold = db.execute(text("SELECT coalesce(sum(quantity), 0) FROM order_lines")).scalar()
+        db.close()
+        assert all(order is not None for shopper, order in enumerate(orders) if held[shopper])
+        assert sold == self.STOCK
+        assert quantity == 0
+        assert reserved == 0